@@ -0,0 +1,202 @@
+"""FAISS index construction and search-time knobs.
+
+All indices use inner product on L2-normalized vectors (cosine similarity),
+matching the IndexFlatIP the notebook builds. Index types:
+
+  flat       exact brute-force scan (IndexFlatIP)
+  ivf_flat   inverted lists over a coarse k-means quantizer; tune ``nprobe``
+  ivf_pq     inverted lists + product-quantized codes (compact); tune ``nprobe``
+  hnsw       graph index; tune ``ef_search``
+
+``recall_at_k`` compares any index against the exact flat result so the
+speed/recall trade-off can be picked per catalog; ``set_search_defaults``
+stores the picked nprobe / efSearch in the index file so the server uses them.
+
+The optional fused index stores sqrt(alpha) * image ⊕ sqrt(1 - alpha) * text
+per item (see ``fused_vectors``). Its inner product with a query built the same
+way is alpha * image_sim + (1 - alpha) * text_sim, the fused score of /search.
+"""
+import time
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+try:
+    import faiss
+except Exception:
+    faiss = None
+
+INDEX_TYPES = ('flat', 'ivf_flat', 'ivf_pq', 'hnsw')
+
+
+def default_nlist(n: int) -> int:
+    # ~4*sqrt(n) lists, with at least ~39 training points per list
+    return int(max(1, min(4 * int(np.sqrt(max(n, 1))), n // 39 or 1)))
+
+
+FUSED_LAYOUT = ('image', 'text')
+
+
+def fused_vectors(image_rows: np.ndarray, text_rows: np.ndarray, alpha: float) -> np.ndarray:
+    """Concatenate normalized image and text rows weighted so inner product gives the fused score."""
+    return np.ascontiguousarray(np.hstack([np.sqrt(alpha) * np.asarray(image_rows, dtype=np.float32),
+                                           np.sqrt(1.0 - alpha) * np.asarray(text_rows, dtype=np.float32)]),
+                                dtype=np.float32)
+
+
+def make_index(d: int, index_type: str = 'flat', n: Optional[int] = None, nlist: Optional[int] = None,
+               pq_m: int = 16, pq_nbits: int = 8, hnsw_m: int = 32, ef_construction: int = 200):
+    """Create an empty (possibly untrained) inner-product index."""
+    if index_type == 'flat':
+        return faiss.IndexFlatIP(d)
+    if index_type in ('ivf_flat', 'ivf_pq'):
+        nlist = nlist or default_nlist(n or 0)
+        quantizer = faiss.IndexFlatIP(d)
+        if index_type == 'ivf_flat':
+            index = faiss.IndexIVFFlat(quantizer, d, nlist, faiss.METRIC_INNER_PRODUCT)
+        else:
+            if d % pq_m != 0:
+                raise ValueError(f'pq_m={pq_m} must divide the embedding dimension {d}')
+            index = faiss.IndexIVFPQ(quantizer, d, nlist, pq_m, pq_nbits, faiss.METRIC_INNER_PRODUCT)
+        return index
+    if index_type == 'hnsw':
+        index = faiss.IndexHNSWFlat(d, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = ef_construction
+        return index
+    raise ValueError(f'unknown index type {index_type!r}; expected one of {INDEX_TYPES}')
+
+
+def train_index(index, sample: np.ndarray):
+    if not index.is_trained:
+        index.train(np.ascontiguousarray(sample, dtype=np.float32))
+
+
+def build_index(vecs: np.ndarray, index_type: str = 'flat', train_size: int = 100000, seed: int = 42,
+                holdout: Optional[np.ndarray] = None, **params):
+    """Build and fill an index from normalized vectors.
+
+    Rows in ``holdout`` (e.g. recall benchmark queries) are excluded from training.
+    """
+    vecs = np.ascontiguousarray(vecs, dtype=np.float32)
+    index = make_index(vecs.shape[1], index_type, n=len(vecs), **params)
+    if not index.is_trained:
+        rng = np.random.default_rng(seed)
+        pool = np.arange(len(vecs))
+        if holdout is not None and len(holdout) < len(vecs):
+            pool = np.setdiff1d(pool, holdout)
+        if len(pool) > train_size:
+            pool = np.sort(rng.choice(pool, train_size, replace=False))
+        train_index(index, vecs[pool])
+    index.add(vecs)
+    return index
+
+
+def set_search_defaults(index, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+    """Store nprobe / efSearch in the index itself: write_index saves them and queries without
+    per-call parameters use them (faiss would otherwise default to nprobe=1, efSearch=16)."""
+    if faiss is None or index is None:
+        return index
+    inner = faiss.downcast_index(index.index) if hasattr(index, 'id_map') else faiss.downcast_index(index)
+    if nprobe is not None and hasattr(inner, 'nprobe'):
+        inner.nprobe = int(nprobe)
+    if ef_search is not None and hasattr(inner, 'hnsw'):
+        inner.hnsw.efSearch = int(ef_search)
+    return index
+
+
+def describe(index) -> Dict[str, Any]:
+    if index is None or faiss is None:
+        return {}
+    info: Dict[str, Any] = {'ntotal': int(index.ntotal), 'd': int(index.d)}
+    inner = faiss.downcast_index(index.index) if hasattr(index, 'id_map') else faiss.downcast_index(index)
+    info['type'] = type(inner).__name__
+    if hasattr(inner, 'nlist'):
+        info['nlist'] = int(inner.nlist)
+        info['nprobe'] = int(inner.nprobe)
+    if hasattr(inner, 'hnsw'):
+        info['ef_search'] = int(inner.hnsw.efSearch)
+    return info
+
+
+def search_params(index, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+    """Per-call search parameters (thread-safe; the shared index is not modified)."""
+    if faiss is None or (nprobe is None and ef_search is None):
+        return None
+    inner = faiss.downcast_index(index)
+    if nprobe is not None and hasattr(inner, 'nprobe'):
+        return faiss.SearchParametersIVF(nprobe=int(nprobe))
+    if ef_search is not None and hasattr(inner, 'hnsw'):
+        return faiss.SearchParametersHNSW(efSearch=int(ef_search))
+    return None
+
+
+def search(index, q: np.ndarray, k: int, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+    params = search_params(index, nprobe, ef_search)
+    if params is None:
+        return index.search(q, k)
+    return index.search(q, k, params=params)
+
+
+def _normalize_rows(x: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return x / norms
+
+
+def exact_search(vecs: np.ndarray, q: np.ndarray, k: int, block_size: int = 65536, normalize: bool = False):
+    """Blocked exact inner-product top-k; reads ``vecs`` (e.g. a memmap) one block at a time.
+
+    Each block's scores are cut to their own top k before they are merged with
+    the running best, so only (q, block) scores and (q, 2k) candidates are held.
+    """
+    q = np.ascontiguousarray(q, dtype=np.float32)
+    best_D = np.full((len(q), 0), -np.inf, dtype=np.float32)
+    best_I = np.full((len(q), 0), -1, dtype=np.int64)
+    for start in range(0, len(vecs), block_size):
+        block = np.asarray(vecs[start:start + block_size], dtype=np.float32)
+        if normalize:
+            block = _normalize_rows(block)
+        D = q @ block.T
+        if D.shape[1] > k:
+            part = np.argpartition(-D, k - 1, axis=1)[:, :k]
+            D, I = np.take_along_axis(D, part, axis=1), part + start
+        else:
+            I = np.broadcast_to(np.arange(start, start + D.shape[1]), D.shape)
+        D, I = np.concatenate([best_D, D], axis=1), np.concatenate([best_I, I], axis=1)
+        if D.shape[1] > k:
+            part = np.argpartition(-D, k - 1, axis=1)[:, :k]
+            D, I = np.take_along_axis(D, part, axis=1), np.take_along_axis(I, part, axis=1)
+        best_D, best_I = D, I
+    order = np.argsort(-best_D, axis=1, kind='stable')
+    return np.take_along_axis(best_D, order, axis=1), np.take_along_axis(best_I, order, axis=1)
+
+
+def recall_at_k(index, vecs: np.ndarray, k: int = 10, n_queries: int = 1000, seed: int = 123,
+                nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                query_idxs: Optional[np.ndarray] = None, normalize: bool = False) -> Dict[str, Any]:
+    """recall@k of ``index`` against exact inner-product search, plus per-query latency of both.
+
+    ``vecs`` may be a memmap; set ``normalize`` when it holds raw (unnormalized) embeddings.
+    """
+    if query_idxs is None:
+        rng = np.random.default_rng(seed)
+        query_idxs = rng.choice(len(vecs), size=min(n_queries, len(vecs)), replace=False)
+    q = np.asarray(vecs[np.sort(query_idxs)], dtype=np.float32)
+    if normalize:
+        q = _normalize_rows(q)
+    t0 = time.perf_counter()
+    _, I_exact = exact_search(vecs, q, k, normalize=normalize)
+    t_exact = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    _, I_ann = search(index, q, k, nprobe=nprobe, ef_search=ef_search)
+    t_ann = time.perf_counter() - t0
+    hits = sum(len(np.intersect1d(a[a >= 0], b)) for a, b in zip(I_ann, I_exact))
+    return {
+        'k': int(k),
+        'queries': int(len(q)),
+        'recall': float(hits / (k * len(q))) if len(q) else 0.0,
+        'ann_ms_per_query': 1000.0 * t_ann / max(1, len(q)),
+        'exact_ms_per_query': 1000.0 * t_exact / max(1, len(q)),
+        'nprobe': nprobe,
+        'ef_search': ef_search,
+    }
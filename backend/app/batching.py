@@ -0,0 +1,97 @@
+"""In-process dynamic batching for encoder calls.
+
+Concurrent requests each carry one title or one image. Encoding them one by
+one leaves most of the model's throughput unused, so a MicroBatcher queues
+single items, groups whatever arrives within a short window (up to a maximum
+batch size) and runs one encoder call for the group on a dedicated worker
+thread. Callers get a concurrent.futures.Future per item; async handlers can
+await it with asyncio.wrap_future without blocking the event loop.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Sequence
+
+
+class MicroBatcher:
+    """Collect items for up to ``max_wait_ms`` (or ``max_batch_size`` items) and encode them together.
+
+    ``fn`` takes a list of items and returns a sequence with one output per item.
+    """
+
+    def __init__(self, fn: Callable[[List[Any]], Sequence[Any]], max_batch_size: int = 64,
+                 max_wait_ms: float = 5.0, name: str = 'batcher'):
+        self.fn = fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.name = name
+        self._queue: 'queue.Queue' = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stats = {'batches': 0, 'items': 0, 'max_batch': 0, 'errors': 0, 'busy_s': 0.0}
+
+    def _ensure_worker(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                t = threading.Thread(target=self._run, name=f'{self.name}-worker', daemon=True)
+                t.start()
+                self._thread = t
+
+    def submit(self, item: Any) -> Future:
+        fut: Future = Future()
+        self._ensure_worker()
+        self._queue.put((item, fut))
+        return fut
+
+    def submit_many(self, items: Sequence[Any]) -> List[Future]:
+        return [self.submit(item) for item in items]
+
+    def _collect(self) -> List[Any]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            # drain whatever is already queued, then wait out the window
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = [(item, fut) for item, fut in self._collect() if fut.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            t0 = time.perf_counter()
+            try:
+                outputs = self.fn([item for item, _ in batch])
+                for (_, fut), out in zip(batch, outputs):
+                    fut.set_result(out)
+            except Exception as e:
+                self._stats['errors'] += 1
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+            self._stats['busy_s'] += time.perf_counter() - t0
+            self._stats['batches'] += 1
+            self._stats['items'] += len(batch)
+            self._stats['max_batch'] = max(self._stats['max_batch'], len(batch))
+
+    def stats(self) -> Dict[str, Any]:
+        s = dict(self._stats)
+        s['queued'] = self._queue.qsize()
+        s['mean_batch'] = (s['items'] / s['batches']) if s['batches'] else 0.0
+        s['max_batch_size'] = self.max_batch_size
+        s['max_wait_ms'] = self.max_wait * 1000.0
+        return s
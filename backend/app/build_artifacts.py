@@ -0,0 +1,370 @@
+"""Build the complete siamese_artifacts set the server loads.
+
+Reads the Shopee-style ``train.csv`` (image, title, label_group, ...) plus its
+image folder and writes, into the artifact dir:
+
+  meta.csv              the catalog rows (with an ``image_path`` column, relative to the artifact dir)
+  text_embs.npy         normalized title embeddings (same text model the server queries with)
+  image_embs.npy        normalized OpenCLIP image embeddings
+  faiss_text.index      \
+  faiss_image.index     /  inner-product indices (flat by default, see --index-type)
+  threshold_clf.pkl     logistic duplicate classifier on (image_sim, text_sim, fused_sim)
+  fraud_model/          seller IsolationForest and risk features (when meta has seller_id)
+  manifest.json         models, files (relative to the artifact dir), embedding storage and build stats
+
+Everything is staged in ``<artifact_dir>/.build`` and moved into place at the
+end (manifest.json last), so a running server never sees a half-written set.
+Encoding writes into memmaps and records progress in ``.build/state.json``;
+rerunning after an interruption resumes where it stopped.
+
+JPEG decoding and preprocessing run in DataLoader worker processes while the
+main process runs batched OpenCLIP inference (on at least half of the cores);
+images/sec is reported as it goes.
+Decoding and preprocessing go through image_preprocess, as query images do.
+
+Usage:
+  python -m app.build_index --siamese-artifacts [--image-workers 8] [--image-batch 64]
+"""
+import json
+import os
+import pickle
+import shutil
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .embeddings import DEFAULT_ARTIFACT_DIR, EMBEDDING_NAMES, STORAGE_SUFFIX
+from .fraud_model import FRAUD_MODEL_DIR, build_artifact_fraud_model
+from .image_preprocess import compile_preprocess, open_image
+
+TEXT_MODEL_NAME = 'all-MiniLM-L6-v2'
+IMAGE_MODEL_NAME = 'ViT-B-32'
+IMAGE_MODEL_PRETRAINED = 'openai'
+FUSION_ALPHA = 0.5
+SEED = 42
+
+
+def _read_json(path: str) -> Dict[str, Any]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_json(path: str, obj: Dict[str, Any]):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(obj, f, indent=2)
+    os.replace(tmp, path)
+
+
+class _BuildState:
+    """Per-stage progress in ``.build/state.json``, tied to the source CSV it was started from."""
+
+    def __init__(self, stage_dir: str, source: Dict[str, Any], resume: bool):
+        self.path = os.path.join(stage_dir, 'state.json')
+        state = _read_json(self.path) if resume else {}
+        if state.get('source') != source:
+            state = {'source': source}
+        self.state = state
+
+    def get(self, key: str, default=None):
+        return self.state.get(key, default)
+
+    def set(self, key: str, value):
+        self.state[key] = value
+        _write_json(self.path, self.state)
+
+
+def _open_output(path: str, n: int, d: int, done: int) -> Tuple[np.memmap, int]:
+    """(memmap, rows already written); a missing or differently shaped file starts over at row 0."""
+    if done > 0 and os.path.exists(path):
+        out = np.lib.format.open_memmap(path, mode='r+')
+        if out.shape == (n, d):
+            return out, done
+    return np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(n, d)), 0
+
+
+def _relative_path(path: str, start: str) -> str:
+    """``path`` relative to ``start`` (forward slashes), or absolute when there is no relative path (other drive)."""
+    try:
+        return os.path.relpath(path, start).replace(os.sep, '/')
+    except ValueError:
+        return os.path.abspath(path)
+
+
+def _write_meta(csv_path: str, images_dir: str, out_path: str, chunk_size: int, artifact_dir: str) -> int:
+    n = 0
+    images_rel = _relative_path(images_dir, artifact_dir)
+    with open(out_path, 'w', newline='', encoding='utf-8') as f:
+        for chunk in pd.read_csv(csv_path, chunksize=chunk_size):
+            if 'image_path' not in chunk.columns and 'image' in chunk.columns:
+                chunk['image_path'] = [f'{images_rel}/{v}' for v in chunk['image']]
+            chunk.to_csv(f, header=(n == 0), index=False)
+            n += len(chunk)
+    return n
+
+
+def encode_titles(csv_path: str, out_path: str, n: int, state: _BuildState, chunk_size: int = 8192,
+                  checkpoint_every: int = 4) -> Dict[str, Any]:
+    from sentence_transformers import SentenceTransformer
+    model = SentenceTransformer(TEXT_MODEL_NAME)
+    d = model.get_sentence_embedding_dimension()
+    out, done = _open_output(out_path, n, d, int(state.get('text_rows', 0)))
+
+    row, chunks, encoded = 0, 0, 0
+    t0 = time.perf_counter()
+    for chunk in pd.read_csv(csv_path, usecols=['title'], chunksize=chunk_size):
+        start, row = row, row + len(chunk)
+        if row <= done:
+            continue
+        titles = chunk['title'].fillna('').astype(str).tolist()[done - start:]
+        out[done:row] = model.encode(titles, convert_to_numpy=True, normalize_embeddings=True,
+                                     show_progress_bar=False)
+        encoded += len(titles)
+        done = row
+        chunks += 1
+        if chunks % checkpoint_every == 0:
+            out.flush()
+            state.set('text_rows', done)
+            print(f'  titles {done}/{n} ({encoded / (time.perf_counter() - t0):.0f}/s)')
+    out.flush()
+    state.set('text_rows', done)
+    elapsed = time.perf_counter() - t0
+    return {'dim': int(d), 'titles_per_sec': encoded / elapsed if elapsed > 0 else None}
+
+
+class _ImageFiles:
+    """Map-style dataset: decode + preprocess one image (runs inside DataLoader workers)."""
+
+    def __init__(self, paths, preprocess, offset: int = 0):
+        self.paths = paths
+        self.preprocess = preprocess
+        self.offset = offset
+
+    def __len__(self):
+        return len(self.paths) - self.offset
+
+    def __getitem__(self, i):
+        row = self.offset + i
+        try:
+            return row, self.preprocess(open_image(self.paths[row]))
+        except Exception:
+            return row, None
+
+
+def _collate_images(items):
+    import torch
+    rows = np.array([r for r, _ in items], dtype=np.int64)
+    ok = np.array([t is not None for _, t in items], dtype=bool)
+    tensors = [t for _, t in items if t is not None]
+    return rows, ok, (torch.stack(tensors) if tensors else None)
+
+
+def encode_images(image_paths, out_path: str, state: _BuildState, batch_size: int = 64, workers: Optional[int] = None,
+                  torch_threads: Optional[int] = None, checkpoint_every: int = 20) -> Dict[str, Any]:
+    """Encode images with OpenCLIP; rows whose file is missing or unreadable get a zero vector."""
+    import torch
+    import open_clip
+    cpus = os.cpu_count() or 2
+    if workers is None:
+        workers = max(1, cpus - cpus // 2)
+    # decode workers and intra-op threads share the cores; inference keeps at least half of them
+    torch.set_num_threads(torch_threads or max(1, cpus // 2, cpus - workers))
+    model, _, preprocess = open_clip.create_model_and_transforms(IMAGE_MODEL_NAME, pretrained=IMAGE_MODEL_PRETRAINED)
+    model.eval()
+    preprocess = compile_preprocess(preprocess)
+    d = int(model.visual.output_dim)
+    n = len(image_paths)
+    out, done = _open_output(out_path, n, d, int(state.get('image_rows', 0)))
+    missing = int(state.get('missing_images', 0)) if done else 0
+
+    loader = torch.utils.data.DataLoader(
+        _ImageFiles(image_paths, preprocess, offset=done), batch_size=batch_size, shuffle=False,
+        num_workers=workers, collate_fn=_collate_images, persistent_workers=False,
+        prefetch_factor=4 if workers > 0 else None)
+    t0 = time.perf_counter()
+    infer_s, decoded = 0.0, 0
+    for b, (rows, ok, x) in enumerate(loader):
+        emb = np.zeros((len(rows), d), dtype=np.float32)
+        if x is not None:
+            ti = time.perf_counter()
+            with torch.no_grad():
+                e = model.encode_image(x)
+                e = torch.nn.functional.normalize(e, dim=-1)
+            emb[ok] = e.cpu().numpy()
+            infer_s += time.perf_counter() - ti
+        out[rows[0]:rows[-1] + 1] = emb
+        missing += int((~ok).sum())
+        decoded += int(ok.sum())
+        done = int(rows[-1]) + 1
+        if (b + 1) % checkpoint_every == 0:
+            out.flush()
+            state.set('image_rows', done)
+            state.set('missing_images', missing)
+            print(f'  images {done}/{n} ({decoded / (time.perf_counter() - t0):.1f} images/s, '
+                  f'{missing} missing)')
+    out.flush()
+    state.set('image_rows', done)
+    state.set('missing_images', missing)
+    elapsed = time.perf_counter() - t0
+    stats = {
+        'dim': d,
+        'images_per_sec': decoded / elapsed if elapsed > 0 and decoded else None,
+        'inference_images_per_sec': decoded / infer_s if infer_s > 0 else None,
+        'missing_images': missing,
+        'workers': workers,
+        'torch_threads': torch.get_num_threads(),
+        'batch_size': batch_size,
+    }
+    if stats['images_per_sec']:
+        print(f"  images: {stats['images_per_sec']:.1f}/s end-to-end, "
+              f"{stats['inference_images_per_sec']:.1f}/s in inference, {missing} missing")
+    return stats
+
+
+def _pair_sims(embs: np.ndarray, a: np.ndarray, b: np.ndarray, block: int = 65536) -> np.ndarray:
+    out = np.empty(len(a), dtype=np.float32)
+    for s in range(0, len(a), block):
+        out[s:s + block] = np.einsum('ij,ij->i', np.asarray(embs[a[s:s + block]], dtype=np.float32),
+                                     np.asarray(embs[b[s:s + block]], dtype=np.float32))
+    return out
+
+
+def train_threshold_classifier(text_embs: np.ndarray, image_embs: np.ndarray, labels: np.ndarray,
+                               alpha: float = FUSION_ALPHA, max_pairs: int = 200000, seed: int = SEED) -> Dict[str, Any]:
+    """Logistic classifier on pair similarities, as in the notebook.
+
+    Positives are consecutive rows of each label_group; an equal number of random
+    cross-group pairs are negatives. The threshold maximizes F1 on a held-out split.
+    """
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.metrics import precision_recall_curve, roc_auc_score
+    from sklearn.model_selection import train_test_split
+
+    rng = np.random.default_rng(seed)
+    order = np.argsort(labels, kind='stable')
+    same = labels[order[1:]] == labels[order[:-1]]
+    pos = np.stack([order[:-1][same], order[1:][same]], axis=1)
+    if len(pos) > max_pairs // 2:
+        pos = pos[np.sort(rng.choice(len(pos), max_pairs // 2, replace=False))]
+    if len(pos) == 0:
+        raise ValueError('no label_group has two or more rows; cannot train the duplicate classifier')
+
+    neg = np.empty((0, 2), dtype=np.int64)
+    while len(neg) < len(pos):
+        cand = rng.integers(0, len(labels), size=(2 * (len(pos) - len(neg)), 2))
+        cand = cand[labels[cand[:, 0]] != labels[cand[:, 1]]]
+        neg = np.concatenate([neg, cand])[:len(pos)]
+
+    pairs = np.concatenate([pos, neg])
+    y = np.concatenate([np.ones(len(pos), np.int32), np.zeros(len(neg), np.int32)])
+    img_sim = _pair_sims(image_embs, pairs[:, 0], pairs[:, 1])
+    txt_sim = _pair_sims(text_embs, pairs[:, 0], pairs[:, 1])
+    X = np.stack([img_sim, txt_sim, alpha * img_sim + (1.0 - alpha) * txt_sim], axis=1).astype(np.float32)
+
+    X_train, X_val, y_train, y_val = train_test_split(X, y, test_size=0.25, random_state=seed, stratify=y)
+    clf = LogisticRegression(max_iter=1000)
+    clf.fit(X_train, y_train)
+    probs = clf.predict_proba(X_val)[:, 1]
+    prec, rec, ths = precision_recall_curve(y_val, probs)
+    f1s = 2 * (prec * rec) / (prec + rec + 1e-12)
+    best_idx = int(np.nanargmax(f1s))
+    best_th = ths[min(best_idx, len(ths) - 1)]
+    report = {'pairs': int(len(y)), 'val_roc_auc': float(roc_auc_score(y_val, probs)),
+              'best_f1': float(f1s[best_idx]), 'best_threshold': float(best_th)}
+    print(f"  classifier: {report['pairs']} pairs, val ROC-AUC {report['val_roc_auc']:.4f}, "
+          f"best F1 {report['best_f1']:.4f} at {report['best_threshold']:.4f}")
+    return {'clf': clf, 'alpha': alpha, 'best_threshold': float(best_th), 'report': report}
+
+
+def build_siamese_artifacts(csv_path: str, images_dir: Optional[str] = None, artifact_dir: str = DEFAULT_ARTIFACT_DIR,
+                            index_type: str = 'flat', chunk_size: int = 8192, image_batch: int = 64,
+                            image_workers: Optional[int] = None, torch_threads: Optional[int] = None,
+                            resume: bool = True, train_size: int = 100000, nprobe: Optional[int] = None,
+                            ef_search: Optional[int] = None, **index_params) -> Dict[str, Any]:
+    import faiss
+    from .ann_index import set_search_defaults
+    from .build_index import _IncrementalIndex, _source_fingerprint
+
+    images_dir = images_dir or os.path.join(os.path.dirname(os.path.abspath(csv_path)), 'train_images')
+    stage = os.path.join(artifact_dir, '.build')
+    os.makedirs(stage, exist_ok=True)
+    state = _BuildState(stage, {'csv': _source_fingerprint(csv_path), 'images_dir': os.path.abspath(images_dir),
+                                'index_type': index_type, 'params': index_params}, resume)
+    if state.get('text_rows') or state.get('image_rows'):
+        print(f"Resuming build in {stage} (titles {state.get('text_rows', 0)}, images {state.get('image_rows', 0)})")
+
+    print('Writing meta.csv from', csv_path)
+    n = _write_meta(csv_path, images_dir, os.path.join(stage, 'meta.csv'), chunk_size, artifact_dir)
+
+    print(f'Encoding {n} titles with {TEXT_MODEL_NAME}')
+    text_stats = encode_titles(csv_path, os.path.join(stage, 'text_embs.npy'), n, state, chunk_size=chunk_size)
+
+    paths = pd.read_csv(os.path.join(stage, 'meta.csv'), usecols=['image_path'])['image_path'].astype(str).tolist()
+    paths = [os.path.join(artifact_dir, p) for p in paths]  # relative image_path values are artifact-dir relative
+    paths = [p if os.path.exists(p) else os.path.join(images_dir, os.path.basename(p)) for p in paths]
+    print(f'Encoding {n} images with {IMAGE_MODEL_NAME}/{IMAGE_MODEL_PRETRAINED}')
+    image_stats = encode_images(paths, os.path.join(stage, 'image_embs.npy'), state, batch_size=image_batch,
+                                workers=image_workers, torch_threads=torch_threads)
+
+    text_embs = np.load(os.path.join(stage, 'text_embs.npy'), mmap_mode='r')
+    image_embs = np.load(os.path.join(stage, 'image_embs.npy'), mmap_mode='r')
+    for name, embs in (('faiss_text.index', text_embs), ('faiss_image.index', image_embs)):
+        print(f'Building {index_type} {name} over {len(embs)} vectors')
+        builder = _IncrementalIndex(embs.shape[1], len(embs), index_type, train_size, **index_params)
+        builder.catch_up(embs, len(embs), final=True)
+        set_search_defaults(builder.index, nprobe=nprobe, ef_search=ef_search)
+        faiss.write_index(builder.index, os.path.join(stage, name))
+
+    print('Training duplicate classifier')
+    labels = pd.read_csv(csv_path, usecols=['label_group'])['label_group'].to_numpy()
+    clf_obj = train_threshold_classifier(text_embs, image_embs, labels)
+    clf_report = clf_obj.pop('report')
+    with open(os.path.join(stage, 'threshold_clf.pkl'), 'wb') as f:
+        pickle.dump(clf_obj, f)
+    del text_embs, image_embs
+
+    files = {'meta_csv': 'meta.csv', 'text_embs': 'text_embs.npy', 'image_embs': 'image_embs.npy',
+             'faiss_text': 'faiss_text.index', 'faiss_image': 'faiss_image.index', 'threshold_clf': 'threshold_clf.pkl'}
+    manifest = {
+        'image_model': {'name': IMAGE_MODEL_NAME, 'pretrained': IMAGE_MODEL_PRETRAINED, 'dim': image_stats['dim']},
+        'text_model': {'name': TEXT_MODEL_NAME, 'dim': text_stats['dim']},
+        'fusion_alpha': FUSION_ALPHA,
+        'files': dict(files),
+        'embedding_storage': {
+            name: {'storage': 'float32', 'file': name + '.npy', 'shape': [n, stats['dim']], 'normalized': True}
+            for name, stats in (('text_embs', text_stats), ('image_embs', image_stats))
+        },
+        'build': {
+            'rows': n,
+            'index_type': index_type,
+            'index_params': index_params,
+            'text': text_stats,
+            'image': image_stats,
+            'classifier': clf_report,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+    }
+
+    # Move the new set into place; stale quantized copies would shadow the new embeddings.
+    for name in EMBEDDING_NAMES:
+        for st, suffix in STORAGE_SUFFIX.items():
+            if st != 'float32':
+                for stale in (name + suffix, name + '.i8_scale.npy'):
+                    if os.path.exists(os.path.join(artifact_dir, stale)):
+                        os.remove(os.path.join(artifact_dir, stale))
+    for f in files.values():
+        os.replace(os.path.join(stage, f), os.path.join(artifact_dir, f))
+    # seller model reads the final meta.csv (its fingerprint ties the model to this build)
+    fraud_stats = build_artifact_fraud_model(artifact_dir)
+    if fraud_stats is not None:
+        manifest['files']['fraud_model'] = FRAUD_MODEL_DIR
+        manifest['build']['fraud_model'] = fraud_stats
+    _write_json(os.path.join(artifact_dir, 'manifest.json'), manifest)
+    shutil.rmtree(stage, ignore_errors=True)
+    print('Wrote artifacts to', artifact_dir)
+    return manifest
@@ -1,41 +1,401 @@
 import os
+import json
+import time
+import argparse
 import pandas as pd
 import numpy as np
-from sentence_transformers import SentenceTransformer
 import faiss
 
+from .ann_index import (FUSED_LAYOUT, INDEX_TYPES, build_index, fused_vectors, make_index, recall_at_k,
+                        set_search_defaults, train_index)
+
 ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
 DATASET_CSV = os.path.join(ROOT, 'dataset', 'shopee-product-matching', 'train.csv')
 DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data')
+ARTIFACT_DIR = os.path.join(DATA_DIR, 'siamese_artifacts')
 os.makedirs(DATA_DIR, exist_ok=True)
 
-def build():
-    print('Loading dataset:', DATASET_CSV)
-    df = pd.read_csv(DATASET_CSV)
-    # Expecting columns: image, title, label_group, etc.
-    titles = df['title'].fillna('').astype(str).tolist()
-    meta = df[['image', 'label_group']].to_dict(orient='records')
 
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-    embeddings = model.encode(titles, convert_to_numpy=True, show_progress_bar=True)
-    embeddings = embeddings.astype('float32')
+def _benchmark(index, vecs: np.ndarray, query_idxs: np.ndarray, k: int, nprobe=None, ef_search=None, normalize=False):
+    report = recall_at_k(index, vecs, k=k, query_idxs=query_idxs, nprobe=nprobe, ef_search=ef_search,
+                         normalize=normalize)
+    print(f"  recall@{k}={report['recall']:.4f} over {report['queries']} held-out queries | "
+          f"ann {report['ann_ms_per_query']:.3f} ms/q vs exact {report['exact_ms_per_query']:.3f} ms/q")
+    return report
+
+
+def _build_and_report(vecs: np.ndarray, index_type: str, recall_queries: int, recall_k: int,
+                      nprobe=None, ef_search=None, **index_params):
+    """Build an index over normalized vecs; for approximate types also measure recall vs flat."""
+    rng = np.random.default_rng(123)
+    query_idxs = None
+    if index_type != 'flat' and recall_queries > 0:
+        query_idxs = rng.choice(len(vecs), size=min(recall_queries, len(vecs)), replace=False)
+    index = build_index(vecs, index_type, holdout=query_idxs, **index_params)
+    set_search_defaults(index, nprobe=nprobe, ef_search=ef_search)
+    report = None
+    if query_idxs is not None:
+        report = _benchmark(index, vecs, query_idxs, recall_k, nprobe=nprobe, ef_search=ef_search)
+        report.update({'index_type': index_type, 'params': index_params})
+    return index, report
+
+
+MODEL_NAME = 'all-MiniLM-L6-v2'
+CHECKPOINT_PATH = os.path.join(DATA_DIR, 'build_checkpoint.json')
+
+
+def _source_fingerprint(path: str) -> dict:
+    st = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': int(st.st_size), 'mtime': int(st.st_mtime)}
+
+
+def _count_rows(csv_path: str, chunk_size: int) -> int:
+    return sum(len(c) for c in pd.read_csv(csv_path, usecols=['title'], chunksize=chunk_size))
+
+
+def _read_checkpoint(path: str) -> dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
 
+def _write_checkpoint(path: str, state: dict):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, path)
+
+
+class _IncrementalIndex:
+    """FAISS index filled chunk by chunk from rows already written to the embeddings memmap.
+
+    Trainable (IVF) indices train on ``train_size`` rows sampled uniformly from all
+    ``n`` rows (excluding the benchmark queries), so the coarse quantizer sees the
+    whole CSV rather than its head. The sample is fixed up front, which keeps it
+    the same across resumes; training waits until its last row has been encoded,
+    then the index catches up on the backlog.
+    """
+
+    def __init__(self, d: int, n: int, index_type: str, train_size: int, holdout=None, **index_params):
+        self.index = make_index(d, index_type, n=n, **index_params)
+        self.train_rows = self._train_sample(n, train_size, holdout) if not self.index.is_trained else None
+        self.added = 0
+
+    @staticmethod
+    def _train_sample(n: int, train_size: int, holdout=None) -> np.ndarray:
+        holdout = np.zeros(0, np.int64) if holdout is None else np.asarray(holdout, dtype=np.int64)
+        if n - len(holdout) <= train_size:
+            return np.setdiff1d(np.arange(n), holdout)
+        pool = np.random.default_rng(42).choice(n, min(n, train_size + len(holdout)), replace=False)
+        return np.sort(pool[~np.isin(pool, holdout)][:train_size])
+
+    def catch_up(self, embs: np.ndarray, rows_done: int, final: bool = False, chunk_size: int = 65536):
+        if not self.index.is_trained:
+            pool = self.train_rows
+            if not final and len(pool) and rows_done <= pool[-1]:
+                return
+            sample = np.array(embs[pool[pool < rows_done]], dtype=np.float32)
+            faiss.normalize_L2(sample)
+            train_index(self.index, sample)
+        while self.added < rows_done:
+            stop = min(rows_done, self.added + chunk_size)
+            block = np.array(embs[self.added:stop], dtype=np.float32)
+            faiss.normalize_L2(block)
+            self.index.add(block)
+            self.added = stop
+
+
+def build(index_type: str = 'flat', recall_queries: int = 1000, recall_k: int = 10,
+          nprobe=None, ef_search=None, chunk_size: int = 8192, checkpoint_every: int = 4,
+          resume: bool = True, train_size: int = 100000, **index_params):
+    """Stream train.csv through the text encoder into embeddings.npy and the FAISS index.
+
+    The CSV is read ``chunk_size`` rows at a time and each encoded chunk is written into
+    a preallocated memmap, so peak memory stays around one chunk. Every
+    ``checkpoint_every`` chunks the memmap is flushed and progress (plus the partial
+    index) is recorded, so an interrupted build resumes from the last checkpoint.
+    """
+    print('Loading dataset:', DATASET_CSV)
     emb_path = os.path.join(DATA_DIR, 'embeddings.npy')
     meta_path = os.path.join(DATA_DIR, 'meta.npy')
     idx_path = os.path.join(DATA_DIR, 'faiss_index.idx')
+    partial_emb = emb_path + '.partial'
+    partial_idx = idx_path + '.partial'
 
-    np.save(emb_path, embeddings)
-    np.save(meta_path, np.array(meta, dtype=object))
+    from sentence_transformers import SentenceTransformer
+    model = SentenceTransformer(MODEL_NAME)
+    d = model.get_sentence_embedding_dimension()
+
+    job = {'source': _source_fingerprint(DATASET_CSV), 'model': MODEL_NAME, 'dim': int(d),
+           'index_type': index_type, 'params': index_params, 'train_size': train_size}
+    state = _read_checkpoint(CHECKPOINT_PATH) if resume else {}
+    if state.get('job') != job or not os.path.exists(partial_emb):
+        state = {'job': job, 'rows': _count_rows(DATASET_CSV, chunk_size), 'rows_done': 0, 'index_rows': 0}
+        embs = np.lib.format.open_memmap(partial_emb, mode='w+', dtype=np.float32, shape=(state['rows'], d))
+        _write_checkpoint(CHECKPOINT_PATH, state)
+    else:
+        embs = np.lib.format.open_memmap(partial_emb, mode='r+')
+        print(f"Resuming at row {state['rows_done']}/{state['rows']}")
+    n = state['rows']
 
-    d = embeddings.shape[1]
-    index = faiss.IndexFlatIP(d)
-    faiss.normalize_L2(embeddings)
-    index.add(embeddings)
-    faiss.write_index(index, idx_path)
+    query_idxs = None
+    if index_type != 'flat' and recall_queries > 0:
+        query_idxs = np.sort(np.random.default_rng(123).choice(n, size=min(recall_queries, n), replace=False))
+    builder = _IncrementalIndex(d, n, index_type, train_size, holdout=query_idxs, **index_params)
+    if state['index_rows'] and os.path.exists(partial_idx):
+        builder.index = faiss.read_index(partial_idx)
+        builder.added = int(builder.index.ntotal)
+    builder.catch_up(embs, state['rows_done'])
+
+    row, chunks = 0, 0
+    t0 = time.perf_counter()
+    encoded = 0
+    for chunk in pd.read_csv(DATASET_CSV, usecols=['title'], chunksize=chunk_size):
+        start, row = row, row + len(chunk)
+        if row <= state['rows_done']:
+            continue
+        # Expecting columns: image, title, label_group, etc.
+        titles = chunk['title'].fillna('').astype(str).tolist()[state['rows_done'] - start:]
+        embs[state['rows_done']:row] = model.encode(titles, convert_to_numpy=True, show_progress_bar=False)
+        encoded += len(titles)
+        state['rows_done'] = row
+        builder.catch_up(embs, row)
+        chunks += 1
+        if chunks % checkpoint_every == 0:
+            embs.flush()
+            if builder.added:
+                faiss.write_index(builder.index, partial_idx)
+            state['index_rows'] = builder.added
+            _write_checkpoint(CHECKPOINT_PATH, state)
+            rate = encoded / max(time.perf_counter() - t0, 1e-9)
+            print(f"  {row}/{n} rows encoded ({rate:.0f} titles/s)")
+
+    builder.catch_up(embs, state['rows_done'], final=True)
+    set_search_defaults(builder.index, nprobe=nprobe, ef_search=ef_search)
+    embs.flush()
+    print(f'Built {index_type} index over {builder.index.ntotal} vectors')
+    if query_idxs is not None:
+        report = _benchmark(builder.index, embs, query_idxs, recall_k, nprobe=nprobe, ef_search=ef_search, normalize=True)
+        report.update({'index_type': index_type, 'params': index_params})
+        with open(os.path.join(DATA_DIR, 'index_report.json'), 'w') as f:
+            json.dump(report, f, indent=2)
+    del embs
+
+    meta = pd.read_csv(DATASET_CSV, usecols=['image', 'label_group']).to_dict(orient='records')
+    np.save(meta_path, np.array(meta, dtype=object))
+    faiss.write_index(builder.index, idx_path)
+    os.replace(partial_emb, emb_path)
+    for path in (partial_idx, CHECKPOINT_PATH):
+        if os.path.exists(path):
+            os.remove(path)
 
     print('Saved embeddings to', emb_path)
     print('Saved meta to', meta_path)
     print('Saved index to', idx_path)
 
+
+def build_artifact_indices(artifact_dir: str = ARTIFACT_DIR, index_type: str = 'flat', recall_queries: int = 1000,
+                           recall_k: int = 10, nprobe=None, ef_search=None, **index_params):
+    """Rebuild faiss_text.index / faiss_image.index in the server's artifact dir from its embeddings."""
+    from .embeddings import load_embeddings
+    manifest_path = os.path.join(artifact_dir, 'manifest.json')
+    manifest = json.load(open(manifest_path)) if os.path.exists(manifest_path) else {}
+    reports = {}
+    for emb_name, index_name in (('text_embs', 'faiss_text.index'), ('image_embs', 'faiss_image.index')):
+        embs = load_embeddings(artifact_dir, emb_name, manifest, mmap=True)
+        if embs is None:
+            continue
+        vecs = embs.normalized_rows(np.arange(len(embs)))
+        print(f'{index_name}: building {index_type} index over {len(vecs)} vectors')
+        index, report = _build_and_report(vecs, index_type, recall_queries, recall_k,
+                                          nprobe=nprobe, ef_search=ef_search, **index_params)
+        faiss.write_index(index, os.path.join(artifact_dir, index_name))
+        if report is not None:
+            reports[index_name] = report
+    if reports:
+        with open(os.path.join(artifact_dir, 'index_report.json'), 'w') as f:
+            json.dump(reports, f, indent=2)
+    return reports
+
+
+FUSED_INDEX_FILE = 'faiss_fused.index'
+
+
+class _FusedRows:
+    """Fused vectors computed on demand from the two embedding matrices (row-indexable like an array)."""
+
+    def __init__(self, image_embs, text_embs, alpha: float):
+        self.image_embs = image_embs
+        self.text_embs = text_embs
+        self.alpha = alpha
+        self.shape = (len(text_embs), image_embs.shape[1] + text_embs.shape[1])
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __getitem__(self, key) -> np.ndarray:
+        idxs = np.arange(len(self))[key] if isinstance(key, slice) else np.asarray(key)
+        return fused_vectors(self.image_embs.normalized_rows(idxs), self.text_embs.normalized_rows(idxs), self.alpha)
+
+
+def build_fused_index(artifact_dir: str = ARTIFACT_DIR, index_type: str = 'flat', recall_queries: int = 1000,
+                      recall_k: int = 10, nprobe=None, ef_search=None, chunk: int = 65536, train_size: int = 100000,
+                      **index_params):
+    """Build faiss_fused.index over sqrt(alpha) * image ⊕ sqrt(1 - alpha) * text and record it in manifest.json.
+
+    alpha comes from threshold_clf.pkl (the value /search and /dedup/fused use by
+    default). Vectors are assembled chunk by chunk from the stored embeddings.
+    """
+    import pickle
+    from .embeddings import _read_manifest, _write_manifest, load_embeddings
+
+    manifest = _read_manifest(artifact_dir)
+    text_embs = load_embeddings(artifact_dir, 'text_embs', manifest, mmap=True)
+    image_embs = load_embeddings(artifact_dir, 'image_embs', manifest, mmap=True)
+    if text_embs is None or image_embs is None:
+        raise ValueError(f'the fused index needs both text and image embeddings in {artifact_dir}')
+    if len(text_embs) != len(image_embs):
+        raise ValueError(f'text_embs has {len(text_embs)} rows but image_embs has {len(image_embs)}')
+    alpha = 0.5
+    clf_path = os.path.join(artifact_dir, 'threshold_clf.pkl')
+    if os.path.exists(clf_path):
+        with open(clf_path, 'rb') as f:
+            alpha = float(pickle.load(f).get('alpha', alpha))
+    else:
+        print(f'{clf_path} not found; building the fused index with alpha={alpha}')
+    rows = _FusedRows(image_embs, text_embs, alpha)
+    n, d = rows.shape
+    print(f'{FUSED_INDEX_FILE}: building {index_type} index over {n} vectors (d={d}, alpha={alpha})')
+
+    rng = np.random.default_rng(123)
+    query_idxs = None
+    if index_type != 'flat' and recall_queries > 0:
+        query_idxs = rng.choice(n, size=min(recall_queries, n), replace=False)
+    index = make_index(d, index_type, n=n, **index_params)
+    if not index.is_trained:
+        pool = np.arange(n) if query_idxs is None else np.setdiff1d(np.arange(n), query_idxs)
+        if len(pool) > train_size:
+            pool = np.sort(rng.choice(pool, train_size, replace=False))
+        train_index(index, rows[pool])
+    for start in range(0, n, chunk):
+        index.add(rows[start:start + chunk])
+    set_search_defaults(index, nprobe=nprobe, ef_search=ef_search)
+    report = None
+    if query_idxs is not None:
+        report = _benchmark(index, rows, query_idxs, recall_k, nprobe=nprobe, ef_search=ef_search)
+        report.update({'index_type': index_type, 'params': index_params})
+    faiss.write_index(index, os.path.join(artifact_dir, FUSED_INDEX_FILE))
+
+    manifest = _read_manifest(artifact_dir)
+    manifest['fused_index'] = {
+        'file': FUSED_INDEX_FILE,
+        'alpha': alpha,
+        'layout': list(FUSED_LAYOUT),
+        'dims': [int(image_embs.shape[1]), int(text_embs.shape[1])],
+        'rows': int(n),
+        'embeddings': {'text_embs': text_embs.source, 'image_embs': image_embs.source},
+        'index_type': index_type,
+        'recall': report,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    _write_manifest(artifact_dir, manifest)
+    return manifest['fused_index']
+
+
+def _parser() -> argparse.ArgumentParser:
+    ap = argparse.ArgumentParser(description='Build embeddings and FAISS indices')
+    ap.add_argument('--artifacts', action='store_true',
+                    help='rebuild faiss_text/faiss_image in siamese_artifacts from the existing embeddings')
+    ap.add_argument('--siamese-artifacts', action='store_true',
+                    help='encode titles and images and write the complete siamese_artifacts set')
+    ap.add_argument('--fraud-model', action='store_true',
+                    help='precompute the seller fraud model (fraud_model/) from the artifacts in --out')
+    ap.add_argument('--clusters', action='store_true',
+                    help='cluster near-duplicates across the catalog in --out (writes clusters/)')
+    ap.add_argument('--cluster-workers', type=int, default=None, help='query chunks searched in parallel (default: CPUs)')
+    ap.add_argument('--cluster-chunk', type=int, default=2048, help='queries per chunk for --clusters')
+    ap.add_argument('--cluster-k', type=int, default=100, help='max neighbours kept per item and index for --clusters (0: all, by range search)')
+    ap.add_argument('--cluster-radius', type=float, default=None,
+                    help='similarity radius for --clusters (default: lowest fused similarity the classifier accepts)')
+    ap.add_argument('--rings', action='store_true',
+                    help='find cross-seller duplicate rings in --out (writes rings/; runs --clusters first if needed)')
+    ap.add_argument('--ring-min-pairs', type=int, default=2,
+                    help='near-duplicate listing pairs two sellers must share to be linked in a ring')
+    ap.add_argument('--ring-min-overlap', type=float, default=0.25,
+                    help='share of both sellers\' listings with a near-duplicate at the other needed to link them')
+    ap.add_argument('--fused-index', action='store_true',
+                    help='build faiss_fused.index (alpha-weighted image+text vectors) in --out for one-search fused queries')
+    ap.add_argument('--export-onnx', action='store_true',
+                    help='export the text and image encoders to <--out>/onnx for ENCODER_BACKEND=onnx')
+    ap.add_argument('--onnx-int8', action='store_true', help='with --export-onnx: also write dynamic int8 quantized models')
+    ap.add_argument('--onnx-int8-min-cosine', type=float, default=0.99,
+                    help='drop an int8 model whose embeddings fall below this cosine to the PyTorch ones')
+    ap.add_argument('--csv', default=DATASET_CSV, help='catalog CSV for --siamese-artifacts')
+    ap.add_argument('--images-dir', default=None, help='image folder (default: train_images next to the CSV)')
+    ap.add_argument('--out', default=ARTIFACT_DIR, help='artifact dir for --siamese-artifacts / --fraud-model / --clusters / --rings / --fused-index / --export-onnx')
+    ap.add_argument('--image-batch', type=int, default=64, help='images per OpenCLIP forward pass')
+    ap.add_argument('--image-workers', type=int, default=None, help='decode/preprocess processes (default: half the CPUs)')
+    ap.add_argument('--torch-threads', type=int, default=None, help='intra-op threads for CPU inference (default: the larger of half the CPUs and CPUs - workers)')
+    ap.add_argument('--index-type', choices=INDEX_TYPES, default='flat')
+    ap.add_argument('--nlist', type=int, default=None, help='IVF lists (default ~4*sqrt(n))')
+    ap.add_argument('--pq-m', type=int, default=16, help='IVF-PQ sub-quantizers (must divide the dimension)')
+    ap.add_argument('--pq-nbits', type=int, default=8, help='IVF-PQ bits per code')
+    ap.add_argument('--hnsw-m', type=int, default=32, help='HNSW neighbours per node')
+    ap.add_argument('--ef-construction', type=int, default=200, help='HNSW build-time beam width')
+    ap.add_argument('--recall-queries', type=int, default=1000, help='held-out queries for the recall benchmark (0 to skip)')
+    ap.add_argument('--recall-k', type=int, default=10)
+    ap.add_argument('--nprobe', type=int, default=None,
+                    help='IVF nprobe for the benchmark, saved in the index as the serving default')
+    ap.add_argument('--ef-search', type=int, default=None,
+                    help='HNSW efSearch for the benchmark, saved in the index as the serving default')
+    ap.add_argument('--chunk-size', type=int, default=8192, help='CSV rows read and encoded per step')
+    ap.add_argument('--checkpoint-every', type=int, default=4, help='chunks between checkpoints')
+    ap.add_argument('--no-resume', action='store_true', help='ignore any checkpoint and start over')
+    return ap
+
+
+def _index_params(args) -> dict:
+    params = {}
+    if args.index_type in ('ivf_flat', 'ivf_pq'):
+        params['nlist'] = args.nlist
+    if args.index_type == 'ivf_pq':
+        params.update(pq_m=args.pq_m, pq_nbits=args.pq_nbits)
+    if args.index_type == 'hnsw':
+        params.update(hnsw_m=args.hnsw_m, ef_construction=args.ef_construction)
+    return params
+
+
 if __name__ == '__main__':
-    build()
+    args = _parser().parse_args()
+    common = dict(index_type=args.index_type, recall_queries=args.recall_queries, recall_k=args.recall_k,
+                  nprobe=args.nprobe, ef_search=args.ef_search, **_index_params(args))
+    if args.siamese_artifacts:
+        from .build_artifacts import build_siamese_artifacts
+        build_siamese_artifacts(args.csv, images_dir=args.images_dir, artifact_dir=args.out,
+                                index_type=args.index_type, chunk_size=args.chunk_size, image_batch=args.image_batch,
+                                image_workers=args.image_workers, torch_threads=args.torch_threads,
+                                resume=not args.no_resume, nprobe=args.nprobe, ef_search=args.ef_search,
+                                **_index_params(args))
+    elif args.clusters or args.rings:
+        from .clusters import build_clusters, cluster_source, load_clusters
+        if args.clusters or load_clusters(args.out, cluster_source(args.out)) is None:
+            build_clusters(args.out, workers=args.cluster_workers, chunk=args.cluster_chunk, k=args.cluster_k,
+                           radius=args.cluster_radius, nprobe=args.nprobe)
+        if args.rings:
+            from .rings import build_rings
+            build_rings(args.out, min_pairs=args.ring_min_pairs, min_overlap=args.ring_min_overlap)
+    elif args.fused_index:
+        build_fused_index(args.out, **common)
+    elif args.export_onnx:
+        from .onnx_encoders import export_encoders
+        export_encoders(args.out, int8=args.onnx_int8, int8_min_cosine=args.onnx_int8_min_cosine,
+                        images_dir=args.images_dir or os.path.join(os.path.dirname(args.csv), 'train_images'))
+    elif args.fraud_model:
+        from .fraud_model import build_artifact_fraud_model
+        build_artifact_fraud_model(args.out)
+    elif args.artifacts:
+        build_artifact_indices(**common)
+    else:
+        build(chunk_size=args.chunk_size, checkpoint_every=args.checkpoint_every, resume=not args.no_resume, **common)
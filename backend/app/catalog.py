@@ -0,0 +1,491 @@
+"""Incremental catalog updates on top of the loaded artifacts.
+
+New listings are encoded and appended to the embedding matrices, both FAISS
+indices and the metadata store without a rebuild; deletes take items out of
+search. Every change is first written to a write-ahead log (JSON lines next
+to the artifacts) and the log is replayed when artifacts are loaded, so the
+live catalog survives restarts:
+
+  {"op": "base", "rows": N, "source": {...}}         first line: the base catalog the log applies to
+  {"op": "add", "idx": i, "row": {...}, "text": "<b64 float32>", "image": "<b64 float32>" | null}
+  {"op": "delete", "idx": i}
+
+Indices are made ID-addressable at attach time: flat indices are rebuilt as
+IndexIDMap2 (ids == catalog idx), IVF indices already carry ids. Deleted
+idxs are tombstoned and filtered from results immediately; they are removed
+from the index in batches (``compact_every``) since each removal is a pass
+over the index. HNSW cannot remove entries, so its tombstones stay filtered.
+The optional fused index (``faiss_fused``) gets the alpha-weighted
+concatenation of each new item's normalized image and text vectors.
+
+Adds are validated (rows coerced to the metadata column types, vector
+dimensions checked) before they are logged, and applied all-or-nothing: if
+any structure rejects the batch, the ones already extended are rolled back.
+A replay that fails therefore leaves the loaded artifacts untouched.
+
+When the artifacts are rebuilt (the header's row count or ``source`` -- the
+build fingerprint passed in as ``base_id`` -- no longer matches) the old log
+is set aside as ``<wal>.stale`` and a new one starts.
+That happens on the new generation's first write, not during replay: a
+reloaded generation that fails validation never writes, so the serving one
+keeps appending to the live log. A reload replays the log while the serving
+generation still takes writes; ``catch_up`` then applies what was appended
+meanwhile, with the serving generation paused only for that and the swap.
+"""
+import base64
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+try:
+    import faiss
+except Exception:
+    faiss = None
+
+from . import ann_index
+
+
+class RWLock:
+    """Many concurrent readers (searches) or one writer (index mutation)."""
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+def _encode_vec(vec: Optional[np.ndarray]) -> Optional[str]:
+    if vec is None:
+        return None
+    return base64.b64encode(np.asarray(vec, dtype=np.float32).tobytes()).decode('ascii')
+
+
+def _decode_vec(data: Optional[str]) -> Optional[np.ndarray]:
+    if data is None:
+        return None
+    return np.frombuffer(base64.b64decode(data), dtype=np.float32)
+
+
+class CatalogWAL:
+    def __init__(self, path: str, fsync: bool = True):
+        self.path = path
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._f = None
+        self._intact: Optional[tuple] = None  # (intact prefix, file size) seen by the last read
+
+    def read(self) -> List[Dict[str, Any]]:
+        """Records of the intact prefix. Read-only: another generation may still be appending."""
+        if not os.path.exists(self.path):
+            self._intact = None
+            return []
+        records = []
+        valid = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                if line.strip():
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        break
+                valid += len(line)
+            self._intact = (valid, f.tell())
+        return records
+
+    def _repair(self):
+        """Cut a torn final write (from a crash) seen by the last read, so appends stay readable."""
+        if self._intact is None:
+            return
+        valid, size = self._intact
+        if valid < size and os.path.exists(self.path) and os.path.getsize(self.path) == size:
+            with open(self.path, 'r+b') as f:
+                f.truncate(valid)
+        self._intact = None
+
+    def reset(self, base_rows: int, source: Optional[Dict[str, Any]] = None):
+        if os.path.exists(self.path):
+            os.replace(self.path, f'{self.path}.stale')
+        self._intact = None
+        self.append([{'op': 'base', 'rows': int(base_rows), 'source': source, 'ts': time.time()}])
+
+    def append(self, records: Sequence[Dict[str, Any]]):
+        with self._lock:
+            if self._f is None:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                self._repair()
+                self._f = open(self.path, 'a', encoding='utf-8')
+            self._f.write(''.join(json.dumps(r, default=str) + '\n' for r in records))
+            self._f.flush()
+            if self.fsync:
+                os.fsync(self._f.fileno())
+
+    def close(self):
+        with self._lock:
+            if self._f is not None:
+                self._f.close()
+                self._f = None
+
+
+INDEX_NAMES = ('faiss_text', 'faiss_image', 'faiss_fused')
+
+
+def _removable(index) -> bool:
+    if faiss is None or index is None:
+        return False
+    inner = faiss.downcast_index(index)
+    return isinstance(inner, (faiss.IndexIDMap, faiss.IndexIDMap2)) or hasattr(inner, 'invlists')
+
+
+def id_mapped(index, chunk: int = 65536):
+    """Return an index that supports add_with_ids/remove_ids with ids == catalog idx.
+
+    Flat indices are copied into an IndexIDMap2 (the original can be dropped
+    afterwards); IVF indices are returned as is; HNSW stays sequential-id only.
+    """
+    if faiss is None or index is None or _removable(index):
+        return index
+    inner = faiss.downcast_index(index)
+    if not isinstance(inner, faiss.IndexFlat):
+        return index
+    mapped = faiss.IndexIDMap2(faiss.IndexFlat(index.d, index.metric_type))
+    for start in range(0, index.ntotal, chunk):
+        stop = min(index.ntotal, start + chunk)
+        mapped.add_with_ids(index.reconstruct_n(start, stop - start), np.arange(start, stop, dtype=np.int64))
+    return mapped
+
+
+def _append(index, index_name: str, block: np.ndarray, ids: np.ndarray):
+    if _removable(index):
+        index.add_with_ids(block, ids)
+    elif index.ntotal == ids[0]:
+        index.add(block)
+    else:
+        raise RuntimeError(f'{index_name} has {index.ntotal} entries; cannot append idx {ids[0]}')
+
+
+class Catalog:
+    """Owns mutations of one artifact generation (``art`` dict) and its write-ahead log."""
+
+    def __init__(self, art: Dict[str, Any], wal: CatalogWAL, image_key_fn: Callable[[Dict[str, Any]], Optional[str]],
+                 compact_every: int = 256, base_id: Optional[Dict[str, Any]] = None):
+        self.art = art
+        self.wal = wal
+        self.image_key_fn = image_key_fn
+        self.compact_every = max(1, int(compact_every))
+        self.lock = RWLock()
+        self._write_lock = threading.Lock()
+        self.deleted: set = set()
+        self.pending: set = set()  # deleted but still physically present in a removable index
+        self.added = 0
+        self.retired = False
+        self.failed: Optional[str] = None  # set when memory and log may disagree; writes are refused
+        self._new_log = False  # the log on disk is not ours: start a new one on the first write
+        self._replayed = 0  # log records (header included) applied by replay / catch_up
+        self.base_rows = len(art['meta']) if art.get('meta') is not None else 0
+        self.base_id = base_id
+        self._keys_buf: Optional[np.ndarray] = None  # capacity behind art['image_keys'] once items are added
+        for name in INDEX_NAMES:
+            art[name] = id_mapped(art.get(name))
+
+    # -------- replay --------
+    def _owns(self, records: List[Dict[str, Any]]) -> bool:
+        header = records[0] if records else {}
+        return (header.get('op') == 'base' and header.get('rows') == self.base_rows
+                and header.get('source') == self.base_id)
+
+    def replay(self) -> int:
+        records = self.wal.read()
+        if not self._owns(records):
+            if records:
+                print(f'[catalog] artifacts changed since {self.wal.path} was written; starting a new log')
+            self._new_log = True
+            return 0
+        self._apply_records(records[1:])
+        self._replayed = len(records)
+        return len(records) - 1
+
+    def catch_up(self) -> int:
+        """Apply the records appended since ``replay`` (by the generation serving meanwhile).
+
+        Call with that generation paused. Raises RuntimeError if the log was restarted in between.
+        """
+        records = self.wal.read()
+        if not self._owns(records):
+            if self._replayed:
+                raise RuntimeError(f'{self.wal.path} was restarted while it was replayed')
+            return 0
+        start = max(self._replayed, 1)
+        self._apply_records(records[start:])
+        self._new_log = False  # the serving generation started a log for the same base
+        self._replayed = len(records)
+        return len(records) - start
+
+    def _apply_records(self, records: List[Dict[str, Any]]):
+        if not records:
+            return
+        # parse and validate all records before changing anything
+        adds = [r for r in records if r.get('op') == 'add']
+        batch = None
+        if adds:
+            batch = self._prepare_add([r['row'] for r in adds], [_decode_vec(r.get('text')) for r in adds],
+                                      [_decode_vec(r.get('image')) for r in adds],
+                                      expect=[int(r['idx']) for r in adds])
+        deletes = [int(r['idx']) for r in records if r.get('op') == 'delete']
+        if batch is not None:
+            self._apply_add(batch)
+        if deletes:
+            self._apply_delete(deletes)
+            self.compact()
+
+    # -------- lifecycle --------
+    @contextmanager
+    def paused(self):
+        """Hold off writers (e.g. while a new artifact generation catches up with the log)."""
+        with self._write_lock:
+            yield
+
+    def retire(self):
+        """Stop accepting writes once a newer generation owns the log. Call while paused."""
+        self.retired = True
+        self.wal.close()
+
+    def _check_live(self):
+        if self.retired:
+            raise RuntimeError('artifacts were reloaded while this request was running; retry')
+        if self.failed:
+            raise RuntimeError(f'catalog writes are disabled until the artifacts are reloaded: {self.failed}')
+
+    def check_rows(self, rows: List[Dict[str, Any]]):
+        """Raise ValueError if ``rows`` cannot be stored in the metadata columns."""
+        self.art['meta'].coerce_rows(rows)
+
+    # -------- mutations --------
+    def _log(self, records: List[Dict[str, Any]]):
+        if self._new_log:
+            self.wal.reset(self.base_rows, self.base_id)
+            self._new_log = False
+        self.wal.append(records)
+
+    def add_items(self, rows: List[Dict[str, Any]], text_vecs: Sequence[Optional[np.ndarray]],
+                  image_vecs: Sequence[Optional[np.ndarray]]) -> List[int]:
+        with self._write_lock:
+            self._check_live()
+            start = len(self.art['meta'])
+            idxs = list(range(start, start + len(rows)))
+            batch = self._prepare_add(rows, text_vecs, image_vecs, expect=idxs)  # raises before anything is logged
+            self._log([{'op': 'add', 'idx': i, 'row': r, 'text': _encode_vec(t), 'image': _encode_vec(v)}
+                       for i, r, t, v in zip(idxs, rows, text_vecs, image_vecs)])
+            try:
+                self._apply_add(batch)
+            except Exception as e:
+                # rolled back in memory but already logged: the next load replays it
+                self.failed = f'applying logged items {idxs[0]}..{idxs[-1]} failed: {e}'
+                raise
+            return idxs
+
+    def delete_items(self, idxs: Sequence[int]) -> List[int]:
+        with self._write_lock:
+            self._check_live()
+            n = len(self.art['meta'])
+            idxs = [int(i) for i in idxs if 0 <= int(i) < n and int(i) not in self.deleted]
+            if idxs:
+                self._log([{'op': 'delete', 'idx': i} for i in idxs])
+                self._apply_delete(idxs)
+                if len(self.pending) >= self.compact_every:
+                    self.compact()
+            return idxs
+
+    def _prepare_add(self, rows, text_vecs, image_vecs, expect: Sequence[int]) -> Dict[str, Any]:
+        """Validate an add and build everything it appends; raises ValueError/RuntimeError without side effects."""
+        art = self.art
+        meta = art['meta']
+        if len(meta) != expect[0]:
+            raise RuntimeError(f'catalog out of sync: next idx {len(meta)}, log expects {expect[0]}')
+        if list(expect) != list(range(expect[0], expect[0] + len(rows))):
+            raise RuntimeError(f'log idxs {expect[0]}..{expect[-1]} are not consecutive')
+        batch = {'ids': np.asarray(expect, dtype=np.int64), 'rows': meta.coerce_rows(rows), 'blocks': {}}
+        for emb_name, index_name, vecs in (('text_embs', 'faiss_text', text_vecs),
+                                           ('image_embs', 'faiss_image', image_vecs)):
+            embs, index = art.get(emb_name), art.get(index_name)
+            d = embs.shape[1] if embs is not None else (index.d if index is not None else None)
+            if d is None:
+                continue
+            # items without this modality get a zero vector so idxs stay aligned
+            block = np.zeros((len(rows), d), dtype=np.float32)
+            for j, v in enumerate(vecs):
+                if v is None:
+                    continue
+                v = np.asarray(v, dtype=np.float32).reshape(-1)
+                if v.shape[0] != d:
+                    raise ValueError(f'item {j}: {emb_name} vector has {v.shape[0]} dims, expected {d}')
+                block[j] = v
+            norms = np.linalg.norm(block, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            batch['blocks'][emb_name] = np.ascontiguousarray(block / norms)
+        if art.get('faiss_fused') is not None:
+            batch['blocks']['fused'] = ann_index.fused_vectors(batch['blocks']['image_embs'],
+                                                               batch['blocks']['text_embs'],
+                                                               art['fused_index']['alpha'])
+        for name in INDEX_NAMES:
+            index = art.get(name)
+            if index is not None and not _removable(index) and index.ntotal != expect[0]:
+                raise RuntimeError(f'{name} has {index.ntotal} entries; cannot append idx {expect[0]}')
+        if art.get('image_keys') is not None:
+            batch['keys'] = np.empty(len(rows), dtype=object)
+            batch['keys'][:] = [self.image_key_fn(r) for r in rows]
+        return batch
+
+    def _apply_add(self, batch: Dict[str, Any]):
+        """Append a prepared batch to meta, embeddings and indices, rolling all of them back on failure."""
+        art = self.art
+        ids = batch['ids']
+        start = int(ids[0])
+        blocks = batch['blocks']
+        undo: List[Callable[[], None]] = []
+        with self.lock.write():
+            try:
+                meta = art['meta']
+                meta.append_rows(batch['rows'])
+                undo.append(lambda: meta.truncate(start))
+                for emb_name in ('text_embs', 'image_embs'):
+                    embs = art.get(emb_name)
+                    if embs is not None and emb_name in blocks:
+                        embs.append(blocks[emb_name])
+                        undo.append(lambda embs=embs: embs.truncate(start))
+                if 'keys' in batch:
+                    keys = art['image_keys']
+                    art['image_keys'] = self._grow_keys(keys, batch['keys'])
+                    undo.append(lambda keys=keys: art.__setitem__('image_keys', keys))
+                # removable indices first: an HNSW index that took the batch cannot give it back
+                sources = {'faiss_text': 'text_embs', 'faiss_image': 'image_embs', 'faiss_fused': 'fused'}
+                names = sorted((n for n in INDEX_NAMES if art.get(n) is not None), key=lambda n: not _removable(art[n]))
+                for name in names:
+                    index = art[name]
+                    _append(index, name, blocks[sources[name]], ids)
+                    undo.append(lambda index=index, name=name: self._unappend(index, name, ids))
+            except Exception:
+                for fn in reversed(undo):
+                    fn()
+                raise
+        self.added += len(ids)
+
+    def _grow_keys(self, keys: np.ndarray, new_keys: np.ndarray) -> np.ndarray:
+        """``keys`` followed by ``new_keys``, as a view into a buffer grown by doubling (amortized O(new))."""
+        used, need = len(keys), len(keys) + len(new_keys)
+        buf = self._keys_buf
+        if buf is None or keys.base is not buf or need > len(buf):
+            buf = np.empty(max(need, 2 * len(keys), 1024), dtype=object)
+            buf[:used] = keys
+            self._keys_buf = buf
+        buf[used:need] = new_keys
+        return buf[:need]
+
+    def _unappend(self, index, index_name: str, ids: np.ndarray):
+        if _removable(index):
+            index.remove_ids(ids)
+            return
+        # cannot be removed: hide the entries and stop writes, since their idxs would be reused
+        self.deleted.update(int(i) for i in ids)
+        self.failed = f'{index_name} kept entries of a rolled-back add'
+
+    def _apply_delete(self, idxs: Sequence[int]):
+        with self.lock.write():
+            self.deleted.update(idxs)
+            self.pending.update(idxs)
+
+    def compact(self):
+        """Physically remove pending deletes from indices that support it (the others keep them as tombstones)."""
+        with self.lock.write():
+            if not self.pending:
+                return
+            ids = np.fromiter(self.pending, dtype=np.int64)
+            for name in INDEX_NAMES:
+                index = self.art.get(name)
+                if _removable(index):
+                    index.remove_ids(ids)
+            self.pending = set()
+
+    def expected_ntotal(self, index, rows: int) -> int:
+        """Entries ``index`` should hold over ``rows`` catalog rows: only removable indices lose compacted deletes."""
+        if not _removable(index):
+            return rows
+        return rows - (len(self.deleted) - len(self.pending))
+
+    # -------- reads --------
+    def is_deleted(self, idx: int) -> bool:
+        return int(idx) in self.deleted
+
+    def search(self, index, q: np.ndarray, k: int, **knobs):
+        """Search ``index`` hiding deleted items; over-fetches by the number still in the index.
+
+        Deleted hits are dropped rather than padded: the result is at most ``k`` wide and only
+        rows that came up short end in FAISS's own padding (idx -1, the lowest float32 score).
+        """
+        with self.lock.read():
+            # pending deletes are bounded by compact_every; HNSW tombstones are not, so start
+            # with a capped over-fetch and widen it only for queries that come up short
+            extra = len(self.pending) if _removable(index) else min(len(self.deleted), 4 * k)
+            D, I = ann_index.search(index, q, k + extra, **knobs)
+            if not extra:
+                return D, I
+            deleted = np.fromiter(self.deleted, dtype=np.int64, count=len(self.deleted))
+            limit = min(k + len(self.deleted), index.ntotal)
+            keep = (I >= 0) & ~np.isin(I, deleted)
+            while (keep.sum(axis=1) < k).any() and I.shape[1] < limit:
+                D, I = ann_index.search(index, q, min(2 * I.shape[1], limit), **knobs)
+                keep = (I >= 0) & ~np.isin(I, deleted)
+        width = min(k, int(keep.sum(axis=1).max()) if len(I) else 0)
+        D_out = np.full((len(I), width), np.finfo(np.float32).min, dtype=D.dtype)
+        I_out = np.full((len(I), width), -1, dtype=I.dtype)
+        for r in range(len(I)):
+            d, i = D[r][keep[r]][:width], I[r][keep[r]][:width]
+            D_out[r, :len(d)], I_out[r, :len(i)] = d, i
+        return D_out, I_out
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'wal': self.wal.path,
+            'base_rows': self.base_rows,
+            'added': self.added,
+            'deleted': len(self.deleted),
+            'pending_compaction': len(self.pending),
+            'rows': len(self.art['meta']) if self.art.get('meta') is not None else 0,
+            'writes_failed': self.failed,
+        }
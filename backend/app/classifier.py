@@ -0,0 +1,97 @@
+"""Duplicate classifier scoring over whole candidate arrays.
+
+threshold_clf.pkl holds {'clf', 'alpha', 'best_threshold'}; clf maps a pair's
+(image_sim, text_sim, fused_sim) to a duplicate probability. For a few hundred
+candidates sklearn's per-call input validation costs more than the arithmetic,
+so a binary logistic model is compiled once at load into its weights:
+
+  prob = expit(X @ w + b)
+
+which is what LogisticRegression.predict_proba(X)[:, 1] computes. The compiled
+form is checked against predict_proba on a grid of similarities before it is
+used. Any other classifier is called once per request with the whole (n, 3)
+matrix. Without a classifier (or if it fails) the fused similarity is the
+score and fused >= 0.5 the decision.
+"""
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+from scipy.special import expit
+
+
+class DuplicateScorer:
+    def __init__(self, clf=None, threshold: float = 0.5, weights: Optional[np.ndarray] = None, bias: float = 0.0):
+        self.clf = clf
+        self.threshold = float(threshold)
+        self.weights = weights
+        self.bias = bias
+
+    @property
+    def compiled(self) -> bool:
+        return self.weights is not None
+
+    @property
+    def kind(self) -> str:
+        if self.compiled:
+            return 'numpy'
+        return 'sklearn' if self.clf is not None else 'fused'
+
+    def features(self, img: np.ndarray, txt: np.ndarray, alpha: float) -> np.ndarray:
+        """(n, 3) float32 classifier input: image, text and fused similarity."""
+        img = np.asarray(img, dtype=np.float64)
+        txt = np.asarray(txt, dtype=np.float64)
+        return np.stack([img, txt, alpha * img + (1.0 - alpha) * txt], axis=1).astype(np.float32)
+
+    def score(self, img: np.ndarray, txt: np.ndarray, alpha: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(fused, prob, decision) arrays for paired image/text similarities."""
+        fused = alpha * np.asarray(img, dtype=np.float64) + (1.0 - alpha) * np.asarray(txt, dtype=np.float64)
+        p = None
+        if self.compiled:
+            p = expit(self.features(img, txt, alpha) @ self.weights + self.bias)
+        elif self.clf is not None and len(fused):
+            try:
+                p = self.clf.predict_proba(self.features(img, txt, alpha))[:, 1]
+            except Exception:
+                p = None
+        if p is None:
+            return fused, fused, fused >= 0.5
+        return fused, p, p >= self.threshold
+
+    def stats(self) -> Dict[str, Any]:
+        return {'kind': self.kind, 'threshold': self.threshold}
+
+
+def _logistic_weights(clf) -> Optional[Tuple[np.ndarray, float]]:
+    """(w, b) with predict_proba(X)[:, 1] == expit(X @ w + b), or None if clf is not a binary logistic model."""
+    try:
+        from sklearn.linear_model import LogisticRegression
+    except Exception:
+        return None
+    if not isinstance(clf, LogisticRegression) or len(getattr(clf, 'classes_', ())) != 2:
+        return None
+    w = np.asarray(clf.coef_, dtype=np.float64).ravel()
+    b = float(np.ravel(clf.intercept_)[0])
+    if getattr(clf, 'multi_class', 'auto') == 'multinomial':
+        w, b = 2.0 * w, 2.0 * b  # softmax over (-d, d)
+    return w, b
+
+
+def compile_classifier(clf_obj: Optional[Dict[str, Any]]) -> DuplicateScorer:
+    """Scorer for a loaded threshold_clf.pkl (None gives the fused-similarity fallback)."""
+    clf = (clf_obj or {}).get('clf')
+    threshold = (clf_obj or {}).get('best_threshold', 0.5)
+    if clf is None:
+        return DuplicateScorer()
+    found = _logistic_weights(clf)
+    if found is not None:
+        compiled = DuplicateScorer(clf, threshold, weights=found[0], bias=found[1])
+        grid = np.linspace(-1.0, 1.0, 9)
+        img, txt = (g.ravel() for g in np.meshgrid(grid, grid))
+        probe = compiled.features(img, txt, float(clf_obj.get('alpha', 0.5)))
+        try:
+            expected = clf.predict_proba(probe)[:, 1]
+            if np.allclose(expit(probe @ compiled.weights + compiled.bias), expected, rtol=0.0, atol=1e-9):
+                return compiled
+        except Exception:
+            pass
+    return DuplicateScorer(clf, threshold)
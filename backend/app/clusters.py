@@ -0,0 +1,372 @@
+"""Catalog-wide near-duplicate clusters, built by a batch self-join over the FAISS indices.
+
+Every catalog item is used as a query against faiss_text and faiss_image. A
+pair is a duplicate when the threshold classifier accepts it, exactly as
+/dedup/fused decides: fused = alpha * image_sim + (1 - alpha) * text_sim, and
+prob >= best_threshold. The logistic decision is linear in the two
+similarities, so the lowest fused similarity it can accept is computed up
+front. Any accepted pair has at least that similarity in one modality, so a
+search of both indices for the neighbours above that radius finds every
+candidate. Accepted pairs are merged with union-find, and each connected
+component of two or more items becomes a cluster.
+
+Each item keeps its ``k`` nearest neighbours above the radius per index (a
+k-NN search, so a chunk holds at most chunk * k hits); ``k=0`` keeps all of
+them with a range search, whose memory grows with the largest duplicate
+groups. The search is complete only for flat indices: IVF indices are probed
+at least CLUSTER_MIN_NPROBE lists deep and HNSW at its efSearch, and both can
+miss pairs. info.json records whether the join was exhaustive.
+
+Queries are processed in chunks on a thread pool (FAISS releases the GIL).
+
+Written to ``<artifact_dir>/clusters/``:
+
+  info.json          parameters, counts and the inputs it was built from (meta.csv,
+                     embedding and threshold_clf.pkl fingerprints)
+  cluster_ids.npy    cluster id per catalog idx (-1: no near-duplicate)
+  offsets.npy        (C + 1,) CSR offsets into members
+  members.npy        catalog idxs grouped by cluster, ascending within each cluster
+  stats.npz          per cluster: size, edges, mean_prob, max_prob, mean_fused
+  pairs.npy          (E, 2) accepted duplicate pairs (a < b), the input of the seller ring job
+  pair_prob.npy      (E,) classifier probability of each pair
+
+Cluster ids are ordered by size, largest first.
+
+Usage:
+  python -m app.build_index --clusters [--cluster-workers 8] [--cluster-chunk 2048] [--cluster-k 100]
+"""
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+try:
+    import faiss
+except Exception:
+    faiss = None
+
+CLUSTERS_DIR = 'clusters'
+CLUSTERS_VERSION = 3
+# IVF lists probed per query unless --nprobe says otherwise (faiss defaults to 1)
+CLUSTER_MIN_NPROBE = 32
+STAT_COLUMNS = ('size', 'edges', 'mean_prob', 'max_prob', 'mean_fused')
+
+
+class UnionFind:
+    """Array-backed union-find; ``union`` takes whole edge arrays at once."""
+
+    def __init__(self, n: int):
+        self.parent = np.arange(n, dtype=np.int64)
+
+    def find(self, x: np.ndarray) -> np.ndarray:
+        roots = self.parent[x]
+        while True:
+            up = self.parent[roots]
+            if np.array_equal(up, roots):
+                break
+            roots = up
+        self.parent[x] = roots  # path compression
+        return roots
+
+    def union(self, a: np.ndarray, b: np.ndarray):
+        while len(a):
+            ra, rb = self.find(a), self.find(b)
+            split = ra != rb
+            if not split.any():
+                break
+            ra, rb = ra[split], rb[split]
+            # hook the larger root under the smaller; parents only decrease, so no cycles
+            np.minimum.at(self.parent, np.maximum(ra, rb), np.minimum(ra, rb))
+            a, b = a[split], b[split]
+
+    def labels(self) -> np.ndarray:
+        return self.find(np.arange(len(self.parent)))
+
+
+def decision_rule(clf_obj: Optional[Dict[str, Any]], alpha: float) -> Optional[Tuple[np.ndarray, float]]:
+    """(c_img, c_txt), c0 such that a pair is accepted iff c_img*img + c_txt*txt + c0 >= 0.
+
+    Without a classifier this is the fused >= 0.5 fallback of /dedup/fused; None
+    when the classifier is not a binary logistic model (no linear rule).
+    """
+    from .classifier import _logistic_weights
+
+    clf = (clf_obj or {}).get('clf')
+    if clf is None:
+        return np.array([alpha, 1.0 - alpha]), -0.5
+    found = _logistic_weights(clf)
+    if found is None:
+        return None
+    (w_img, w_txt, w_fused), b = found[0][:3], found[1]
+    th = float(np.clip(clf_obj.get('best_threshold', 0.5), 1e-9, 1 - 1e-9))
+    c = np.array([w_img + alpha * w_fused, w_txt + (1.0 - alpha) * w_fused])
+    return c, b - float(np.log(th / (1.0 - th)))
+
+
+def min_fused_similarity(c: np.ndarray, c0: float, alpha: float) -> Optional[float]:
+    """Smallest alpha*img + (1-alpha)*txt over similarities in [-1, 1]^2 the rule accepts (None: none).
+
+    A linear objective over the box cut by one half-plane is minimized at a box
+    corner or where the boundary line crosses a box edge.
+    """
+    points = [np.array([x, y]) for x in (-1.0, 1.0) for y in (-1.0, 1.0)]
+    for k in (0, 1):
+        if abs(c[k]) > 1e-12:
+            for v in (-1.0, 1.0):
+                p = np.empty(2)
+                p[1 - k] = v
+                p[k] = -(c0 + c[1 - k] * v) / c[k]
+                if -1.0 <= p[k] <= 1.0:
+                    points.append(p)
+    feasible = [p for p in points if c @ p + c0 >= -1e-9]
+    if not feasible:
+        return None
+    return float(min(alpha * p[0] + (1.0 - alpha) * p[1] for p in feasible))
+
+
+def cluster_source(artifact_dir: str, embeddings: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """What a clustering is built from: meta.csv, the embeddings (float32 fingerprints) and threshold_clf.pkl.
+
+    embeddings: the loaded matrices by name (see ``embedding_sources``).
+    """
+    from .embeddings import embedding_sources
+    from .meta_store import _source_fingerprint
+
+    clf_path = os.path.join(artifact_dir, 'threshold_clf.pkl')
+    return {
+        'meta_csv': _source_fingerprint(os.path.join(artifact_dir, 'meta.csv')),
+        'embeddings': embedding_sources(artifact_dir, embeddings),
+        'classifier': _source_fingerprint(clf_path) if os.path.exists(clf_path) else None,
+    }
+
+
+def _neighbours(index, q: np.ndarray, radius: float, k: int):
+    """(query row, neighbour idx, sim) for sims above ``radius``; the k nearest per query (k=0: all)."""
+    if k:
+        D, I = index.search(q, k)
+        hit = (I >= 0) & (D > radius)
+        return np.nonzero(hit)[0], I[hit].astype(np.int64), D[hit]
+    try:
+        lims, D, I = index.range_search(q, radius)
+    except RuntimeError as e:
+        raise ValueError(f'{type(index).__name__} has no range search; cluster with k > 0') from e
+    rows = np.repeat(np.arange(len(q)), np.diff(lims.astype(np.int64)))
+    return rows, I.astype(np.int64), D
+
+
+def _join_chunk(start: int, stop: int, ctx: Dict[str, Any]):
+    ids = np.arange(start, stop)
+    a_parts, b_parts = [], []
+    for embs, index in ctx['sources']:
+        rows, nbrs, _ = _neighbours(index, np.ascontiguousarray(embs.normalized_rows(ids)), ctx['radius'], ctx['k'])
+        a_parts.append(ids[rows])
+        b_parts.append(nbrs)
+    a, b = np.concatenate(a_parts), np.concatenate(b_parts)
+    keep = (a != b) & (b >= 0) & (b < ctx['n'])
+    a, b = np.minimum(a[keep], b[keep]), np.maximum(a[keep], b[keep])
+    key = np.unique(a * ctx['n'] + b)
+    a, b = key // ctx['n'], key % ctx['n']
+    zeros = np.zeros(len(a), dtype=np.float32)
+    img = ctx['image_embs'].pair_dot(a, b) if ctx['image_embs'] is not None else zeros
+    txt = ctx['text_embs'].pair_dot(a, b) if ctx['text_embs'] is not None else zeros
+    fused, prob, ok = ctx['scorer'].score(img, txt, ctx['alpha'])
+    return key[ok], prob[ok].astype(np.float32), fused[ok].astype(np.float32)
+
+
+def build_clusters(artifact_dir: str, workers: Optional[int] = None, chunk: int = 2048, k: int = 100,
+                   radius: Optional[float] = None, nprobe: Optional[int] = None) -> Dict[str, Any]:
+    """Self-join the catalog, cluster accepted pairs and persist the result. Returns info.json."""
+    import pickle
+    from .ann_index import describe, set_search_defaults
+    from .classifier import compile_classifier
+    from .embeddings import _read_manifest, load_embeddings
+
+    t0 = time.perf_counter()
+    manifest = _read_manifest(artifact_dir)
+    text_embs = load_embeddings(artifact_dir, 'text_embs', manifest, mmap=True)
+    image_embs = load_embeddings(artifact_dir, 'image_embs', manifest, mmap=True)
+    clf_obj = None
+    clf_path = os.path.join(artifact_dir, 'threshold_clf.pkl')
+    if os.path.exists(clf_path):
+        with open(clf_path, 'rb') as f:
+            clf_obj = pickle.load(f)
+    alpha = float((clf_obj or {}).get('alpha', 0.5))
+    if radius is None:
+        rule = decision_rule(clf_obj, alpha)
+        if rule is None:
+            raise ValueError('threshold_clf.pkl is not a binary logistic model; pass an explicit radius')
+        radius = min_fused_similarity(*rule, alpha)
+        if radius is None:
+            raise ValueError('the classifier accepts no pair with similarities in [-1, 1]')
+    sources = []
+    exhaustive = True
+    for emb_name, embs in (('text', text_embs), ('image', image_embs)):
+        path = os.path.join(artifact_dir, f'faiss_{emb_name}.index')
+        if embs is not None and os.path.exists(path):
+            index = faiss.read_index(path)
+            desc = describe(index)
+            if 'nlist' in desc:
+                set_search_defaults(index, nprobe=nprobe if nprobe is not None
+                                    else max(desc['nprobe'], min(desc['nlist'], CLUSTER_MIN_NPROBE)))
+                desc = describe(index)
+                exhaustive = exhaustive and desc['nprobe'] >= desc['nlist']
+            elif 'ef_search' in desc:
+                exhaustive = False
+            sources.append((embs, index))
+    if not sources:
+        raise ValueError(f'no embeddings with a FAISS index in {artifact_dir}')
+    if not exhaustive:
+        print('Approximate (IVF/HNSW) indices: pairs the index search misses are not clustered')
+    n = len(sources[0][0])
+    workers = workers or os.cpu_count() or 1
+    ctx = {'sources': sources, 'radius': float(radius) - 1e-6, 'k': k, 'n': n, 'alpha': alpha,
+           'scorer': compile_classifier(clf_obj), 'text_embs': text_embs, 'image_embs': image_embs}
+    print(f'Clustering {n} items: radius {radius:.4f} (fused), {len(sources)} indices, '
+          f'{workers} workers, chunks of {chunk}')
+
+    uf = UnionFind(n)
+    keys, probs, fused = [], [], []
+    omp_threads = faiss.omp_get_max_threads()
+    if workers > 1:
+        faiss.omp_set_num_threads(1)  # parallelism comes from the chunk pool
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            chunks = [(s, min(n, s + chunk)) for s in range(0, n, chunk)]
+            for done, (key, prob, fu) in enumerate(pool.map(lambda se: _join_chunk(se[0], se[1], ctx), chunks), 1):
+                uf.union(key // n, key % n)
+                keys.append(key)
+                probs.append(prob)
+                fused.append(fu)
+                if done % 50 == 0 or done == len(chunks):
+                    print(f'  {min(n, done * chunk)}/{n} queries, {sum(len(x) for x in keys)} accepted pairs')
+    finally:
+        faiss.omp_set_num_threads(omp_threads)
+
+    # a pair found from both ends (or by both indices) is one edge
+    key, first = np.unique(np.concatenate(keys) if keys else np.zeros(0, np.int64), return_index=True)
+    prob = np.concatenate(probs)[first] if probs else np.zeros(0, np.float32)
+    fu = np.concatenate(fused)[first] if fused else np.zeros(0, np.float32)
+    roots = uf.labels()
+    sizes = np.bincount(roots, minlength=n)
+    big = np.flatnonzero(sizes >= 2)
+    order = big[np.lexsort((big, -sizes[big]))]  # largest first
+    root_to_cluster = np.full(n, -1, dtype=np.int64)
+    root_to_cluster[order] = np.arange(len(order))
+    cluster_ids = root_to_cluster[roots]
+    members = np.flatnonzero(cluster_ids >= 0)
+    members = members[np.argsort(cluster_ids[members], kind='stable')]
+    size = sizes[order]
+    offsets = np.r_[0, np.cumsum(size)].astype(np.int64)
+    edge_cluster = cluster_ids[key // n] if len(key) else np.zeros(0, np.int64)
+    edges = np.bincount(edge_cluster, minlength=len(order))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        stats = {
+            'size': size.astype(np.int64),
+            'edges': edges.astype(np.int64),
+            'mean_prob': np.bincount(edge_cluster, weights=prob, minlength=len(order)) / edges,
+            'max_prob': _segment_max(edge_cluster, prob, len(order)),
+            'mean_fused': np.bincount(edge_cluster, weights=fu, minlength=len(order)) / edges,
+        }
+
+    out = os.path.join(artifact_dir, CLUSTERS_DIR)
+    tmp = out + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    np.save(os.path.join(tmp, 'cluster_ids.npy'), cluster_ids)
+    np.save(os.path.join(tmp, 'offsets.npy'), offsets)
+    np.save(os.path.join(tmp, 'members.npy'), members)
+    np.savez(os.path.join(tmp, 'stats.npz'), **stats)
+    np.save(os.path.join(tmp, 'pairs.npy'), np.stack([key // n, key % n], axis=1).astype(np.int64))
+    np.save(os.path.join(tmp, 'pair_prob.npy'), prob.astype(np.float32))
+    info = {
+        'version': CLUSTERS_VERSION,
+        'source': cluster_source(artifact_dir, {'text_embs': text_embs, 'image_embs': image_embs}),
+        'rows': int(n),
+        'clusters': int(len(order)),
+        'clustered_items': int(len(members)),
+        'edges': int(len(key)),
+        'largest': int(size[0]) if len(size) else 0,
+        'radius': float(radius),
+        'alpha': alpha,
+        'best_threshold': float((clf_obj or {}).get('best_threshold', 0.5)),
+        'k': int(k),
+        'exhaustive': exhaustive,
+        'build_s': time.perf_counter() - t0,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    with open(os.path.join(tmp, 'info.json'), 'w') as f:
+        json.dump(info, f, indent=2)
+    shutil.rmtree(out, ignore_errors=True)
+    os.replace(tmp, out)
+    print(f"Clusters: {info['clusters']} clusters covering {info['clustered_items']} items "
+          f"({info['edges']} duplicate pairs, largest {info['largest']}) in {info['build_s']:.1f}s -> {out}")
+    return info
+
+
+def _segment_max(seg: np.ndarray, values: np.ndarray, n: int) -> np.ndarray:
+    out = np.full(n, np.nan)
+    if len(seg):
+        order = np.lexsort((-values, seg))
+        first = order[np.r_[True, seg[order][1:] != seg[order][:-1]]]
+        out[seg[first]] = values[first]
+    return out
+
+
+class Clusters:
+    """Loaded clustering result: constant-time item -> cluster and cluster -> members lookups."""
+
+    def __init__(self, info: Dict[str, Any], cluster_ids: np.ndarray, offsets: np.ndarray, members: np.ndarray,
+                 stats: Dict[str, np.ndarray], pairs: Optional[np.ndarray] = None, pair_prob: Optional[np.ndarray] = None):
+        self.info = info
+        self.cluster_ids = cluster_ids
+        self.offsets = offsets
+        self.members = members
+        self.stats = stats
+        self.pairs = pairs
+        self.pair_prob = pair_prob
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def cluster_of(self, idx: int) -> Optional[int]:
+        """Cluster id of a catalog idx; None for singletons and items added after the job ran."""
+        if not 0 <= idx < len(self.cluster_ids):
+            return None
+        cid = int(self.cluster_ids[idx])
+        return cid if cid >= 0 else None
+
+    def describe(self, cluster_id: int) -> Optional[Dict[str, Any]]:
+        if not 0 <= cluster_id < len(self):
+            return None
+        out: Dict[str, Any] = {'cluster_id': int(cluster_id)}
+        for name in STAT_COLUMNS:
+            v = self.stats[name][cluster_id]
+            out[name] = int(v) if name in ('size', 'edges') else (None if np.isnan(v) else float(v))
+        return out
+
+    def member_idxs(self, cluster_id: int) -> np.ndarray:
+        return self.members[self.offsets[cluster_id]:self.offsets[cluster_id + 1]]
+
+
+def load_clusters(artifact_dir: str, source: Dict[str, Any], mmap: bool = True) -> Optional[Clusters]:
+    """Load a clustering result if it was built from ``source`` (see ``cluster_source``), else None."""
+    root = os.path.join(artifact_dir, CLUSTERS_DIR)
+    try:
+        with open(os.path.join(root, 'info.json'), 'r') as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if info.get('version') != CLUSTERS_VERSION or info.get('source') != source:
+        return None
+    mmap_mode = 'r' if mmap else None
+    with np.load(os.path.join(root, 'stats.npz')) as f:
+        stats = {name: f[name] for name in STAT_COLUMNS}
+    return Clusters(info, np.load(os.path.join(root, 'cluster_ids.npy'), mmap_mode=mmap_mode),
+                    np.load(os.path.join(root, 'offsets.npy')),
+                    np.load(os.path.join(root, 'members.npy'), mmap_mode=mmap_mode), stats,
+                    np.load(os.path.join(root, 'pairs.npy'), mmap_mode=mmap_mode),
+                    np.load(os.path.join(root, 'pair_prob.npy'), mmap_mode=mmap_mode))
@@ -0,0 +1,118 @@
+"""Bounded LRU cache for query embeddings.
+
+Relisted items and UI re-queries send the same titles and images over and
+over. The cache sits in front of the encoders: titles are keyed by their
+normalized text, uploaded images by a hash of the raw bytes. Eviction is
+least-recently-used against both an item limit and a memory limit, and the
+cache can be saved to / restored from a local .npz file across restarts.
+"""
+import hashlib
+import os
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+
+def title_key(title: str) -> str:
+    # all-MiniLM-L6-v2 is uncased and splits on whitespace, so case and
+    # spacing differences encode to the same vector.
+    text = unicodedata.normalize('NFKC', str(title))
+    return 't:' + ' '.join(text.lower().split())
+
+
+def image_key(contents: bytes) -> str:
+    return 'i:' + hashlib.sha1(contents).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, max_items: int = 10000, max_bytes: int = 64 * 1024 * 1024, path: Optional[str] = None):
+        self.max_items = int(max_items)
+        self.max_bytes = int(max_bytes)
+        self.path = path
+        self._data: 'OrderedDict[str, np.ndarray]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @staticmethod
+    def _cost(key: str, vec: np.ndarray) -> int:
+        return int(vec.nbytes) + len(key)
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            vec = self._data.get(key)
+            if vec is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return vec
+
+    def get_many(self, keys: List[str]) -> List[Optional[np.ndarray]]:
+        return [self.get(k) for k in keys]
+
+    def put(self, key: str, vec: np.ndarray):
+        if self.max_items <= 0:
+            return
+        vec = np.array(vec, dtype=np.float32)
+        vec.flags.writeable = False
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= self._cost(key, old)
+            self._data[key] = vec
+            self._bytes += self._cost(key, vec)
+            while self._data and (len(self._data) > self.max_items or self._bytes > self.max_bytes):
+                k, v = self._data.popitem(last=False)
+                self._bytes -= self._cost(k, v)
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            'items': len(self._data),
+            'bytes': self._bytes,
+            'max_items': self.max_items,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits / total) if total else 0.0,
+            'evictions': self.evictions,
+            'path': self.path,
+        }
+
+    def save(self, path: Optional[str] = None) -> bool:
+        path = path or self.path
+        if not path:
+            return False
+        with self._lock:
+            items = list(self._data.items())
+        if not items:
+            return False
+        keys = np.array([k for k, _ in items])
+        vecs = np.stack([v for _, v in items])
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, keys=keys, vecs=vecs)
+        os.replace(tmp, path)
+        return True
+
+    def load(self, path: Optional[str] = None) -> int:
+        """Restore entries saved by ``save``; oldest first so LRU order survives."""
+        path = path or self.path
+        if not path or not os.path.exists(path):
+            return 0
+        with np.load(path, allow_pickle=False) as z:
+            keys, vecs = z['keys'], z['vecs']
+        for k, v in zip(keys.tolist(), vecs):
+            self.put(k, v)
+        return len(keys)
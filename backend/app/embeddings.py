@@ -0,0 +1,304 @@
+"""Embedding matrix storage: memory-mapped loading and float16 / int8 variants.
+
+The notebook writes text_embs.npy / image_embs.npy as float32. Loaded with
+np.load those are copied into every worker's heap. This module can instead
+memory-map them (pages are shared between gunicorn workers) and convert them
+into smaller on-disk forms:
+
+  float16   <name>.f16.npy                              half the size
+  int8      <name>.i8.npy + <name>.i8_scale.npy         a quarter of the size,
+                                                         per-dimension symmetric scale
+
+The chosen storage is recorded in manifest.json under "embedding_storage" so the
+server picks it up without extra configuration. Converted matrices are stored
+L2-normalized (flagged "normalized": true), so cosine similarity is a plain
+inner product at query time.
+
+Usage:
+  python -m app.embeddings --storage int8
+  python -m app.embeddings --storage float16 --remove-source
+"""
+import json
+import os
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+DEFAULT_ARTIFACT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'data', 'siamese_artifacts'))
+EMBEDDING_NAMES = ('text_embs', 'image_embs')
+STORAGE_SUFFIX = {'float32': '.npy', 'float16': '.f16.npy', 'int8': '.i8.npy'}
+
+
+class EmbeddingMatrix:
+    """Row-addressable embedding matrix over float32, float16 or int8 storage.
+
+    Indexing (``m[idxs]``, ``m[a:b]``) always returns float32 rows, dequantized
+    when needed, so callers written against a plain ndarray keep working.
+    Row norms are resolved once at load (see ``prepare_norms``); ``dot`` and
+    ``pair_dot`` then give cosine similarities with a single gathered product.
+
+    Rows added after load (``append``) live in a normalized float32 overlay
+    after the base rows. The overlay is a view into a buffer grown by doubling,
+    so an append copies only the new rows; rows are written before the view
+    that exposes them is published, so concurrent readers see a consistent matrix.
+    """
+
+    def __init__(self, data: np.ndarray, scale: Optional[np.ndarray] = None, storage: str = 'float32',
+                 normalized: bool = False):
+        self.data = data
+        self.scale = None if scale is None else np.asarray(scale, dtype=np.float32)
+        self.storage = storage
+        self.normalized = normalized
+        self.inv_norms: Optional[np.ndarray] = None
+        # fingerprint of the float32 matrix the base rows come from (set by load_embeddings)
+        self.source: Optional[Dict[str, Any]] = None
+        self._extra_buf = np.zeros((0, data.shape[1]), dtype=np.float32)
+        self.extra = self._extra_buf[:0]
+
+    @property
+    def shape(self):
+        return (len(self), self.data.shape[1])
+
+    @property
+    def nbytes(self) -> int:
+        return (int(self.data.nbytes) + int(self._extra_buf.nbytes)
+                + (0 if self.scale is None else int(self.scale.nbytes)))
+
+    def __len__(self) -> int:
+        return int(self.data.shape[0]) + len(self.extra)
+
+    def _base_rows(self, key) -> np.ndarray:
+        rows = np.asarray(self.data[key], dtype=np.float32)
+        if self.scale is not None:
+            rows = rows * self.scale
+        return rows
+
+    def _split(self, idxs: np.ndarray):
+        """Positions of ``idxs`` that fall in the appended overlay, or None if there are none."""
+        if not len(self.extra):
+            return None
+        in_extra = idxs >= self.data.shape[0]
+        return in_extra if in_extra.any() else None
+
+    def __getitem__(self, key) -> np.ndarray:
+        if not len(self.extra):
+            return self._base_rows(key)
+        if isinstance(key, slice):
+            key = np.arange(len(self))[key]
+        idxs = np.asarray(key, dtype=np.int64)
+        if idxs.ndim == 0:
+            return self[idxs.reshape(1)][0]
+        in_extra = self._split(idxs)
+        if in_extra is None:
+            return self._base_rows(idxs)
+        rows = np.empty((len(idxs), self.data.shape[1]), dtype=np.float32)
+        rows[~in_extra] = self._base_rows(idxs[~in_extra])
+        rows[in_extra] = self.extra[idxs[in_extra] - self.data.shape[0]]
+        return rows
+
+    def append(self, rows: np.ndarray) -> np.ndarray:
+        """Append rows (stored L2-normalized) and return their indices."""
+        rows = np.asarray(rows, dtype=np.float32).reshape(-1, self.data.shape[1])
+        norms = np.linalg.norm(rows, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        start = len(self)
+        used = len(self.extra)
+        if used + len(rows) > len(self._extra_buf):
+            buf = np.zeros((max(used + len(rows), 2 * len(self._extra_buf), 64), self.data.shape[1]), dtype=np.float32)
+            buf[:used] = self.extra
+            self._extra_buf = buf
+        self._extra_buf[used:used + len(rows)] = rows / norms
+        self.extra = self._extra_buf[:used + len(rows)]
+        return np.arange(start, start + len(rows))
+
+    def truncate(self, nrows: int):
+        """Drop appended rows from ``nrows`` on (undoes a failed ``append``)."""
+        self.extra = self._extra_buf[:max(0, int(nrows) - self.data.shape[0])]
+
+    def prepare_norms(self, in_place: bool = False, chunk: int = 65536, tol: float = 1e-3):
+        """Compute row norms once.
+
+        Already-normalized matrices need nothing. A private float32 copy is
+        normalized in place; memory-mapped or quantized data keeps a per-row
+        inverse norm instead so the shared pages stay untouched.
+        """
+        if self.normalized:
+            return
+        n = self.data.shape[0]
+        norms = np.empty(n, dtype=np.float32)
+        for s in range(0, n, chunk):
+            norms[s:s + chunk] = np.linalg.norm(self._base_rows(slice(s, s + chunk)), axis=1)
+        if len(norms) == 0 or np.abs(norms - 1.0).max() <= tol:
+            self.normalized = True
+            return
+        norms[norms == 0] = 1.0
+        if in_place and self.scale is None and self.data.dtype == np.float32 and self.data.flags.writeable:
+            self.data /= norms[:, None]
+            self.normalized = True
+        else:
+            self.inv_norms = 1.0 / norms
+
+    def normalized_rows(self, idxs) -> np.ndarray:
+        idxs = np.asarray(idxs, dtype=np.int64)
+        rows = self[idxs]
+        if self.inv_norms is not None:
+            in_extra = self._split(idxs)
+            if in_extra is None:
+                rows *= self.inv_norms[idxs][:, None]
+            else:
+                rows[~in_extra] *= self.inv_norms[idxs[~in_extra]][:, None]
+        return rows
+
+    def dot(self, idxs, q: np.ndarray) -> np.ndarray:
+        """Cosine similarity of rows ``idxs`` with a unit-norm query vector."""
+        idxs = np.asarray(idxs, dtype=np.int64)
+        if len(idxs) == 0:
+            return np.zeros(0, dtype=np.float32)
+        q = np.asarray(q, dtype=np.float32).reshape(-1)
+        in_extra = self._split(idxs)
+        if in_extra is not None:
+            sims = np.empty(len(idxs), dtype=np.float32)
+            sims[in_extra] = self.extra[idxs[in_extra] - self.data.shape[0]] @ q
+            sims[~in_extra] = self.dot(idxs[~in_extra], q)
+            return sims
+        qs = q * self.scale if self.scale is not None else q
+        sims = np.asarray(self.data[idxs], dtype=np.float32) @ qs
+        if self.inv_norms is not None:
+            sims *= self.inv_norms[idxs]
+        return sims
+
+    def pair_dot(self, a, b) -> np.ndarray:
+        """Row-wise cosine similarity of pairs (a[i], b[i])."""
+        return np.einsum('ij,ij->i', self.normalized_rows(a), self.normalized_rows(b))
+
+
+def quantize_int8(x: np.ndarray, chunk: int = 65536):
+    """Symmetric per-dimension int8 quantization. Returns (q, scale)."""
+    amax = np.zeros(x.shape[1], dtype=np.float32)
+    for s in range(0, len(x), chunk):
+        np.maximum(amax, np.abs(np.asarray(x[s:s + chunk], dtype=np.float32)).max(axis=0), out=amax)
+    scale = amax / 127.0
+    scale[scale == 0] = 1.0
+    q = np.empty(x.shape, dtype=np.int8)
+    for s in range(0, len(x), chunk):
+        block = np.asarray(x[s:s + chunk], dtype=np.float32) / scale
+        q[s:s + chunk] = np.clip(np.rint(block), -127, 127).astype(np.int8)
+    return q, scale
+
+
+def _read_manifest(artifact_dir: str) -> Dict[str, Any]:
+    path = os.path.join(artifact_dir, 'manifest.json')
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            return json.load(f)
+    return {}
+
+
+def _write_manifest(artifact_dir: str, manifest: Dict[str, Any]):
+    path = os.path.join(artifact_dir, 'manifest.json')
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, path)
+
+
+def _file_fingerprint(path: str) -> Dict[str, Any]:
+    st = os.stat(path)
+    return {'file': os.path.basename(path), 'size': int(st.st_size), 'mtime': float(st.st_mtime)}
+
+
+def load_embeddings(artifact_dir: str, name: str, manifest: Optional[Dict[str, Any]] = None,
+                    mmap: bool = False, storage: Optional[str] = None) -> Optional[EmbeddingMatrix]:
+    """Load one embedding matrix.
+
+    storage: 'float32' | 'float16' | 'int8'; defaults to the manifest entry,
+    falling back to whatever file is present.
+    """
+    entry = ((manifest or {}).get('embedding_storage') or {}).get(name) or {}
+    wanted = [storage] if storage else []
+    if entry.get('storage'):
+        wanted.append(entry['storage'])
+    wanted += ['float32', 'float16', 'int8']
+    mmap_mode = 'r' if mmap else None
+    for st in wanted:
+        path = os.path.join(artifact_dir, name + STORAGE_SUFFIX[st])
+        if not os.path.exists(path):
+            continue
+        data = np.load(path, mmap_mode=mmap_mode)
+        scale = None
+        if st == 'int8':
+            scale = np.load(os.path.join(artifact_dir, name + '.i8_scale.npy'))
+        normalized = bool(entry.get('normalized')) and entry.get('storage') == st
+        m = EmbeddingMatrix(data, scale=scale, storage=st, normalized=normalized)
+        if st == 'float32':
+            m.source = _file_fingerprint(path)
+        elif entry.get('storage') == st:
+            m.source = entry.get('source')
+        m.prepare_norms(in_place=not mmap)
+        return m
+    return None
+
+
+def embedding_sources(artifact_dir: str, embeddings: Optional[Dict[str, Optional[EmbeddingMatrix]]] = None
+                      ) -> Dict[str, Any]:
+    """float32 fingerprint (``EmbeddingMatrix.source``) of each embedding matrix, for results derived from them.
+
+    embeddings: the loaded matrices by name; loaded memory-mapped from ``artifact_dir`` when omitted.
+    """
+    if embeddings is None:
+        manifest = _read_manifest(artifact_dir)
+        embeddings = {name: load_embeddings(artifact_dir, name, manifest, mmap=True)
+                      for name in ('text_embs', 'image_embs')}
+    return {name: m.source for name, m in embeddings.items() if m is not None}
+
+
+def _normalized_copy(x: np.ndarray, chunk: int = 65536) -> np.ndarray:
+    out = np.empty(x.shape, dtype=np.float32)
+    for s in range(0, len(x), chunk):
+        block = np.asarray(x[s:s + chunk], dtype=np.float32)
+        norms = np.linalg.norm(block, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        out[s:s + chunk] = block / norms
+    return out
+
+
+def convert_embeddings(artifact_dir: str, storage: str, remove_source: bool = False) -> Dict[str, Any]:
+    """Write normalized float16/int8 copies of the float32 matrices and record them in manifest.json."""
+    manifest = _read_manifest(artifact_dir)
+    records = manifest.get('embedding_storage') or {}
+    for name in EMBEDDING_NAMES:
+        src = os.path.join(artifact_dir, name + '.npy')
+        if not os.path.exists(src):
+            continue
+        x = np.load(src, mmap_mode='r')
+        out = os.path.join(artifact_dir, name + STORAGE_SUFFIX[storage])
+        rec: Dict[str, Any] = {'storage': storage, 'file': os.path.basename(out), 'shape': list(x.shape),
+                               'source': _file_fingerprint(src)}
+        if storage != 'float32':
+            x = _normalized_copy(x)
+            rec['normalized'] = True
+        if storage == 'float16':
+            np.save(out, np.asarray(x, dtype=np.float16))
+        elif storage == 'int8':
+            q, scale = quantize_int8(x)
+            np.save(out, q)
+            np.save(os.path.join(artifact_dir, name + '.i8_scale.npy'), scale)
+            rec['scale'] = name + '.i8_scale.npy'
+        if storage != 'float32' and remove_source:
+            del x
+            os.remove(src)
+        records[name] = rec
+        print(f'{name}: {storage} -> {out}')
+    manifest['embedding_storage'] = records
+    _write_manifest(artifact_dir, manifest)
+    return records
+
+
+if __name__ == '__main__':
+    import argparse
+    ap = argparse.ArgumentParser(description='Convert embedding artifacts to float16 or int8 storage')
+    ap.add_argument('--artifact-dir', default=DEFAULT_ARTIFACT_DIR)
+    ap.add_argument('--storage', choices=sorted(STORAGE_SUFFIX), default='int8')
+    ap.add_argument('--remove-source', action='store_true', help='delete the float32 .npy files after conversion')
+    args = ap.parse_args()
+    convert_embeddings(args.artifact_dir, args.storage, remove_source=args.remove_source)
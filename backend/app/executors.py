@@ -0,0 +1,77 @@
+"""Executor layer that keeps blocking work off the asyncio event loop.
+
+Each pipeline stage gets its own bounded thread pool:
+
+  search     FAISS searches and numpy rescoring (release the GIL, so several threads help)
+  inference  image decode/preprocess and torch encoder calls (kept small; torch is already multi-threaded)
+
+Handlers ``await STAGE.run(fn, ...)`` from async code or ``STAGE.call(fn, ...)``
+from sync code; the caller's context variables (e.g. its pinned artifact
+generation) are carried into the worker thread. Every stage tracks queue depth and how long work waited
+before a thread picked it up, which is what to watch when sizing the pools.
+"""
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+
+class StageExecutor:
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max(1, int(max_workers))
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f'{name}-stage')
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._stats = {'submitted': 0, 'completed': 0, 'errors': 0,
+                       'wait_s_total': 0.0, 'wait_s_max': 0.0, 'run_s_total': 0.0}
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        enqueued = time.perf_counter()
+        with self._lock:
+            self._queued += 1
+            self._stats['submitted'] += 1
+
+        def task():
+            started = time.perf_counter()
+            wait = started - enqueued
+            with self._lock:
+                self._queued -= 1
+                self._running += 1
+                self._stats['wait_s_total'] += wait
+                self._stats['wait_s_max'] = max(self._stats['wait_s_max'], wait)
+            ok = False
+            try:
+                out = fn(*args, **kwargs)
+                ok = True
+                return out
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._stats['completed'] += 1
+                    self._stats['run_s_total'] += time.perf_counter() - started
+                    if not ok:
+                        self._stats['errors'] += 1
+
+        return self._pool.submit(contextvars.copy_context().run, task)
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def call(self, fn: Callable, *args, **kwargs) -> Any:
+        return self.submit(fn, *args, **kwargs).result()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            s = dict(self._stats)
+            s['queued'] = self._queued
+            s['running'] = self._running
+        done = s['completed'] or 1
+        s['wait_ms_mean'] = 1000.0 * s.pop('wait_s_total') / done
+        s['wait_ms_max'] = 1000.0 * s.pop('wait_s_max')
+        s['run_ms_mean'] = 1000.0 * s.pop('run_s_total') / done
+        s['max_workers'] = self.max_workers
+        return s
@@ -0,0 +1,482 @@
+"""Seller fraud model: per-seller features, IsolationForest and heuristic risk scores.
+
+Built offline next to the other artifacts so no request pays for training:
+
+  fraud_model/info.json             version, seller count, columns and the meta.csv / embeddings it was built from
+  fraud_model/model.pkl             IsolationForest fitted on the seller feature matrix
+  fraud_model/anomaly_scores.npy    -score_samples of every seller (higher is more anomalous)
+  fraud_model/anomaly_order.npy     seller positions by descending anomaly score
+  fraud_model/risk_order.npy        seller positions by descending risk score
+  fraud_model/seller_ids.npy        seller ids in groupby order (position == seller code)
+  fraud_model/seller_features.npy   (S, d) float32 normalized mean text embedding per seller
+  fraud_model/group_offsets.npy     (S + 1,) CSR offsets into group_rows
+  fraud_model/group_rows.npy        catalog idxs grouped by seller
+  fraud_model/features.npz          per-seller metric columns of ``features_df``
+
+The server memory-maps the arrays at load and only builds in-process when the
+directory is missing or was built from a different meta.csv or embeddings. When the ring job
+(rings.py) ran over the same sellers, ``with_ring_features`` adds its columns
+and raises the risk score of ring members whose listings are duplicated at others. Items added to
+the live catalog after the build are not part of the model until it is rebuilt.
+
+Usage:
+  python -m app.build_index --fraud-model [--out data/siamese_artifacts]
+"""
+import json
+import os
+import pickle
+import shutil
+import time
+from collections.abc import Mapping
+from typing import Any, Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+FRAUD_MODEL_DIR = 'fraud_model'
+FRAUD_MODEL_VERSION = 4
+FEATURE_COLUMNS = ('count', 'mean_text_sim', 'mean_image_sim', 'label_entropy', 'unique_title_ratio', 'risk_score')
+# risk boost of ring members (with_ring_features): max_overlap and capped cross-seller pairs
+RING_OVERLAP_WEIGHT = 0.5
+RING_PAIRS_WEIGHT = 0.5
+RING_PAIRS_CAP = 100
+
+
+def _order(scores: np.ndarray) -> np.ndarray:
+    """Positions by descending score (NaN last, ties by position)."""
+    return np.argsort(-scores, kind='stable')
+
+
+def _ranks(order: np.ndarray) -> np.ndarray:
+    ranks = np.empty(len(order), dtype=np.int64)
+    ranks[order] = np.arange(1, len(order) + 1)
+    return ranks
+
+
+class SellerDirectory:
+    """Constant-time seller lookup with scores and rankings fixed when the model is built.
+
+    Seller ids are matched by their string form, as they arrive in URLs. The
+    descending orders are computed once per build, so a ranking page is a slice.
+    """
+
+    def __init__(self, seller_ids: np.ndarray, counts: np.ndarray, anomaly_scores: np.ndarray,
+                 risk_scores: Optional[np.ndarray] = None, anomaly_order: Optional[np.ndarray] = None,
+                 risk_order: Optional[np.ndarray] = None):
+        self.seller_ids = seller_ids
+        self.counts = counts
+        self.anomaly_scores = anomaly_scores
+        self.risk_scores = risk_scores
+        self.anomaly_order = _order(anomaly_scores) if anomaly_order is None else anomaly_order
+        self.anomaly_rank = _ranks(self.anomaly_order)
+        self.risk_order = self.risk_rank = None
+        if risk_scores is not None:
+            self.risk_order = _order(risk_scores) if risk_order is None else risk_order
+            self.risk_rank = _ranks(self.risk_order)
+        self._positions: Optional[Dict[str, int]] = None
+
+    def __len__(self) -> int:
+        return len(self.seller_ids)
+
+    def position(self, seller_id) -> Optional[int]:
+        if self._positions is None:
+            # reversed so the first of any ids with the same string form wins
+            keys = [str(x) for x in self.seller_ids.tolist()]
+            self._positions = dict(zip(reversed(keys), range(len(keys) - 1, -1, -1)))
+        return self._positions.get(str(seller_id))
+
+    def lookup(self, seller_id) -> Optional[Dict[str, Any]]:
+        i = self.position(seller_id)
+        if i is None:
+            return None
+        out = {
+            'seller_id': str(seller_id),
+            'anomaly_score': float(self.anomaly_scores[i]),
+            'count': int(self.counts[i]),
+            'anomaly_rank': int(self.anomaly_rank[i]),
+        }
+        if self.risk_scores is not None:
+            out['risk_score'] = float(self.risk_scores[i])
+            out['risk_rank'] = int(self.risk_rank[i])
+        return out
+
+
+    def ranked(self, by: str = 'anomaly', offset: int = 0, limit: int = 20, min_count: int = 0,
+               min_score: Optional[float] = None):
+        """One page of seller positions by descending score, and how many sellers pass the filters.
+
+        Without filters a page is a slice of the presorted order; filters cost
+        one vectorized pass over it (scores >= min_score form a prefix of the order).
+        """
+        if by == 'risk':
+            if self.risk_order is None:
+                raise ValueError('risk scores are not available')
+            order, scores = self.risk_order, self.risk_scores
+        else:
+            order, scores = self.anomaly_order, self.anomaly_scores
+        if min_score is not None:
+            order = order[:int(np.count_nonzero(scores >= min_score))]
+        if min_count > 1:
+            order = order[self.counts[order] >= min_count]
+        return order[offset:offset + limit], len(order)
+
+
+class SellerGroups(Mapping):
+    """seller_id -> catalog idxs, backed by CSR arrays (offsets into one row array)."""
+
+    def __init__(self, directory: SellerDirectory, offsets: np.ndarray, rows: np.ndarray):
+        self.directory = directory
+        self.offsets = offsets
+        self.rows = rows
+
+    def __getitem__(self, seller_id) -> np.ndarray:
+        p = self.directory.position(seller_id)
+        if p is None:
+            raise KeyError(seller_id)
+        return self.rows[self.offsets[p]:self.offsets[p + 1]]
+
+    def __contains__(self, seller_id) -> bool:
+        return self.directory.position(seller_id) is not None
+
+    def __iter__(self):
+        return iter(self.directory.seller_ids.tolist())
+
+    def __len__(self) -> int:
+        return len(self.directory)
+
+
+def _norm(x: np.ndarray) -> np.ndarray:
+    denom = np.linalg.norm(x, axis=-1, keepdims=True)
+    denom[denom == 0] = 1.0
+    return x / denom
+
+
+def _seller_sums(embs, order: np.ndarray, counts: np.ndarray, with_sums: bool = True, block: int = 16384):
+    """Per-seller embedding sums and within-seller pairwise cosine totals in one pass.
+
+    ``order`` lists row idxs grouped by seller (``counts`` rows each). Rows are
+    gathered a block at a time and reduced with ``np.add.reduceat``; a seller
+    that straddles two blocks is carried over, so only the (S, d) sums are kept.
+    For unit vectors sum_{i != j} u_i . u_j = |sum u|^2 - sum |u_i|^2, so no
+    pairs are materialized.
+    """
+    n_sellers, d = len(counts), embs.shape[1]
+    sums = np.zeros((n_sellers, d), dtype=np.float32) if with_sums else None
+    pair_total = np.zeros(n_sellers, dtype=np.float64)
+    seg_of_pos = np.repeat(np.arange(n_sellers), counts)
+    carry = None
+    for start in range(0, len(order), block):
+        seg = seg_of_pos[start:start + block]
+        rows = np.asarray(embs[order[start:start + block]], dtype=np.float32)
+        unit = _norm(rows)
+        bounds = np.flatnonzero(np.r_[True, seg[1:] != seg[:-1]])
+        owners = seg[bounds]
+        raw = np.add.reduceat(rows, bounds, axis=0, dtype=np.float64) if with_sums else None
+        usum = np.add.reduceat(unit, bounds, axis=0, dtype=np.float64)
+        usq = np.add.reduceat(np.einsum('ij,ij->i', unit, unit), bounds, dtype=np.float64)
+        if carry is not None and carry[0] == owners[0]:
+            if with_sums:
+                raw[0] += carry[1]
+            usum[0] += carry[2]
+            usq[0] += carry[3]
+        elif carry is not None:
+            _finish_sellers(sums, pair_total, *carry)
+        # the last seller may continue in the next block
+        carry = (owners[-1], raw[-1] if with_sums else None, usum[-1], usq[-1])
+        _finish_sellers(sums, pair_total, owners[:-1], raw[:-1] if with_sums else None, usum[:-1], usq[:-1])
+    if carry is not None:
+        _finish_sellers(sums, pair_total, *carry)
+    return sums, pair_total
+
+
+def _finish_sellers(sums, pair_total, owners, raw, usum, usq):
+    if sums is not None:
+        sums[owners] = raw
+    pair_total[owners] = np.einsum('...j,...j->...', usum, usum) - usq
+
+
+def _mean_pair_sim(pair_total: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Mean cosine similarity over all distinct pairs within each seller (NaN below two items)."""
+    n = counts.astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sims = pair_total / (n * (n - 1))
+    sims[counts < 2] = np.nan
+    return sims
+
+
+def seller_codes(meta):
+    """Sellers in groupby order: (seller_ids, counts, order, codes), or None without a seller_id column.
+
+    ``order`` holds catalog idxs grouped by seller; codes[i] is the position of
+    row i's seller (-1: no seller). Every seller-level artifact uses these positions.
+    """
+    if meta is None or 'seller_id' not in meta.columns:
+        return None
+    seller_col = pd.Series(meta.column('seller_id'), dtype=object)
+    groups = seller_col.groupby(seller_col).indices
+    seller_ids = list(groups.keys())
+    counts = np.fromiter((len(v) for v in groups.values()), dtype=np.int64, count=len(groups))
+    order = np.concatenate(list(groups.values())).astype(np.int64) if groups else np.zeros(0, np.int64)
+    codes = np.full(len(seller_col), -1, dtype=np.int64)
+    codes[order] = np.repeat(np.arange(len(seller_ids)), counts)
+    return seller_ids, counts, order, codes
+
+
+def build_fraud_model(meta, text_embs, image_embs=None) -> Optional[Dict[str, Any]]:
+    """Fit the seller model over a MetaStore and embedding matrices.
+
+    Returns the FRAUD entries (model, seller_ids, seller_features, counts,
+    seller_groups, features_df, directory), or None without seller ids or with fewer than 5 sellers.
+    """
+    from sklearn.ensemble import IsolationForest
+
+    if meta is None or text_embs is None:
+        return None
+    grouped = seller_codes(meta)
+    if grouped is None or len(grouped[0]) < 5:
+        return None
+    seller_ids, counts, order, codes = grouped
+    # Mean text embedding per seller, plus within-seller similarity from the same pass
+    text_sums, text_pairs = _seller_sums(text_embs, order, counts)
+    text_sums /= counts[:, None]
+    X = _norm(text_sums).astype('float32')
+    del text_sums
+    model = IsolationForest(n_estimators=200, contamination='auto', random_state=42)
+    model.fit(X)
+    # Compute additional seller metrics (no training)
+    try:
+        mean_text_sim = _mean_pair_sim(text_pairs, counts)
+        if image_embs is not None:
+            mean_image_sim = _mean_pair_sim(_seller_sums(image_embs, order, counts, with_sums=False)[1], counts)
+        else:
+            mean_image_sim = np.full(len(seller_ids), np.nan)
+
+        has_seller = codes >= 0
+        row_sellers = codes[has_seller]
+        label_entropy = np.full(len(seller_ids), np.nan)
+        if 'label_group' in meta.columns:
+            labels = pd.Series(meta.column('label_group'), dtype=object)[has_seller].map(str)
+            label_codes = pd.factorize(labels)[0]
+            width = label_codes.max() + 1
+            pair_keys, pair_counts = np.unique(row_sellers * width + label_codes, return_counts=True)
+            p = pair_counts / counts[pair_keys // width]
+            label_entropy = np.bincount(pair_keys // width, weights=-p * np.log(p + 1e-12), minlength=len(seller_ids))
+        unique_title_ratio = np.full(len(seller_ids), np.nan)
+        if 'title' in meta.columns:
+            titles = pd.Series(meta.column('title'), dtype=object)[has_seller]
+            titles = titles.map(lambda x: '' if x is None else str(x)).str.strip().str.lower()
+            title_codes = pd.factorize(titles)[0]
+            width = title_codes.max() + 1
+            uniq = np.unique(row_sellers * width + title_codes) // width
+            unique_title_ratio = np.bincount(uniq, minlength=len(seller_ids)) / np.maximum(counts, 1)
+
+        features_df = pd.DataFrame({
+            'seller_id': seller_ids,
+            'count': counts.astype(int),
+            'mean_text_sim': mean_text_sim,
+            'mean_image_sim': mean_image_sim,
+            'label_entropy': label_entropy,
+            'unique_title_ratio': unique_title_ratio,
+        })
+        # simple risk score (higher is riskier): high count, high similarity, low entropy, low unique titles
+        mt, mi, ent, utr = (np.nan_to_num(features_df[c].to_numpy(dtype=np.float64), nan=0.0)
+                            for c in ('mean_text_sim', 'mean_image_sim', 'label_entropy', 'unique_title_ratio'))
+        features_df['risk_score'] = ((0.4 * mt + 0.3 * mi + 0.2 * (1.0 - np.minimum(ent, 5.0) / 5.0) + 0.1 * (1.0 - utr))
+                                     * (1.0 + np.minimum(counts, 100) / 100.0))
+    except Exception:
+        features_df = None
+
+    ids = np.array(seller_ids)
+    return _assemble(model, ids, X, np.r_[0, np.cumsum(counts)].astype(np.int64), order, features_df,
+                     -model.score_samples(X))
+
+
+def _assemble(model, ids, X, offsets, rows, features_df, anomaly_scores,
+              orders: Optional[Dict[str, np.ndarray]] = None) -> Dict[str, Any]:
+    counts = np.diff(offsets)
+    risk = features_df['risk_score'].to_numpy() if features_df is not None else None
+    orders = orders or {}
+    directory = SellerDirectory(ids, counts, anomaly_scores, risk, anomaly_order=orders.get('anomaly'),
+                                risk_order=orders.get('risk'))
+    return {
+        'model': model,
+        'seller_ids': ids,
+        'seller_features': X,
+        'counts': counts,
+        'seller_groups': SellerGroups(directory, offsets, rows),
+        'features_df': features_df,
+        'directory': directory,
+    }
+
+
+def with_ring_features(fraud: Dict[str, Any], rings) -> Dict[str, Any]:
+    """Copy of ``fraud`` with the per-seller ring columns and a risk score that weighs them.
+
+    The risk_score of a seller in a ring is scaled by 1 + RING_OVERLAP_WEIGHT * max_overlap +
+    RING_PAIRS_WEIGHT * min(cross_seller_pairs, RING_PAIRS_CAP) / RING_PAIRS_CAP, so a ring member
+    whose listings are largely duplicated at another seller ranks up to twice as risky. Sellers in
+    no ring (incidental matches below the ring job's min_pairs / min_overlap) keep their score.
+    The anomaly score (IsolationForest over mean title embeddings) is unchanged.
+    """
+    df = fraud.get('features_df')
+    if df is None:
+        return fraud
+    cross_pairs = np.asarray(rings.cross_pairs)
+    max_overlap = np.asarray(rings.max_overlap)
+    ring_ids = np.asarray(rings.ring_ids)
+    boost = (RING_OVERLAP_WEIGHT * np.nan_to_num(max_overlap.astype(np.float64))
+             + RING_PAIRS_WEIGHT * np.minimum(cross_pairs, RING_PAIRS_CAP) / float(RING_PAIRS_CAP))
+    risk = df['risk_score'].to_numpy(dtype=np.float64) * (1.0 + np.where(ring_ids >= 0, boost, 0.0))
+    df = df.assign(cross_seller_pairs=cross_pairs, max_overlap=max_overlap, ring_partners=np.asarray(rings.partners),
+                   ring_id=ring_ids, risk_score=risk)
+    old: SellerDirectory = fraud['directory']
+    directory = SellerDirectory(old.seller_ids, old.counts, old.anomaly_scores, risk, anomaly_order=old.anomaly_order)
+    groups: SellerGroups = fraud['seller_groups']
+    return {**fraud, 'features_df': df, 'directory': directory,
+            'seller_groups': SellerGroups(directory, groups.offsets, groups.rows)}
+
+
+def seller_duplicate_pairs(idxs: np.ndarray, text_embs, image_embs, alpha: float = 0.5, use: str = 'fused',
+                           threshold: float = 0.8, top: int = 50, block: int = 1024) -> Dict[str, Any]:
+    """The ``top`` highest-scoring pairs (i < j) among a seller's listings with score >= threshold.
+
+    Every pair is scored: the seller's normalized rows are multiplied block by
+    block (E_i @ E_j.T over the upper triangle) and each block keeps at most
+    ``top`` candidates, so memory is O(block^2) however large the seller is.
+    use = 'fused' | 'text' | 'image'; fused falls back to image when text is missing.
+    Returns arrays a, b (catalog idxs), score, text, image and fused (None when unavailable).
+    """
+    idxs = np.asarray(idxs, dtype=np.int64)
+    kind = use if use in ('text', 'image') else 'fused'
+    if kind == 'fused' and (text_embs is None or image_embs is None):
+        kind = 'image'
+    parts = {'text': [(1.0, text_embs)], 'image': [(1.0, image_embs)],
+             'fused': [(alpha, image_embs), (1.0 - alpha, text_embs)]}[kind]
+    a_pos = np.zeros(0, dtype=np.int64)
+    b_pos = np.zeros(0, dtype=np.int64)
+    best = np.zeros(0, dtype=np.float32)
+    if top > 0 and len(idxs) >= 2 and all(m is not None for _, m in parts):
+        upper = np.triu(np.ones((block, block), dtype=bool), 1)
+        for i0 in range(0, len(idxs), block):
+            rows_i = [m.normalized_rows(idxs[i0:i0 + block]) for _, m in parts]
+            for j0 in range(i0, len(idxs), block):
+                rows_j = rows_i if j0 == i0 else [m.normalized_rows(idxs[j0:j0 + block]) for _, m in parts]
+                sims = sum(w * (ri @ rj.T) for (w, _), ri, rj in zip(parts, rows_i, rows_j))
+                if j0 == i0:
+                    sims = np.where(upper[:len(sims), :len(sims)], sims, -np.inf)
+                flat = sims.ravel()
+                hits = flat >= threshold
+                if np.count_nonzero(hits) <= top:
+                    cand = np.flatnonzero(hits)
+                else:
+                    cand = np.argpartition(-flat, top - 1)[:top]
+                if not len(cand):
+                    continue
+                a_pos = np.concatenate([a_pos, i0 + cand // sims.shape[1]])
+                b_pos = np.concatenate([b_pos, j0 + cand % sims.shape[1]])
+                best = np.concatenate([best, flat[cand].astype(np.float32)])
+                if len(best) > top:
+                    keep = np.argpartition(-best, top - 1)[:top]
+                    a_pos, b_pos, best = a_pos[keep], b_pos[keep], best[keep]
+    # highest score first; ties in listing order
+    order = np.lexsort((b_pos, a_pos, -best))
+    a_idx, b_idx = idxs[a_pos[order]], idxs[b_pos[order]]
+    txt = text_embs.pair_dot(a_idx, b_idx) if text_embs is not None else None
+    img = image_embs.pair_dot(a_idx, b_idx) if image_embs is not None else None
+    fused = alpha * img + (1.0 - alpha) * txt if txt is not None and img is not None else None
+    return {'a': a_idx, 'b': b_idx, 'score': {'text': txt, 'image': img, 'fused': fused}[kind],
+            'text': txt, 'image': img, 'fused': fused}
+
+
+def fraud_model_source(artifact_dir: str, embeddings: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """What the model is built from: meta.csv and the embeddings (float32 fingerprints, see ``embedding_sources``)."""
+    from .embeddings import embedding_sources
+    from .meta_store import _source_fingerprint
+
+    return {'meta_csv': _source_fingerprint(os.path.join(artifact_dir, 'meta.csv')),
+            'embeddings': embedding_sources(artifact_dir, embeddings)}
+
+
+def save_fraud_model(artifact_dir: str, fraud: Dict[str, Any], source: Dict[str, Any]) -> str:
+    """Write a built model to ``<artifact_dir>/fraud_model`` (staged, then swapped in)."""
+    out = os.path.join(artifact_dir, FRAUD_MODEL_DIR)
+    tmp = out + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    groups: SellerGroups = fraud['seller_groups']
+    with open(os.path.join(tmp, 'model.pkl'), 'wb') as f:
+        pickle.dump(fraud['model'], f)
+    directory: SellerDirectory = fraud['directory']
+    np.save(os.path.join(tmp, 'anomaly_scores.npy'), directory.anomaly_scores)
+    np.save(os.path.join(tmp, 'anomaly_order.npy'), directory.anomaly_order)
+    if directory.risk_order is not None:
+        np.save(os.path.join(tmp, 'risk_order.npy'), directory.risk_order)
+    np.save(os.path.join(tmp, 'seller_ids.npy'), fraud['seller_ids'], allow_pickle=True)
+    np.save(os.path.join(tmp, 'seller_features.npy'), fraud['seller_features'])
+    np.save(os.path.join(tmp, 'group_offsets.npy'), groups.offsets)
+    np.save(os.path.join(tmp, 'group_rows.npy'), groups.rows)
+    df = fraud.get('features_df')
+    if df is not None:
+        np.savez(os.path.join(tmp, 'features.npz'), **{c: df[c].to_numpy() for c in FEATURE_COLUMNS})
+    info = {
+        'version': FRAUD_MODEL_VERSION,
+        'source': source,
+        'seller_rows': int(len(groups.rows)),
+        'sellers': int(len(groups)),
+        'features': list(FEATURE_COLUMNS) if df is not None else None,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    with open(os.path.join(tmp, 'info.json'), 'w') as f:
+        json.dump(info, f, indent=2)
+    shutil.rmtree(out, ignore_errors=True)
+    os.replace(tmp, out)
+    return out
+
+
+def load_fraud_model(artifact_dir: str, source: Dict[str, Any], mmap: bool = True) -> Optional[Dict[str, Any]]:
+    """Load a persisted model if it was built from ``source`` (see ``fraud_model_source``), else None."""
+    root = os.path.join(artifact_dir, FRAUD_MODEL_DIR)
+    try:
+        with open(os.path.join(root, 'info.json'), 'r') as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if info.get('version') != FRAUD_MODEL_VERSION or info.get('source') != source:
+        return None
+    mmap_mode = 'r' if mmap else None
+    with open(os.path.join(root, 'model.pkl'), 'rb') as f:
+        model = pickle.load(f)
+    ids = np.load(os.path.join(root, 'seller_ids.npy'), allow_pickle=True)
+    features_df = None
+    if info.get('features'):
+        with np.load(os.path.join(root, 'features.npz')) as cols:
+            features_df = pd.DataFrame({'seller_id': ids, **{c: cols[c] for c in info['features']}})
+    return _assemble(model, ids, np.load(os.path.join(root, 'seller_features.npy'), mmap_mode=mmap_mode),
+                     np.load(os.path.join(root, 'group_offsets.npy')),
+                     np.load(os.path.join(root, 'group_rows.npy'), mmap_mode=mmap_mode), features_df,
+                     np.load(os.path.join(root, 'anomaly_scores.npy')),
+                     {'anomaly': np.load(os.path.join(root, 'anomaly_order.npy'), mmap_mode=mmap_mode),
+                      'risk': np.load(os.path.join(root, 'risk_order.npy'), mmap_mode=mmap_mode)
+                      if features_df is not None else None})
+
+
+def build_artifact_fraud_model(artifact_dir: str) -> Optional[Dict[str, Any]]:
+    """Build and persist the fraud model from the meta.csv and embeddings in ``artifact_dir``."""
+    from .embeddings import _read_manifest, load_embeddings
+    from .meta_store import load_meta_store
+
+    meta_path = os.path.join(artifact_dir, 'meta.csv')
+    manifest = _read_manifest(artifact_dir)
+    meta = load_meta_store(meta_path)
+    text_embs = load_embeddings(artifact_dir, 'text_embs', manifest, mmap=True)
+    image_embs = load_embeddings(artifact_dir, 'image_embs', manifest, mmap=True)
+    t0 = time.perf_counter()
+    fraud = build_fraud_model(meta, text_embs, image_embs)
+    if fraud is None:
+        print('No seller_id column (or fewer than 5 sellers) in meta.csv; skipping the fraud model')
+        return None
+    out = save_fraud_model(artifact_dir, fraud,
+                           fraud_model_source(artifact_dir, {'text_embs': text_embs, 'image_embs': image_embs}))
+    elapsed = time.perf_counter() - t0
+    print(f"Fraud model: {len(fraud['seller_ids'])} sellers over {len(meta)} rows in {elapsed:.1f}s -> {out}")
+    return {'sellers': int(len(fraud['seller_ids'])), 'rows': int(len(meta)), 'build_s': elapsed}
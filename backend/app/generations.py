@@ -0,0 +1,169 @@
+"""Artifact generations: load a new artifact set in the background and swap it in atomically.
+
+The server's module-level ``ART`` is a view onto the current generation. Each
+request pins the generation that was current when it arrived (a context
+variable set by middleware; StageExecutor threads inherit it), so a swap never
+changes the artifacts under an in-flight request. At most two generations are
+resident: a reload only starts loading once the generation retired by the
+previous swap has been released by its last request.
+"""
+import contextlib
+import contextvars
+import gc
+import threading
+import time
+import weakref
+from typing import Any, Callable, ContextManager, Dict, List, Optional
+
+_PINNED: contextvars.ContextVar = contextvars.ContextVar('artifact_generation', default=None)
+
+
+class ReloadError(RuntimeError):
+    pass
+
+
+class Artifacts(dict):
+    """One loaded artifact set. A plain dict to callers; weak-referenceable and numbered."""
+
+    generation = 0
+    loaded_at = 0.0
+
+
+class ArtifactGenerations:
+    def __init__(self, loader: Callable[[], Dict[str, Any]],
+                 validator: Optional[Callable[[Dict[str, Any], Dict[str, Any]], List[str]]] = None):
+        self._loader = loader
+        self._validator = validator
+        self._current: Artifacts = Artifacts()
+        self._retired: Optional[weakref.ref] = None
+        self._reload_lock = threading.Lock()
+        self._listeners: List[Callable[[Artifacts, Artifacts], None]] = []
+        self.last_reload: Optional[Dict[str, Any]] = None
+
+    def _new(self, generation: int) -> Artifacts:
+        art = self._loader()
+        if not isinstance(art, Artifacts):
+            art = Artifacts(art)  # a copy: loaders whose objects keep a reference should return Artifacts
+        art.generation = generation
+        art.loaded_at = time.time()
+        return art
+
+    def load_initial(self) -> Artifacts:
+        self._current = self._new(1)
+        return self._current
+
+    @property
+    def current(self) -> Artifacts:
+        return self._current
+
+    def resolve(self) -> Artifacts:
+        """The generation pinned by the running request, else the current one."""
+        return _PINNED.get() or self._current
+
+    def pin(self) -> contextvars.Token:
+        return _PINNED.set(self._current)
+
+    @staticmethod
+    def unpin(token: contextvars.Token):
+        _PINNED.reset(token)
+
+    def on_swap(self, fn: Callable[[Artifacts, Artifacts], None]):
+        self._listeners.append(fn)
+        return fn
+
+    def _retired_alive(self) -> bool:
+        if self._retired is None or self._retired() is None:
+            return False
+        gc.collect()  # generations hold reference cycles (e.g. catalog <-> artifacts)
+        return self._retired() is not None
+
+    def wait_for_previous(self, timeout: float = 30.0):
+        """Block until the generation retired by the last swap has been released."""
+        deadline = time.monotonic() + timeout
+        while self._retired_alive():
+            if time.monotonic() > deadline:
+                raise ReloadError('the previous generation is still in use by in-flight requests')
+            time.sleep(0.1)
+
+    def reload(self, reason: str = '', drain_timeout: float = 30.0,
+               swap_guard: Optional[Callable[[Artifacts, Artifacts], ContextManager]] = None) -> Dict[str, Any]:
+        """Load, validate and swap in a new generation. Raises ReloadError and keeps the old one on failure.
+
+        swap_guard(new, old), if given, is entered around the swap only (after loading and
+        validation); an exception from it keeps the old generation.
+        """
+        if not self._reload_lock.acquire(blocking=False):
+            raise ReloadError('a reload is already in progress')
+        t0 = time.perf_counter()
+        try:
+            self.wait_for_previous(drain_timeout)
+            old = self._current
+            new = self._new(old.generation + 1)
+            problems = self._validator(new, old) if self._validator is not None else []
+            if problems:
+                raise ReloadError('validation failed: ' + '; '.join(problems))
+            with swap_guard(new, old) if swap_guard is not None else contextlib.nullcontext():
+                self._current = new
+                self._retired = weakref.ref(old)
+                for fn in self._listeners:
+                    fn(new, old)
+            self.last_reload = {
+                'generation': new.generation,
+                'reason': reason,
+                'ok': True,
+                'load_s': time.perf_counter() - t0,
+                'at': time.time(),
+            }
+            return self.last_reload
+        except Exception as e:
+            self.last_reload = {'generation': self._current.generation, 'reason': reason, 'ok': False,
+                                'error': str(e), 'at': time.time()}
+            if isinstance(e, ReloadError):
+                raise
+            raise ReloadError(f'loading the new generation failed: {e}') from e
+        finally:
+            self._reload_lock.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'generation': self._current.generation,
+            'loaded_at': self._current.loaded_at,
+            'previous_resident': self._retired is not None and self._retired() is not None,
+            'reloading': self._reload_lock.locked(),
+            'last_reload': self.last_reload,
+        }
+
+
+class ArtifactView:
+    """Read-only mapping that forwards to the request's pinned generation (the module-level ``ART``)."""
+
+    def __init__(self, generations: ArtifactGenerations):
+        self._generations = generations
+
+    @property
+    def generation(self) -> int:
+        return self._generations.resolve().generation
+
+    def get(self, key, default=None):
+        return self._generations.resolve().get(key, default)
+
+    def __getitem__(self, key):
+        return self._generations.resolve()[key]
+
+    def __contains__(self, key) -> bool:
+        return key in self._generations.resolve()
+
+    def __iter__(self):
+        return iter(self._generations.resolve())
+
+    def __len__(self) -> int:
+        return len(self._generations.resolve())
+
+    def keys(self):
+        return self._generations.resolve().keys()
+
+    def values(self):
+        return self._generations.resolve().values()
+
+    def items(self):
+        return self._generations.resolve().items()
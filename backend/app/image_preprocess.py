@@ -0,0 +1,114 @@
+"""Image decode and OpenCLIP preprocessing without the torchvision pipeline.
+
+``open_image`` decodes with JPEG draft mode: libjpeg scales by 1/2, 1/4 or 1/8
+during the DCT, so a 4000x3000 phone photo is decoded at 1000x750 instead of
+full size. The build (build_artifacts) and the query endpoints decode the
+same way, so stored and query embeddings see the same pixels.
+
+``compile_preprocess`` turns the OpenCLIP transform
+
+  Resize(short side, bicubic) -> CenterCrop -> RGB -> ToTensor -> Normalize
+
+into one PIL resize, an array slice and a single fused multiply-add over the
+uint8 pixels. The compiled form is compared with the original transform on
+probe images before it is used; any other transform is returned unchanged.
+torch is imported only to build tensors, so the ONNX backend (tensor=False)
+runs without it.
+"""
+from typing import Any, Optional, Tuple
+
+import numpy as np
+
+try:
+    from PIL import Image
+except Exception:
+    Image = None
+
+# decode at >= 2x the 224 px model input; the bicubic resize then downsamples as before
+DRAFT_SIZE = (448, 448)
+# bump when the pixels open_image / ClipPreprocess produce change (persisted query embeddings are keyed on it)
+PREPROCESS_VERSION = 2
+
+
+def open_image(fp, draft: Optional[Tuple[int, int]] = DRAFT_SIZE):
+    """Decode a path or file object to an RGB PIL image, JPEGs at reduced scale when ``draft`` is set."""
+    img = Image.open(fp)
+    if draft:
+        img.draft('RGB', draft)  # no-op for formats other than JPEG
+    return img.convert('RGB')
+
+
+class ClipPreprocess:
+    """Callable equivalent of an OpenCLIP eval transform; returns a (3, crop, crop) float32 tensor (or array)."""
+
+    def __init__(self, size: int, crop: Tuple[int, int], interpolation: int, mean, std, tensor: bool = True):
+        self.tensor = tensor
+        self.size = int(size)
+        self.crop = (int(crop[0]), int(crop[1]))
+        self.interpolation = interpolation
+        std = np.asarray(std, dtype=np.float32)
+        # (x / 255 - mean) / std == x * scale + shift
+        self.scale = (1.0 / (255.0 * std)).astype(np.float32)
+        self.shift = (-np.asarray(mean, dtype=np.float32) / std).astype(np.float32)
+
+    def _resized_size(self, w: int, h: int) -> Tuple[int, int]:
+        # torchvision: the short side becomes ``size``, the long side is truncated
+        if w <= h:
+            return self.size, int(self.size * h / w)
+        return int(self.size * w / h), self.size
+
+    def __call__(self, img) -> Any:
+        img = img.convert('RGB')
+        w, h = self._resized_size(*img.size)
+        if (w, h) != img.size:
+            img = img.resize((w, h), self.interpolation)
+        ch, cw = self.crop
+        if h < ch or w < cw:
+            raise ValueError(f'resized image {w}x{h} is smaller than the {cw}x{ch} crop')
+        top, left = int(round((h - ch) / 2.0)), int(round((w - cw) / 2.0))
+        x = np.asarray(img)[top:top + ch, left:left + cw]
+        x = np.ascontiguousarray((x.astype(np.float32) * self.scale + self.shift).transpose(2, 0, 1))
+        if not self.tensor:
+            return x
+        import torch
+        return torch.from_numpy(x)
+
+
+def _clip_params(transform) -> Optional[dict]:
+    """Resize/crop/normalize parameters of a recognised OpenCLIP Compose, else None."""
+    try:
+        from torchvision import transforms as T
+        from torchvision.transforms import InterpolationMode
+    except Exception:
+        return None
+    steps = list(getattr(transform, 'transforms', None) or [])
+    steps = [s for s in steps if getattr(s, '__name__', '') != '_convert_to_rgb']
+    if [type(s) for s in steps] != [T.Resize, T.CenterCrop, T.ToTensor, T.Normalize]:
+        return None
+    resize, crop, _, norm = steps
+    size = resize.size if isinstance(resize.size, int) else (resize.size[0] if len(resize.size) == 1 else None)
+    pil_modes = {InterpolationMode.BICUBIC: Image.BICUBIC, InterpolationMode.BILINEAR: Image.BILINEAR}
+    if size is None or resize.max_size is not None or resize.interpolation not in pil_modes:
+        return None
+    return {'size': size, 'crop': tuple(crop.size), 'interpolation': pil_modes[resize.interpolation],
+            'mean': norm.mean, 'std': norm.std}
+
+
+def compile_preprocess(transform):
+    """ClipPreprocess for an OpenCLIP transform if it reproduces it on probe images, else ``transform`` itself."""
+    if Image is None or transform is None or isinstance(transform, ClipPreprocess):
+        return transform
+    params = _clip_params(transform)
+    if params is None:
+        return transform
+    fast = ClipPreprocess(**params)
+    rng = np.random.default_rng(0)
+    try:
+        import torch
+        for w, h in ((640, 427), (301, 533), (224, 224)):
+            probe = Image.fromarray(rng.integers(0, 256, (h, w, 3), dtype=np.uint8))
+            if not torch.allclose(fast(probe), transform(probe), rtol=0.0, atol=1e-5):
+                return transform
+    except Exception:
+        return transform
+    return fast
@@ -1,10 +1,16 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException, Request
 from fastapi.responses import FileResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.middleware import Middleware
 from pydantic import BaseModel
 import numpy as np
 import os
-from typing import List, Optional, Dict, Any
+import asyncio
+import importlib.util
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Optional, Dict, Any, Tuple
 
 app = FastAPI(
     title="Marketplace Integrity Framework API",
@@ -53,32 +59,59 @@ def root():
     """Root endpoint to satisfy Azure warmup HTTP pings on '/'."""
     return {"status": "ok", "service": "marketplace-integrity-api"}
 
+# Encoder backend (see "Model loading strategy" below); the ONNX backend never imports torch
+ENCODER_BACKEND = os.getenv('ENCODER_BACKEND', 'torch').strip().lower()
+
 # Lazy imports for optional libraries
-try:
-    from sentence_transformers import SentenceTransformer
-except Exception:
-    SentenceTransformer = None
+SentenceTransformer = None
+if ENCODER_BACKEND != 'onnx':
+    try:
+        from sentence_transformers import SentenceTransformer
+    except Exception:
+        SentenceTransformer = None
 
 try:
     import faiss
 except Exception:
     faiss = None
 
+open_clip = None
+torch = None
+F = None
+if ENCODER_BACKEND != 'onnx':
+    try:
+        import open_clip
+        import torch
+        import torch.nn.functional as F
+    except Exception:
+        open_clip = None
+        torch = None
+        F = None
+
 try:
-    import open_clip
-    import torch
-    import torch.nn.functional as F
     from PIL import Image
 except Exception:
-    open_clip = None
-    torch = None
-    F = None
     Image = None
 
 # Data/ML essentials (required)
 import pandas as pd
 import pickle
-from sklearn.ensemble import IsolationForest
+
+from .meta_store import MetaStore, _source_fingerprint, load_meta_store
+from .embeddings import load_embeddings
+from .batching import MicroBatcher
+from .executors import StageExecutor
+from .embedding_cache import EmbeddingCache, image_key, title_key
+from .catalog import Catalog, CatalogWAL
+from .fraud_model import (build_fraud_model, fraud_model_source, load_fraud_model, seller_duplicate_pairs,
+                          with_ring_features)
+from .classifier import compile_classifier
+from .image_preprocess import DRAFT_SIZE, PREPROCESS_VERSION, ClipPreprocess, compile_preprocess, open_image
+from .onnx_encoders import ONNX_DIR, OnnxImageEncoder, load_onnx_encoder
+from .clusters import cluster_source, load_clusters
+from .rings import load_rings, ring_source
+from .generations import ArtifactGenerations, Artifacts, ArtifactView, ReloadError
+from . import ann_index
 
 # Log pandas presence/version early
 print(f"[startup] pandas loaded: version={getattr(pd, '__version__', 'unknown')}")
@@ -88,25 +121,207 @@ class EmbedRequest(BaseModel):
     title: str
 
 
+# Embedding loading:
+#   EMBEDDINGS_MMAP=1        -> memory-map the matrices read-only (pages shared across workers)
+#   EMBEDDINGS_STORAGE=...   -> float32 | float16 | int8; defaults to what manifest.json records
+EMBEDDINGS_MMAP = (os.getenv('EMBEDDINGS_MMAP', '0').strip() == '1')
+EMBEDDINGS_STORAGE = (os.getenv('EMBEDDINGS_STORAGE', '').strip() or None)
+
+"""
+Live catalog updates (POST /catalog/items, DELETE /catalog/items/{idx}):
+  CATALOG_WRITES=1            -> enable the endpoints; FAISS indices are made ID-addressable at load
+  CATALOG_WAL=<path>          -> write-ahead log replayed at load (default: siamese_artifacts/catalog_wal.jsonl)
+  CATALOG_WAL_FSYNC=0         -> skip the fsync per write (faster; a power loss can drop the last writes)
+  CATALOG_COMPACT_EVERY=256   -> deletes batched before they are physically removed from the indices
+Uploaded images are stored under <dataset>/catalog_images.
+"""
+CATALOG_WRITES = (os.getenv('CATALOG_WRITES', '0').strip() == '1')
+CATALOG_WAL = os.getenv('CATALOG_WAL', '').strip() or os.path.join(ARTIFACT_DIR, 'catalog_wal.jsonl')
+CATALOG_WAL_FSYNC = (os.getenv('CATALOG_WAL_FSYNC', '1').strip() != '0')
+CATALOG_COMPACT_EVERY = int(os.getenv('CATALOG_COMPACT_EVERY', '256'))
+CATALOG_IMAGES_SUBDIR = 'catalog_images'
+
+
+# Metadata columns that may carry the image filename, in lookup order.
+IMAGE_COLUMNS = ['image', 'image_path', 'file', 'filepath', 'image_name', 'image_file']
+# Column order used when inferring a key for images missing on disk.
+IMAGE_HINT_COLUMNS = ['image_path', 'image', 'file', 'filepath', 'image_name', 'image_file']
+IMAGE_SUBDIRS = ['train_images', 'test_images', CATALOG_IMAGES_SUBDIR]
+# Column build_artifacts writes with the image path relative to the artifact dir; preferred when it resolves.
+ARTIFACT_IMAGE_COLUMN = 'image_path'
+
+
+def _image_value(row, columns: List[str]) -> Optional[str]:
+    for c in columns:
+        if c in row and pd.notna(row[c]) and str(row[c]).strip():
+            return str(row[c]).strip()
+    return None
+
+
+def _image_values(meta: MetaStore, columns: List[str]) -> List[Optional[str]]:
+    """Vectorized _image_value over every row of meta."""
+    vals = pd.Series([None] * len(meta), dtype=object)
+    for c in reversed(columns):
+        if c not in meta.columns:
+            continue
+        col = pd.Series(meta.column(c), dtype=object)
+        stripped = col.astype(str).str.strip()
+        valid = col.notna() & (stripped != '')
+        vals = stripped.where(valid, vals)
+    return vals.tolist()
+
+
+def _resolve_image_value(val: Optional[str], exists=os.path.exists) -> Optional[str]:
+    """Map a metadata image value to an absolute path under DATASET_DIR, if the file exists."""
+    if not val:
+        return None
+    p = val.replace('\\', '/').lstrip('/')
+    # Try as-is under dataset root
+    abs_try = p if os.path.isabs(p) else os.path.join(DATASET_DIR, p)
+    if exists(abs_try):
+        return abs_try
+    # build_artifacts writes image_path relative to the artifact dir
+    if not os.path.isabs(p):
+        art_try = os.path.normpath(os.path.join(ARTIFACT_DIR, p))
+        if exists(art_try):
+            return art_try
+    # Try common folders
+    base = os.path.basename(p)
+    for sub in IMAGE_SUBDIRS:
+        cand = os.path.join(DATASET_DIR, sub, base)
+        if exists(cand):
+            return cand
+    return None
+
+
+def _artifact_image(val: Optional[str], exists=os.path.exists) -> Optional[str]:
+    """Absolute path of an image_path value relative to ARTIFACT_DIR, if that file exists."""
+    if not val:
+        return None
+    p = val.replace('\\', '/')
+    if os.path.isabs(p):
+        return None
+    path = os.path.normpath(os.path.join(ARTIFACT_DIR, p))
+    return path if exists(path) else None
+
+
+def _within(path: str, root: str) -> bool:
+    root = os.path.abspath(root)
+    try:
+        return os.path.commonpath([os.path.abspath(path), root]) == root
+    except ValueError:
+        return False
+
+
+def _image_key_for(val: Optional[str], hint: Optional[str], exists=os.path.exists,
+                   artifact_val: Optional[str] = None) -> Optional[str]:
+    path = _artifact_image(artifact_val, exists)
+    if not path or not _within(path, DATASET_DIR):
+        # keys are DATASET_DIR-relative: images outside it are served by /image/{idx} only
+        path = _resolve_image_value(val, exists)
+    if path:
+        try:
+            rel = os.path.relpath(path, DATASET_DIR)
+            return rel.replace('\\', '/').lstrip('/')
+        except Exception:
+            pass
+    # Try to infer from metadata
+    if not hint:
+        return None
+    p = hint.replace('\\', '/').lstrip('/')
+    base = os.path.basename(p)
+    # Prefer known subfolders
+    for sub in IMAGE_SUBDIRS:
+        if exists(os.path.join(DATASET_DIR, sub, base)):
+            return f"{sub}/{base}"
+    # Keep provided hint if contains subfolder
+    if p.startswith('train_images/') or p.startswith('test_images/'):
+        return p
+    return f"train_images/{base}"
+
+
+def _build_media_index(meta: Optional[MetaStore]) -> Optional[np.ndarray]:
+    """Resolve the image key of every catalog row once.
+
+    Existence checks are answered from cached directory listings, so the whole
+    catalog costs one listdir per image folder instead of several stat calls
+    per result row on the request path.
+    """
+    if meta is None:
+        return None
+    listings: Dict[str, set] = {}
+
+    def exists(path: str) -> bool:
+        d, base = os.path.split(os.path.normcase(path))
+        names = listings.get(d)
+        if names is None:
+            try:
+                names = {os.path.normcase(n) for n in os.listdir(d)}
+            except OSError:
+                names = set()
+            listings[d] = names
+        return base in names
+
+    vals = _image_values(meta, IMAGE_COLUMNS)
+    hints = _image_values(meta, IMAGE_HINT_COLUMNS)
+    artifact_vals = _image_values(meta, [ARTIFACT_IMAGE_COLUMN])
+    keys = np.empty(len(meta), dtype=object)
+    for i, (val, hint, artifact_val) in enumerate(zip(vals, hints, artifact_vals)):
+        try:
+            keys[i] = _image_key_for(val, hint, exists, artifact_val)
+        except Exception:
+            keys[i] = None
+    return keys
+
+
+def _row_image_key(row: Dict[str, Any]) -> Optional[str]:
+    return _image_key_for(_image_value(row, IMAGE_COLUMNS), _image_value(row, IMAGE_HINT_COLUMNS),
+                          artifact_val=_image_value(row, [ARTIFACT_IMAGE_COLUMN]))
+
+
+def _catalog_base_id(manifest: Optional[Dict[str, Any]], meta_path: str) -> Dict[str, Any]:
+    """Identity of the base catalog a write-ahead log applies to: the build stamp when
+    build_artifacts wrote one (survives copying the artifacts), else the meta.csv fingerprint."""
+    created = ((manifest or {}).get('build') or {}).get('created')
+    if created:
+        return {'build': created}
+    return {'meta_csv': _source_fingerprint(meta_path)}
+
+
 def _load_artifacts():
     """Load artifacts if present. Returns a dict with loaded objects or None keys.
     Expected files (from notebook manifest):
-      - meta.csv
+      - meta.csv (served through the columnar store in meta_store/, built on first load)
       - text_embs.npy
       - image_embs.npy
       - faiss_text.index
       - faiss_image.index
+      - faiss_fused.index (optional; alpha-weighted image+text vectors from build_index --fused-index)
       - threshold_clf.pkl
+      - fraud_model/ (optional; seller model precomputed by build_index --fraud-model)
+      - clusters/ (optional; near-duplicate clusters from build_index --clusters)
+      - rings/ (optional; cross-seller duplicate rings from build_index --rings)
+    The returned Artifacts is the generation itself: the catalog keeps a reference and updates it in place.
     """
-    out = {
+    out = Artifacts({
         'meta': None,
         'text_embs': None,
         'image_embs': None,
         'faiss_text': None,
         'faiss_image': None,
+        'faiss_fused': None,
+        'fused_index': None,
         'clf_obj': None,
+        'clf_scorer': None,
         'manifest': None,
-    }
+        'image_keys': None,
+        'catalog': None,
+        'catalog_error': None,
+        'fraud_model': None,
+        'fraud_state': None,  # seller fraud model for the endpoints, built on first use (_build_fraud_model)
+        'clusters': None,
+        'rings': None,
+    })
 
     if not os.path.exists(ARTIFACT_DIR):
         return out
@@ -123,15 +338,24 @@ def _load_artifacts():
     # meta
     meta_path = os.path.join(ARTIFACT_DIR, 'meta.csv')
     if os.path.exists(meta_path):
-        out['meta'] = pd.read_csv(meta_path)
+        try:
+            out['meta'] = load_meta_store(meta_path)
+        except Exception:
+            out['meta'] = None
+        # media index: idx -> image key, resolved once instead of per result row
+        try:
+            out['image_keys'] = _build_media_index(out['meta'])
+        except Exception:
+            out['image_keys'] = None
 
-    # embeddings
-    txt_path = os.path.join(ARTIFACT_DIR, 'text_embs.npy')
-    img_path = os.path.join(ARTIFACT_DIR, 'image_embs.npy')
-    if os.path.exists(txt_path):
-        out['text_embs'] = np.load(txt_path)
-    if os.path.exists(img_path):
-        out['image_embs'] = np.load(img_path)
+    # embeddings (float32, float16 or int8 storage; optionally memory-mapped)
+    for name in ('text_embs', 'image_embs'):
+        try:
+            out[name] = load_embeddings(ARTIFACT_DIR, name, out['manifest'],
+                                        mmap=EMBEDDINGS_MMAP, storage=EMBEDDINGS_STORAGE)
+        except Exception as e:
+            print(f"[startup] failed to load {name}: {e}")
+            out[name] = None
 
     # faiss indices
     if faiss is not None:
@@ -147,6 +371,27 @@ def _load_artifacts():
                 out['faiss_image'] = faiss.read_index(faiss_image_path)
             except Exception:
                 out['faiss_image'] = None
+        # fused index: served only if it still matches the embeddings it was built from
+        fused_entry = (out['manifest'] or {}).get('fused_index')
+        if fused_entry and out['text_embs'] is not None and out['image_embs'] is not None:
+            fused_path = os.path.join(ARTIFACT_DIR, fused_entry.get('file', 'faiss_fused.index'))
+            dims = out['image_embs'].shape[1] + out['text_embs'].shape[1]
+            sources = {name: out[name].source for name in ('text_embs', 'image_embs')}
+            try:
+                if os.path.exists(fused_path):
+                    index = faiss.read_index(fused_path)
+                    if index.d != dims or index.ntotal != len(out['text_embs']):
+                        print(f"[startup] {fused_path} is stale ({index.ntotal} x {index.d} for "
+                              f"{len(out['text_embs'])} x {dims}); rebuild with build_index --fused-index")
+                    elif fused_entry.get('embeddings') != sources:
+                        # same shape, but built from other (e.g. re-encoded) embeddings than the ones loaded
+                        print(f"[startup] {fused_path} was built from other embeddings than the loaded "
+                              f"ones; rebuild with build_index --fused-index")
+                    else:
+                        out['faiss_fused'] = index
+                        out['fused_index'] = fused_entry
+            except Exception as e:
+                print(f"[startup] failed to load faiss_fused: {e}")
 
     # classifier
     clf_path = os.path.join(ARTIFACT_DIR, 'threshold_clf.pkl')
@@ -156,6 +401,45 @@ def _load_artifacts():
                 out['clf_obj'] = pickle.load(f)
         except Exception:
             out['clf_obj'] = None
+    # compiled once per generation so requests score all candidates with one numpy expression
+    out['clf_scorer'] = compile_classifier(out['clf_obj']) if out['clf_obj'] is not None else None
+
+    # precomputed seller fraud model (arrays memory-mapped), if built from this meta.csv and these embeddings
+    if os.path.exists(meta_path):
+        try:
+            out['fraud_model'] = load_fraud_model(ARTIFACT_DIR, fraud_model_source(
+                ARTIFACT_DIR, {name: out[name] for name in ('text_embs', 'image_embs')}))
+        except Exception as e:
+            print(f"[startup] failed to load fraud_model: {e}")
+            out['fraud_model'] = None
+        try:
+            out['clusters'] = load_clusters(ARTIFACT_DIR, cluster_source(
+                ARTIFACT_DIR, {name: out[name] for name in ('text_embs', 'image_embs')}))
+        except Exception as e:
+            print(f"[startup] failed to load clusters: {e}")
+            out['clusters'] = None
+        try:
+            # built from the clustering result, so only loaded alongside a current one
+            out['rings'] = (load_rings(ARTIFACT_DIR, ring_source(out['clusters']))
+                            if out['clusters'] is not None else None)
+        except Exception as e:
+            print(f"[startup] failed to load rings: {e}")
+            out['rings'] = None
+
+    # live catalog: replay the write-ahead log on top of the loaded artifacts. A failed replay
+    # changes nothing, so the generation serves the base artifacts with writes disabled.
+    if CATALOG_WRITES and out['meta'] is not None:
+        try:
+            catalog = Catalog(out, CatalogWAL(CATALOG_WAL, fsync=CATALOG_WAL_FSYNC), _row_image_key,
+                              compact_every=CATALOG_COMPACT_EVERY, base_id=_catalog_base_id(out['manifest'], meta_path))
+            n = catalog.replay()
+            if n:
+                print(f"[startup] replayed {n} catalog changes from {CATALOG_WAL}")
+            out['catalog'] = catalog
+        except Exception as e:
+            print(f"[startup] catalog log replay failed: {e}")
+            out['catalog'] = None
+            out['catalog_error'] = f'replay of {CATALOG_WAL} failed: {e}'
 
     return out
 
@@ -168,6 +452,12 @@ Model loading strategy:
 Environment flags:
   LOAD_TEXT_MODEL=1   -> allow loading SentenceTransformer at first use
   LOAD_IMAGE_MODEL=1  -> allow loading OpenCLIP at first use
+  ENCODER_BACKEND=torch|onnx -> PyTorch models (default) or the ONNX Runtime exports written by
+                                build_index --export-onnx (torch, sentence-transformers and open_clip
+                                are then not imported at all)
+  ENCODER_ONNX_INT8=1        -> use the dynamic int8 quantized exports (float32 if none was kept)
+  ENCODER_ONNX_DIR=<dir>     -> exported models (default: <ARTIFACT_DIR>/onnx)
+  ENCODER_ONNX_THREADS=<n>   -> onnxruntime intra-op threads (default: onnxruntime's choice)
 
 Additionally, require presence of relevant artifacts to avoid accidental downloads.
 """
@@ -179,6 +469,11 @@ IMG_PREPROCESS = None
 
 LOAD_TEXT_MODEL = (os.getenv('LOAD_TEXT_MODEL', '0').strip() == '1')
 LOAD_IMAGE_MODEL = (os.getenv('LOAD_IMAGE_MODEL', '0').strip() == '1')
+ENCODER_ONNX_INT8 = (os.getenv('ENCODER_ONNX_INT8', '0').strip() == '1')
+ENCODER_ONNX_DIR = os.getenv('ENCODER_ONNX_DIR', '').strip() or None
+ENCODER_ONNX_THREADS = int(os.getenv('ENCODER_ONNX_THREADS', '0')) or None
+ENCODER_ERRORS: Dict[str, str] = {}
+IMAGE_DRAFT_DECODE = (os.getenv('IMAGE_DRAFT_DECODE', '1').strip() == '1')  # see "Query image ingestion" below
 
 def _has_artifact_file(filename: str) -> bool:
     try:
@@ -186,15 +481,28 @@ def _has_artifact_file(filename: str) -> bool:
     except Exception:
         return False
 
+def _load_onnx_encoder(kind: str):
+    try:
+        return load_onnx_encoder(kind, ENCODER_ONNX_DIR or os.path.join(ARTIFACT_DIR, ONNX_DIR),
+                                 int8=ENCODER_ONNX_INT8, threads=ENCODER_ONNX_THREADS)
+    except Exception as e:
+        ENCODER_ERRORS[kind] = f'{type(e).__name__}: {e}'
+        return None
+
 def get_text_model():
     global TEXT_MODEL
     if TEXT_MODEL is not None:
         return TEXT_MODEL
-    if not (LOAD_TEXT_MODEL and SentenceTransformer is not None):
+    if not LOAD_TEXT_MODEL:
         return None
     # Require at least one relevant local artifact to avoid remote downloads
     if not (_has_artifact_file('faiss_text.index') or _has_artifact_file('text_embs.npy')):
         return None
+    if ENCODER_BACKEND == 'onnx':
+        TEXT_MODEL = _load_onnx_encoder('text')
+        return TEXT_MODEL
+    if SentenceTransformer is None:
+        return None
     try:
         TEXT_MODEL = SentenceTransformer(TEXT_MODEL_NAME)
     except Exception:
@@ -205,14 +513,22 @@ def get_image_model():
     global IMG_MODEL, IMG_PREPROCESS
     if IMG_MODEL is not None and IMG_PREPROCESS is not None:
         return IMG_MODEL, IMG_PREPROCESS
-    if not (LOAD_IMAGE_MODEL and open_clip is not None and torch is not None):
+    if not LOAD_IMAGE_MODEL:
         return None, None
     # Require at least one relevant local artifact to avoid remote downloads
     if not (_has_artifact_file('faiss_image.index') or _has_artifact_file('image_embs.npy')):
         return None, None
+    if ENCODER_BACKEND == 'onnx':
+        IMG_MODEL = _load_onnx_encoder('image')
+        IMG_PREPROCESS = IMG_MODEL.preprocess if IMG_MODEL is not None else None
+        return IMG_MODEL, IMG_PREPROCESS
+    if open_clip is None or torch is None:
+        return None, None
     try:
         IMG_MODEL, _, IMG_PREPROCESS = open_clip.create_model_and_transforms('ViT-B-32', pretrained='openai')
         IMG_MODEL.eval()
+        # numpy resize/normalize equivalent of the torchvision transform (checked against it)
+        IMG_PREPROCESS = compile_preprocess(IMG_PREPROCESS)
         if torch.cuda.is_available():
             IMG_MODEL.to('cuda')
     except Exception:
@@ -220,137 +536,286 @@ def get_image_model():
     return IMG_MODEL, IMG_PREPROCESS
 
 
-ART = _load_artifacts()
+"""
+Encoder micro-batching:
+  ENCODER_BATCHING=1        -> queue single encode requests and run them in batches on a worker thread
+  ENCODER_MAX_BATCH=64      -> max items per encoder call
+  ENCODER_MAX_WAIT_MS=5     -> how long the first queued item waits for companions
+"""
+ENCODER_BATCHING = (os.getenv('ENCODER_BATCHING', '0').strip() == '1')
+ENCODER_MAX_BATCH = int(os.getenv('ENCODER_MAX_BATCH', '64'))
+ENCODER_MAX_WAIT_MS = float(os.getenv('ENCODER_MAX_WAIT_MS', '5'))
 
-# Fraud model cache
-FRAUD: Dict[str, Any] = {
-    'built': False,
-    'model': None,
-    'seller_ids': None,
-    'seller_features': None,
-    'counts': None,
-    'seller_groups': None,  # dict seller_id -> list of indices
-    'features_df': None,    # pandas DataFrame with computed metrics per seller
-}
 
+def _text_encode_batch(titles: List[str]) -> np.ndarray:
+    return get_text_model().encode(list(titles), convert_to_numpy=True).astype('float32')
 
-def _build_fraud_model():
-    if FRAUD['built']:
-        return
-    meta = ART.get('meta')
-    text_embs = ART.get('text_embs')
-    if meta is None or text_embs is None or 'seller_id' not in meta.columns:
-        FRAUD['built'] = True  # mark as built (no-op) to avoid repeated attempts
-        return
-    # Aggregate mean text embedding per seller
-    seller_groups = meta.groupby('seller_id').indices
-    seller_ids = []
-    feats = []
-    counts = []
-    for sid, idxs in seller_groups.items():
-        idxs = np.array(list(idxs), dtype=int)
-        vecs = text_embs[idxs]
-        mean_vec = vecs.mean(axis=0)
-        mean_vec = _norm(mean_vec)
-        seller_ids.append(sid)
-        feats.append(mean_vec)
-        counts.append(int(len(idxs)))
-    X = np.vstack(feats).astype('float32') if feats else None
-    if X is None or len(X) < 5:
-        FRAUD['built'] = True
-        return
-    model = IsolationForest(n_estimators=200, contamination='auto', random_state=42)
-    model.fit(X)
-    # Compute additional seller metrics (no training)
+
+def _image_encode_batch(tensors: List[Any]) -> np.ndarray:
+    im, _ = get_image_model()
+    if isinstance(im, OnnxImageEncoder):
+        return im.encode_image(np.stack(tensors))
+    x = torch.stack(list(tensors))
+    if torch.cuda.is_available():
+        x = x.to('cuda')
+    with torch.no_grad():
+        emb = im.encode_image(x)
+        return emb.detach().cpu().numpy().astype('float32')
+
+
+"""
+Executor stages (blocking work never runs on the event loop):
+  SEARCH_WORKERS=<n>     -> threads for FAISS search and numpy rescoring (default: CPU count)
+  INFERENCE_WORKERS=<n>  -> threads for image decode/preprocess and encoder calls (default: 1)
+"""
+SEARCH_STAGE = StageExecutor('search', int(os.getenv('SEARCH_WORKERS', str(os.cpu_count() or 4))))
+INFERENCE_STAGE = StageExecutor('inference', int(os.getenv('INFERENCE_WORKERS', '1')))
+
+TEXT_BATCHER = MicroBatcher(_text_encode_batch, ENCODER_MAX_BATCH, ENCODER_MAX_WAIT_MS, name='text-encoder') if ENCODER_BATCHING else None
+IMAGE_BATCHER = MicroBatcher(_image_encode_batch, ENCODER_MAX_BATCH, ENCODER_MAX_WAIT_MS, name='image-encoder') if ENCODER_BATCHING else None
+
+
+"""
+Query embedding cache (in front of both encoders):
+  EMBED_CACHE_SIZE=10000   -> max cached embeddings per encoder (0 disables)
+  EMBED_CACHE_MB=64        -> memory bound per encoder cache
+  EMBED_CACHE_DIR=<dir>    -> persist caches there on shutdown and reload them at startup; one file per
+                              encoder setup (backend, int8, image decode), so a changed setup starts empty
+"""
+EMBED_CACHE_SIZE = int(os.getenv('EMBED_CACHE_SIZE', '10000'))
+EMBED_CACHE_MB = float(os.getenv('EMBED_CACHE_MB', '64'))
+EMBED_CACHE_DIR = os.getenv('EMBED_CACHE_DIR', '').strip() or None
+
+
+def _cache_namespace(name: str) -> str:
+    """Encoder setup the cached embeddings come from, e.g. 'onnx-int8' or 'torch-fp32-pre2-draft'."""
+    parts = [ENCODER_BACKEND, 'int8' if ENCODER_BACKEND == 'onnx' and ENCODER_ONNX_INT8 else 'fp32']
+    if name == 'image':
+        parts += [f'pre{PREPROCESS_VERSION}', 'draft' if IMAGE_DRAFT_DECODE else 'full']
+    return '-'.join(parts)
+
+
+def _make_cache(name: str) -> EmbeddingCache:
+    path = None
+    if EMBED_CACHE_DIR:
+        path = os.path.join(EMBED_CACHE_DIR, f'{name}_embedding_cache.{_cache_namespace(name)}.npz')
+    cache = EmbeddingCache(EMBED_CACHE_SIZE, int(EMBED_CACHE_MB * 1024 * 1024), path=path)
     try:
-        import math
-        image_embs = ART.get('image_embs')
-        # helper to compute within-seller mean cosine sim via sampling
-        rng = np.random.default_rng(42)
-        def mean_sim(idxs: np.ndarray, embs: Optional[np.ndarray], sample_pairs: int = 200) -> float:
-            if embs is None or len(idxs) < 2:
-                return float('nan')
-            idxs = np.array(idxs, dtype=int)
-            m = min(sample_pairs, len(idxs) * (len(idxs) - 1) // 2)
-            if m <= 0:
-                return float('nan')
-            # sample pairs
-            pairs = set()
-            for _ in range(m * 2):
-                i, j = rng.integers(0, len(idxs), size=2)
-                if i == j:
-                    continue
-                a, b = sorted((int(idxs[i]), int(idxs[j])))
-                pairs.add((a, b))
-                if len(pairs) >= m:
-                    break
-            sims = []
-            for a, b in pairs:
-                va = _norm(embs[a:a+1])[0]
-                vb = _norm(embs[b:b+1])[0]
-                sims.append(float((va * vb).sum()))
-            if not sims:
-                return float('nan')
-            return float(np.mean(sims))
-
-        rows = []
-        for sid, idxs in seller_groups.items():
-            idxs = np.array(list(idxs), dtype=int)
-            row = {
-                'seller_id': sid,
-                'count': int(len(idxs)),
-                'mean_text_sim': mean_sim(idxs, text_embs),
-                'mean_image_sim': mean_sim(idxs, image_embs),
-                'label_entropy': float('nan'),
-                'unique_title_ratio': float('nan'),
-            }
-            # label entropy if available
-            try:
-                if 'label_group' in meta.columns:
-                    from collections import Counter
-                    vals = [str(x) for x in meta.iloc[idxs]['label_group'].tolist()]
-                    c = Counter(vals)
-                    total = sum(c.values()) or 1
-                    ent = 0.0
-                    for k, v in c.items():
-                        p = v / total
-                        ent -= p * math.log(p + 1e-12)
-                    row['label_entropy'] = float(ent)
-            except Exception:
-                pass
-            # unique title ratio if available
-            try:
-                if 'title' in meta.columns:
-                    titles = [str(x).strip().lower() for x in meta.iloc[idxs]['title'].fillna('').tolist()]
-                    uniq = len(set(titles)) or 1
-                    row['unique_title_ratio'] = float(uniq / max(1, len(titles)))
-            except Exception:
-                pass
-            # simple risk score (higher is riskier): high count, high similarity, low entropy, low unique titles
-            mt = row.get('mean_text_sim')
-            mi = row.get('mean_image_sim')
-            ent = row.get('label_entropy')
-            utr = row.get('unique_title_ratio')
-            count = row['count']
-            mt = 0.0 if np.isnan(mt) else mt
-            mi = 0.0 if np.isnan(mi) else mi
-            ent = 0.0 if np.isnan(ent) else ent
-            utr = 0.0 if np.isnan(utr) else utr
-            row['risk_score'] = float(0.4 * mt + 0.3 * mi + 0.2 * (1.0 - min(ent, 5.0) / 5.0) + 0.1 * (1.0 - utr)) * (1.0 + min(count, 100) / 100.0)
-            rows.append(row)
-        features_df = pd.DataFrame(rows)
-    except Exception:
-        features_df = None
-
-    FRAUD.update({
-        'built': True,
-        'model': model,
-        'seller_ids': np.array(seller_ids),
-        'seller_features': X,
-        'counts': np.array(counts),
-        'seller_groups': {k: np.array(list(v), dtype=int) for k, v in seller_groups.items()},
-        'features_df': features_df,
-    })
+        n = cache.load()
+        if n:
+            print(f"[startup] restored {n} cached {name} embeddings")
+    except Exception as e:
+        print(f"[startup] could not restore {name} embedding cache: {e}")
+    return cache
+
+
+TEXT_CACHE = _make_cache('text')
+IMAGE_CACHE = _make_cache('image')
+
+
+@app.on_event('shutdown')
+def _save_embedding_caches():
+    for cache in (TEXT_CACHE, IMAGE_CACHE):
+        try:
+            cache.save()
+        except Exception as e:
+            print(f"[shutdown] could not save embedding cache {cache.path}: {e}")
+
+
+@app.on_event('shutdown')
+def _close_catalog_wal():
+    if ART.get('catalog') is not None:
+        ART['catalog'].wal.close()
+
+
+def _validate_generation(new: Dict[str, Any], old: Dict[str, Any]) -> List[str]:
+    """Sanity checks before a reloaded artifact set replaces the serving one."""
+    problems = []
+    for k in ('meta', 'text_embs', 'image_embs', 'faiss_text', 'faiss_image', 'clf_obj'):
+        if old.get(k) is not None and new.get(k) is None:
+            problems.append(f'{k} failed to load')
+    if old.get('catalog') is not None and new.get('catalog') is None:
+        problems.append(new.get('catalog_error') or 'catalog failed to load')
+    meta = new.get('meta')
+    catalog = new.get('catalog')
+
+    def expected(index, rows: int) -> int:
+        return catalog.expected_ntotal(index, rows) if catalog is not None else rows
+
+    for emb_name, index_name in (('text_embs', 'faiss_text'), ('image_embs', 'faiss_image')):
+        embs, index = new.get(emb_name), new.get(index_name)
+        if embs is not None and meta is not None and len(embs) != len(meta):
+            problems.append(f'{emb_name} has {len(embs)} rows but meta has {len(meta)}')
+        if embs is not None and old.get(emb_name) is not None and embs.shape[1] != old[emb_name].shape[1]:
+            # query encoders are not reloaded, so the embedding space must not change
+            problems.append(f'{emb_name} dimension changed from {old[emb_name].shape[1]} to {embs.shape[1]}')
+        if index is not None and embs is not None:
+            if index.d != embs.shape[1]:
+                problems.append(f'{index_name} dimension {index.d} does not match {emb_name} ({embs.shape[1]})')
+            elif index.ntotal != expected(index, len(embs)):
+                problems.append(f'{index_name} has {index.ntotal} vectors for {len(embs)} rows')
+            elif index.ntotal:
+                try:
+                    _, I = ann_index.search(index, np.ascontiguousarray(embs.normalized_rows([0])), 1)
+                    if I[0, 0] < 0:
+                        problems.append(f'{index_name} returned no results for a stored vector')
+                except Exception as e:
+                    problems.append(f'{index_name} search failed: {e}')
+    fused, text_embs = new.get('faiss_fused'), new.get('text_embs')
+    if fused is not None and text_embs is not None and fused.ntotal != expected(fused, len(text_embs)):
+        problems.append(f'faiss_fused has {fused.ntotal} vectors for {len(text_embs)} rows')
+    return problems
+
+
+GENERATIONS = ArtifactGenerations(_load_artifacts, _validate_generation)
+GENERATIONS.load_initial()
+# Handlers read artifacts through ART, which resolves to the generation pinned
+# for the running request, so a hot reload never swaps them mid-request.
+ART = ArtifactView(GENERATIONS)
+
+def _new_fraud_state() -> Dict[str, Any]:
+    return {
+        'model': None,
+        'seller_ids': None,
+        'seller_features': None,
+        'counts': None,
+        'seller_groups': None,  # SellerGroups: seller_id -> catalog indices
+        'features_df': None,    # pandas DataFrame with computed metrics per seller
+        'directory': None,      # SellerDirectory: seller_id -> position, precomputed scores and ranks
+        'rings': None,          # Rings over the same seller positions, when built
+    }
+
+
+def _build_fraud_model() -> Dict[str, Any]:
+    """Seller fraud state of the request's artifact generation, built on first use and kept with it."""
+    art = GENERATIONS.resolve()
+    state = art.get('fraud_state')
+    if state is not None:
+        return state
+    state = _new_fraud_state()
+    # precomputed by `python -m app.build_index --fraud-model`; built here only when missing or stale
+    fraud = art.get('fraud_model')
+    if fraud is None:
+        fraud = build_fraud_model(art.get('meta'), art.get('text_embs'), art.get('image_embs'))
+    if fraud is not None:
+        state.update(fraud)
+        # cross-seller ring features (they also raise risk_score), when the ring job ran over the same sellers
+        rings = art.get('rings')
+        if rings is not None and np.array_equal(rings.seller_ids, fraud['seller_ids']):
+            state['rings'] = rings
+            state.update(with_ring_features(fraud, rings))
+    # a missing model is cached too (as the empty state) to avoid repeated attempts
+    art['fraud_state'] = state
+    return state
+
+
+"""
+Hot reload (a new artifact generation is loaded in the background, validated and swapped in atomically):
+  ADMIN_TOKEN=<secret>              -> enables POST /admin/reload (send the token as X-Admin-Token)
+  ARTIFACT_WATCH_INTERVAL_S=<secs>  -> poll manifest.json and reload when it changes (0 = off)
+  RELOAD_DRAIN_TIMEOUT_S=30         -> how long a reload waits for requests still on the previous generation
+"""
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '').strip() or None
+ARTIFACT_WATCH_INTERVAL_S = float(os.getenv('ARTIFACT_WATCH_INTERVAL_S', '0'))
+RELOAD_DRAIN_TIMEOUT_S = float(os.getenv('RELOAD_DRAIN_TIMEOUT_S', '30'))
+
+
+@app.middleware('http')
+async def _pin_artifact_generation(request: Request, call_next):
+    token = GENERATIONS.pin()
+    try:
+        return await call_next(request)
+    finally:
+        GENERATIONS.unpin(token)
+
+
+@contextmanager
+def _catalog_handover(new: Dict[str, Any], old: Dict[str, Any]):
+    """Hand the catalog log to the new generation. The new one replayed the log while loading;
+    writers wait only while it applies what they appended since and the generations swap."""
+    catalog = old.get('catalog')
+    if catalog is None:
+        yield
+        return
+    with catalog.paused():
+        if new.get('catalog') is not None:
+            n = new['catalog'].catch_up()
+            if n:
+                print(f"[reload] caught up on {n} catalog changes logged during the load")
+        yield
+        catalog.retire()
+
+
+def reload_artifacts(reason: str) -> Dict[str, Any]:
+    """Load a new artifact generation and swap it in; the serving generation stays on any failure."""
+    info = GENERATIONS.reload(reason, drain_timeout=RELOAD_DRAIN_TIMEOUT_S, swap_guard=_catalog_handover)
+    print(f"[reload] generation {info['generation']} is live ({reason}, {info['load_s']:.1f}s)")
+    return info
+
+
+def _watch_manifest(interval: float):
+    path = os.path.join(ARTIFACT_DIR, 'manifest.json')
+
+    def stamp():
+        try:
+            st = os.stat(path)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    seen = stamp()
+    while True:
+        time.sleep(interval)
+        current = stamp()
+        if current is None or current == seen:
+            continue
+        time.sleep(interval)  # let the writer finish before loading
+        if stamp() != current:
+            continue
+        seen = current
+        try:
+            reload_artifacts('manifest.json changed')
+        except ReloadError as e:
+            print(f"[reload] kept generation {GENERATIONS.current.generation}: {e}")
+
+
+@app.on_event('startup')
+def _start_manifest_watcher():
+    if ARTIFACT_WATCH_INTERVAL_S > 0:
+        threading.Thread(target=_watch_manifest, args=(ARTIFACT_WATCH_INTERVAL_S,),
+                         name='manifest-watcher', daemon=True).start()
+
+
+def _check_admin(token: Optional[str]):
+    import hmac
+    if ADMIN_TOKEN is None:
+        raise HTTPException(status_code=404, detail='admin endpoints are disabled (set ADMIN_TOKEN)')
+    if not hmac.compare_digest(token or '', ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail='invalid admin token')
+
+
+@app.post('/admin/reload')
+async def admin_reload(x_admin_token: Optional[str] = Header(None), wait: bool = True):
+    """Reload artifacts from ARTIFACT_DIR without a restart. wait=false returns immediately."""
+    _check_admin(x_admin_token)
+
+    def run():
+        try:
+            return reload_artifacts('admin')
+        except ReloadError as e:
+            print(f"[reload] kept generation {GENERATIONS.current.generation}: {e}")
+            return {'error': str(e), 'generation': GENERATIONS.current.generation}
+
+    if not wait:
+        threading.Thread(target=run, name='artifact-reload', daemon=True).start()
+        return {'status': 'started', 'generation': GENERATIONS.current.generation}
+    return await asyncio.get_running_loop().run_in_executor(None, run)
+
+
+@app.get('/admin/reload')
+def admin_reload_status(x_admin_token: Optional[str] = Header(None)):
+    _check_admin(x_admin_token)
+    return GENERATIONS.stats()
 
 
 @app.get('/health')
@@ -365,12 +830,18 @@ def health():
             'artifact_dir': ARTIFACT_DIR,
             'artifact_dir_exists': os.path.exists(ARTIFACT_DIR),
             'meta_csv_exists': os.path.exists(os.path.join(ARTIFACT_DIR, 'meta.csv')),
+            'embeddings': {
+                k: ({'storage': ART[k].storage, 'shape': list(ART[k].shape), 'mmap': EMBEDDINGS_MMAP}
+                    if ART.get(k) is not None else None)
+                for k in ('text_embs', 'image_embs')
+            },
         },
         'ml_dependencies': {
             'sentence_transformers': SentenceTransformer is not None,
             'torch': torch is not None,
             'faiss': faiss is not None,
-            'open_clip': open_clip is not None
+            'open_clip': open_clip is not None,
+            'onnxruntime': importlib.util.find_spec('onnxruntime') is not None,
         },
         'artifacts_loaded': {k: (v is not None) for k, v in ART.items()},
         'models_loaded': {
@@ -381,7 +852,33 @@ def health():
         'model_loading': {
             'deferred': True,
             'load_text_model_env': LOAD_TEXT_MODEL,
-            'load_image_model_env': LOAD_IMAGE_MODEL
+            'load_image_model_env': LOAD_IMAGE_MODEL,
+            'image_preprocess': (None if IMG_PREPROCESS is None else
+                                 'numpy' if isinstance(IMG_PREPROCESS, ClipPreprocess) else 'torchvision'),
+            'image_draft_decode': IMAGE_DRAFT_DECODE,
+            'encoder_backend': ENCODER_BACKEND,
+            'onnx_int8': ENCODER_ONNX_INT8,
+            'onnx_models': {k: getattr(m, 'model_file', None) for k, m in (('text', TEXT_MODEL), ('image', IMG_MODEL))},
+            'encoder_errors': dict(ENCODER_ERRORS),
+        },
+        'indices': {
+            k: ann_index.describe(ART.get(k)) or None for k in ('faiss_text', 'faiss_image', 'faiss_fused')
+        },
+        'catalog': (ART['catalog'].stats() if ART.get('catalog') is not None
+                    else {'error': ART['catalog_error']} if ART.get('catalog_error') else None),
+        'artifacts': GENERATIONS.stats(),
+        'executors': {
+            'search': SEARCH_STAGE.stats(),
+            'inference': INFERENCE_STAGE.stats(),
+        },
+        'embedding_cache': {
+            'text': TEXT_CACHE.stats(),
+            'image': IMAGE_CACHE.stats(),
+        },
+        'encoder_batching': {
+            'enabled': ENCODER_BATCHING,
+            'text': TEXT_BATCHER.stats() if TEXT_BATCHER is not None else None,
+            'image': IMAGE_BATCHER.stats() if IMAGE_BATCHER is not None else None,
         }
     }
     return info
@@ -392,7 +889,7 @@ def embed_title(req: EmbedRequest):
     tm = get_text_model()
     if tm is None:
         return {"error": "Text model not available on server. Install sentence-transformers."}
-    emb = tm.encode([req.title], convert_to_numpy=True)
+    emb = _embed_titles([req.title])
     return {"embedding": emb[0].tolist()}
 
 
@@ -413,41 +910,15 @@ def _image_base_url() -> str:
 
 
 def _get_image_key(idx: int) -> Optional[str]:
-    """Return a relative image key like 'train_images/abc.jpg' for a given idx."""
-    path = _resolve_image_path(idx)
-    if path and os.path.exists(path):
-        try:
-            rel = os.path.relpath(path, DATASET_DIR)
-            return rel.replace('\\', '/').lstrip('/')
-        except Exception:
-            pass
-    # Try to infer from metadata
-    meta = ART.get('meta')
-    try:
-        if meta is None or idx < 0 or idx >= len(meta):
-            return None
-        row = meta.iloc[int(idx)]
-        candidates = ['image_path', 'image', 'file', 'filepath', 'image_name', 'image_file']
-        val = None
-        for c in candidates:
-            if c in row and pd.notna(row[c]) and str(row[c]).strip():
-                val = str(row[c]).strip()
-                break
-        if not val:
-            return None
-        p = val.replace('\\', '/').lstrip('/')
-        base = os.path.basename(p)
-        # Prefer known subfolders
-        for sub in ['train_images', 'test_images']:
-            cand = os.path.join(DATASET_DIR, sub, base)
-            if os.path.exists(cand):
-                return f"{sub}/{base}"
-        # Keep provided hint if contains subfolder
-        if p.startswith('train_images/') or p.startswith('test_images/'):
-            return p
-        return f"train_images/{base}"
-    except Exception:
+    """Return a relative image key like 'train_images/abc.jpg' for a given idx.
+
+    Served from the media index built at artifact load time, so decorating a
+    result row never touches the filesystem.
+    """
+    keys = ART.get('image_keys')
+    if keys is None or idx < 0 or idx >= len(keys):
         return None
+    return keys[int(idx)]
 
 
 def _image_url_for_key(key: Optional[str]) -> Optional[str]:
@@ -456,247 +927,737 @@ def _image_url_for_key(key: Optional[str]) -> Optional[str]:
         return None
     return base + '/' + key.lstrip('/')
 
+
 def _resolve_image_path(idx: int):
     meta = ART.get('meta')
     try:
         if meta is None or idx < 0 or idx >= len(meta):
             return None
-        row = meta.iloc[int(idx)]
-        candidates = ['image', 'image_path', 'file', 'filepath', 'image_name', 'image_file']
-        val = None
-        for c in candidates:
-            if c in row and pd.notna(row[c]) and str(row[c]).strip():
-                val = str(row[c]).strip()
-                break
-        if not val:
-            return None
-        p = val.replace('\\', '/').lstrip('/')
-        # Try as-is under dataset root
-        abs_try = p if os.path.isabs(p) else os.path.join(DATASET_DIR, p)
-        if os.path.exists(abs_try):
-            return abs_try
-        # Try common folders
-        base = os.path.basename(p)
-        for sub in ['train_images', 'test_images']:
-            cand = os.path.join(DATASET_DIR, sub, base)
-            if os.path.exists(cand):
-                return cand
+        row = meta.row(int(idx))
+        return (_artifact_image(_image_value(row, [ARTIFACT_IMAGE_COLUMN]))
+                or _resolve_image_value(_image_value(row, IMAGE_COLUMNS)))
     except Exception:
         return None
-    return None
 
 
-@app.post('/dedup/title')
-def dedup_title(title: str = Form(...), top_k: int = Form(5)):
-    tm = get_text_model()
-    if ART.get('faiss_text') is None or tm is None:
-        return {"error": "Text FAISS index or text model not available. Ensure artifacts and sentence-transformers are installed."}
+def _result_meta(idxs) -> List[Optional[Dict[str, Any]]]:
+    """Metadata dicts for result idxs in one vectorized fetch (None for out-of-range idxs)."""
+    idxs = [int(i) for i in idxs]
+    out: List[Optional[Dict[str, Any]]] = [None] * len(idxs)
+    meta = ART.get('meta')
+    if meta is None:
+        return out
+    valid = [j for j, i in enumerate(idxs) if 0 <= i < len(meta)]
+    for j, row in zip(valid, meta.rows([idxs[j] for j in valid])):
+        out[j] = row
+    return out
+
+
+def _cache_lookup(cache: EmbeddingCache, keys: List[str]):
+    """Split a batch into cached rows and the positions that still need encoding."""
+    rows = cache.get_many(keys)
+    return rows, [i for i, r in enumerate(rows) if r is None]
+
+
+def _cache_fill(cache: EmbeddingCache, keys: List[str], rows: List[Any], missing: List[int], encoded) -> np.ndarray:
+    for i, vec in zip(missing, encoded):
+        rows[i] = vec
+        cache.put(keys[i], vec)
+    return np.stack(rows)
 
-    q = tm.encode([title], convert_to_numpy=True).astype('float32')
-    q = _norm(q)
-    index = ART['faiss_text']
-    D, I = index.search(q, top_k)
-    meta_df = ART['meta']
+
+def _embed_titles(titles: List[str]) -> np.ndarray:
+    """Raw title embeddings: cache first, then the micro-batcher when enabled, else one batched call on the inference stage."""
+    keys = [title_key(t) for t in titles]
+    rows, missing = _cache_lookup(TEXT_CACHE, keys)
+    encoded = []
+    if missing:
+        todo = [titles[i] for i in missing]
+        if TEXT_BATCHER is not None:
+            encoded = [f.result() for f in TEXT_BATCHER.submit_many(todo)]
+        else:
+            encoded = INFERENCE_STAGE.call(_text_encode_batch, todo)
+    return _cache_fill(TEXT_CACHE, keys, rows, missing, encoded)
+
+
+async def _embed_titles_async(titles: List[str]) -> np.ndarray:
+    keys = [title_key(t) for t in titles]
+    rows, missing = _cache_lookup(TEXT_CACHE, keys)
+    encoded = []
+    if missing:
+        todo = [titles[i] for i in missing]
+        if TEXT_BATCHER is not None:
+            encoded = await asyncio.gather(*[asyncio.wrap_future(f) for f in TEXT_BATCHER.submit_many(todo)])
+        else:
+            encoded = await INFERENCE_STAGE.run(_text_encode_batch, todo)
+    return _cache_fill(TEXT_CACHE, keys, rows, missing, encoded)
+
+
+def _encode_titles(titles: List[str]) -> np.ndarray:
+    """Encode titles; returns L2-normalized float32 rows."""
+    return _norm(_embed_titles(titles))
+
+
+async def _encode_titles_async(titles: List[str]) -> np.ndarray:
+    return _norm(await _embed_titles_async(titles))
+
+
+"""
+Query image ingestion (/dedup/image, /dedup/fused, /search, /search/batch, /catalog/items):
+  IMAGE_MAX_UPLOAD_MB=<n>    -> uploads larger than this are rejected with 413 while being read (default 10)
+  REQUEST_MAX_BODY_MB=<n>    -> request bodies larger than this are rejected with 413 before they are parsed
+                                (default 64, 0 = no limit); Starlette spools a whole multipart body to
+                                memory/disk before a handler runs, so only this bounds what an upload costs
+  IMAGE_DRAFT_DECODE=0|1     -> decode JPEGs at reduced scale, as build_artifacts does (default 1)
+"""
+IMAGE_MAX_UPLOAD_BYTES = int(float(os.getenv('IMAGE_MAX_UPLOAD_MB', '10')) * 1024 * 1024)
+REQUEST_MAX_BODY_BYTES = int(float(os.getenv('REQUEST_MAX_BODY_MB', '64')) * 1024 * 1024)
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+
+class _BodyTooLarge(Exception):
+    pass
+
+
+class RequestBodyLimit:
+    """ASGI middleware: 413 for bodies over ``limit`` bytes, by Content-Length or while the body streams in."""
+
+    def __init__(self, app, limit: int):
+        self.app = app
+        self.limit = limit
+
+    async def _reject(self, send):
+        await send({'type': 'http.response.start', 'status': 413,
+                    'headers': [(b'content-type', b'application/json')]})
+        await send({'type': 'http.response.body',
+                    'body': ('{"detail": "request body exceeds %d bytes"}' % self.limit).encode()})
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not self.limit:
+            return await self.app(scope, receive, send)
+        length = dict(scope['headers']).get(b'content-length', b'')
+        if length.isdigit() and int(length) > self.limit:
+            return await self._reject(send)
+        state = {'seen': 0, 'over': False, 'started': False}
+
+        async def limited_receive():
+            message = await receive()
+            if message['type'] == 'http.request':
+                state['seen'] += len(message.get('body', b''))
+                if state['seen'] > self.limit:
+                    state['over'] = True
+                    raise _BodyTooLarge()
+            return message
+
+        async def guarded_send(message):
+            if state['over']:
+                return  # the app's error response for the aborted body is replaced by the 413
+            state['started'] = state['started'] or message['type'] == 'http.response.start'
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except _BodyTooLarge:
+            pass
+        if state['over'] and not state['started']:
+            await self._reject(send)
+
+
+# innermost (appended, not inserted), so CORS headers still apply to the 413
+app.user_middleware.append(Middleware(RequestBodyLimit, limit=REQUEST_MAX_BODY_BYTES))
+
+
+async def _read_upload(file: UploadFile) -> bytes:
+    """Read an upload in chunks, stopping with 413 once it passes IMAGE_MAX_UPLOAD_BYTES."""
+    limit = IMAGE_MAX_UPLOAD_BYTES
+    too_large = HTTPException(status_code=413, detail=f"{file.filename or 'upload'} exceeds {limit} bytes")
+    if limit and (getattr(file, 'size', None) or 0) > limit:
+        raise too_large
+    chunks, size = [], 0
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_BYTES)
+        if not chunk:
+            break
+        size += len(chunk)
+        if limit and size > limit:
+            raise too_large
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+def _read_image(contents: bytes):
+    from io import BytesIO
+    return open_image(BytesIO(contents), DRAFT_SIZE if IMAGE_DRAFT_DECODE else None)
+
+
+def _preprocess_images(ipre, contents_list: List[bytes]) -> List[Any]:
+    return [ipre(_read_image(contents)) for contents in contents_list]
+
+
+async def _encode_images(im, ipre, contents_list: List[bytes]) -> np.ndarray:
+    """Decode, preprocess and encode uploaded images (cached by content hash); returns L2-normalized float32 rows."""
+    keys = [image_key(c) for c in contents_list]
+    rows, missing = _cache_lookup(IMAGE_CACHE, keys)
+    encoded = []
+    if missing:
+        tensors = await INFERENCE_STAGE.run(_preprocess_images, ipre, [contents_list[i] for i in missing])
+        if IMAGE_BATCHER is not None:
+            encoded = await asyncio.gather(*[asyncio.wrap_future(f) for f in IMAGE_BATCHER.submit_many(tensors)])
+        else:
+            encoded = await INFERENCE_STAGE.run(_image_encode_batch, tensors)
+    return _norm(_cache_fill(IMAGE_CACHE, keys, rows, missing, encoded))
+
+
+"""
+Approximate index search knobs (ignored by exact flat indices):
+  FAISS_NPROBE=<n>      -> IVF lists probed per query (per-request override: nprobe; default: the value
+                           build_index --nprobe stored in the index)
+  FAISS_EF_SEARCH=<n>   -> HNSW search beam width (per-request override: ef_search; default: the value
+                           build_index --ef-search stored in the index)
+"""
+FAISS_NPROBE = int(os.getenv('FAISS_NPROBE', '0')) or None
+FAISS_EF_SEARCH = int(os.getenv('FAISS_EF_SEARCH', '0')) or None
+
+
+def _search_knobs(nprobe: Optional[int], ef_search: Optional[int]) -> Dict[str, Optional[int]]:
+    return {'nprobe': nprobe or FAISS_NPROBE, 'ef_search': ef_search or FAISS_EF_SEARCH}
+
+
+"""
+Two-stage retrieval for /search, /search/batch and /dedup/fused:
+  SEARCH_OVERSAMPLE=<f>         -> stage 1 searches each index top_k * f deep (default 4; per-request override: oversample)
+  SEARCH_OVERSAMPLE_TEXT=<f>    -> text-index factor (default SEARCH_OVERSAMPLE)
+  SEARCH_OVERSAMPLE_IMAGE=<f>   -> image-index factor (default SEARCH_OVERSAMPLE)
+  SEARCH_DEPTH_MAX=<n>          -> cap on the stage-1 depth per index (default 1000)
+  SEARCH_FUSED_INDEX=0|1        -> use faiss_fused.index when present (default 1)
+  SEARCH_OVERSAMPLE_FUSED=<f>   -> fused-index factor (default 1 for /search, whose ranking is the fused score;
+                                   SEARCH_OVERSAMPLE for /dedup/fused, which ranks by classifier probability)
+Stage 2 rescores the whole union with both modalities and selects the top_k
+with argpartition (ties go to the lower catalog idx). Responses carry the
+depths, the union size and per-stage latency under "retrieval".
+
+A query with both a title and an image whose alpha equals the one the fused
+index was built with runs a single search on that index; an alpha override or
+a single-modality query searches the text and image indices instead.
+"""
+SEARCH_OVERSAMPLE = float(os.getenv('SEARCH_OVERSAMPLE', '4'))
+SEARCH_OVERSAMPLE_BY_MODALITY = {
+    m: float(os.getenv(f'SEARCH_OVERSAMPLE_{m.upper()}', '0')) or SEARCH_OVERSAMPLE for m in ('text', 'image')
+}
+_SEARCH_OVERSAMPLE_FUSED = float(os.getenv('SEARCH_OVERSAMPLE_FUSED', '0'))
+SEARCH_OVERSAMPLE_BY_MODALITY['fused'] = _SEARCH_OVERSAMPLE_FUSED or 1.0
+SEARCH_OVERSAMPLE_BY_MODALITY['fused_classifier'] = _SEARCH_OVERSAMPLE_FUSED or SEARCH_OVERSAMPLE
+SEARCH_DEPTH_MAX = int(os.getenv('SEARCH_DEPTH_MAX', '1000'))
+SEARCH_FUSED_INDEX = (os.getenv('SEARCH_FUSED_INDEX', '1').strip() == '1')
+
+
+def _search_depth(top_k: int, modality: str, oversample: Optional[float] = None) -> int:
+    factor = max(1.0, oversample if oversample is not None else SEARCH_OVERSAMPLE_BY_MODALITY[modality])
+    return max(1, top_k, min(int(np.ceil(top_k * factor)), SEARCH_DEPTH_MAX))
+
+
+def _retrieval_stats() -> Dict[str, Any]:
+    return {'depth': {}, 'candidates': 0, 'timings_ms': {}}
+
+
+@contextmanager
+def _timed(stats: Dict[str, Any], stage: str):
+    """Add the wall time of the block to stats['timings_ms'][stage] (summed over repeats, e.g. batch queries)."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = stats['timings_ms']
+        timings[stage] = round(timings.get(stage, 0.0) + (time.perf_counter() - t0) * 1000.0, 3)
+
+
+def _union_candidates(text_hits, image_hits, fused_hits=None):
+    """Stage-1 union of (D_row, I_row) hits: ascending idxs and each one's best FAISS score per modality (0 if missed)."""
+    rows = [np.asarray(h[1]) for h in (text_hits, image_hits, fused_hits) if h is not None]
+    found = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+    idxs = np.unique(found[found >= 0]).astype(np.int64)
+    scores = []
+    for hits in (text_hits, image_hits):
+        best = np.zeros(len(idxs), dtype=np.float64)
+        if hits is not None:
+            D, I = np.asarray(hits[0], dtype=np.float64), np.asarray(hits[1])
+            ok = I >= 0
+            np.maximum.at(best, np.searchsorted(idxs, I[ok]), D[ok])
+        scores.append(best)
+    return idxs, scores[0], scores[1]
+
+
+def _top_k(scores: np.ndarray, idxs: np.ndarray, k: int) -> np.ndarray:
+    """Positions of the k highest scores, best first; equal scores in ascending idx order."""
+    n = len(scores)
+    if k <= 0 or n == 0:
+        return np.zeros(0, dtype=np.int64)
+    cand = np.arange(n)
+    if k < n:
+        kth = scores[np.argpartition(-scores, k - 1)[k - 1]]
+        cand = np.flatnonzero(scores >= kth)  # the k best plus anything tied with the k-th
+    return cand[np.lexsort((idxs[cand], -scores[cand]))][:k]
+
+
+def _search_live(index, q: np.ndarray, k: int, **knobs):
+    # with live catalog updates, searches share the index with writers and hide deleted items
+    catalog = ART.get('catalog')
+    if catalog is None:
+        return ann_index.search(index, q, k, **knobs)
+    return catalog.search(index, q, k, **knobs)
+
+
+def _search_index(index, q: np.ndarray, k: int, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+    return SEARCH_STAGE.call(_search_live, index, q, k, **_search_knobs(nprobe, ef_search))
+
+
+async def _search_index_async(index, q: np.ndarray, k: int, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+    return await SEARCH_STAGE.run(_search_live, index, q, k, **_search_knobs(nprobe, ef_search))
+
+
+def _fused_index_for(alpha_eff: float):
+    """faiss_fused if it ranks by this alpha (the one it was built with), else None."""
+    index, info = ART.get('faiss_fused'), ART.get('fused_index')
+    if not SEARCH_FUSED_INDEX or index is None or info is None:
+        return None
+    return index if abs(float(alpha_eff) - float(info['alpha'])) <= 1e-6 else None
+
+
+async def _stage_one(text_q: List[Optional[np.ndarray]], img_q: List[Optional[np.ndarray]], top_k: int,
+                     alpha_eff: float, nprobe: Optional[int], ef_search: Optional[int], oversample: Optional[float],
+                     stats: Dict[str, Any], fused_depth: str = 'fused'):
+    """Stage-1 (D_row, I_row) hits per query as (text_hits, image_hits, fused_hits) lists.
+
+    Queries with both modalities share one search on the fused index when it
+    applies; the rest run one search per modality (each batched over queries).
+    ``fused_depth`` names the oversample factor of the fused search ('fused_classifier'
+    when the candidates are ranked by the classifier rather than the fused score).
+    """
+    n = len(text_q)
+    hits = {m: [None] * n for m in ('text', 'image', 'fused')}
+    fused_index = _fused_index_for(alpha_eff)
+    fused_rows = []
+    if fused_index is not None:
+        fused_rows = [i for i in range(n) if text_q[i] is not None and img_q[i] is not None]
+    if fused_rows:
+        q = ann_index.fused_vectors(np.stack([img_q[i] for i in fused_rows]), np.stack([text_q[i] for i in fused_rows]),
+                                    ART['fused_index']['alpha'])
+        stats['depth']['fused'] = _search_depth(top_k, fused_depth, oversample)
+        with _timed(stats, 'search_fused'):
+            D, I = await _search_index_async(fused_index, q, stats['depth']['fused'], nprobe, ef_search)
+        for r, i in enumerate(fused_rows):
+            hits['fused'][i] = (D[r], I[r])
+    done = set(fused_rows)
+    for modality, queries in (('text', text_q), ('image', img_q)):
+        rows = [i for i in range(n) if queries[i] is not None and i not in done]
+        if not rows:
+            continue
+        stats['depth'][modality] = _search_depth(top_k, modality, oversample)
+        with _timed(stats, f'search_{modality}'):
+            D, I = await _search_index_async(ART[f'faiss_{modality}'], np.stack([queries[i] for i in rows]),
+                                             stats['depth'][modality], nprobe, ef_search)
+        for r, i in enumerate(rows):
+            hits[modality][i] = (D[r], I[r])
+    return hits['text'], hits['image'], hits['fused']
+
+
+def _hit_results(D_row: np.ndarray, I_row: np.ndarray) -> List[Dict[str, Any]]:
+    """Decorate one row of FAISS hits with metadata and image links."""
+    valid = I_row >= 0  # FAISS pads with -1 when fewer than k items match
+    D_row, I_row = D_row[valid], I_row[valid]
+    metas = _result_meta(I_row)
     results = []
-    for dist, idx in zip(D[0], I[0]):
-        meta = None
-        if meta_df is not None and idx < len(meta_df):
-            meta = meta_df.iloc[int(idx)].to_dict()
+    for dist, idx, meta in zip(D_row, I_row, metas):
         key = _get_image_key(int(idx))
         url = _image_url_for_key(key)
         results.append({'idx': int(idx), 'score': float(dist), 'meta': meta, 'image_key': key, 'image_url': url})
-    return {'query': title, 'results': results}
+    return results
+
+
+def _fused_rank(text_emb_q: Optional[np.ndarray], img_emb_q: Optional[np.ndarray], text_hits, image_hits,
+                top_k: int, alpha_eff: float, stats: Optional[Dict[str, Any]] = None,
+                fused_hits=None) -> List[Dict[str, Any]]:
+    """Rescore the union of stage-1 hits (D_row, I_row) with both modalities and rank it by fused cosine score."""
+    stats = _retrieval_stats() if stats is None else stats
+    with _timed(stats, 'rescore'):
+        idxs, text_score, image_score = _union_candidates(text_hits, image_hits, fused_hits)
+        # with raw embeddings every candidate gets both similarities (one gathered mat-vec per modality)
+        text_embs = ART.get('text_embs')
+        image_embs = ART.get('image_embs')
+        if img_emb_q is not None and image_embs is not None:
+            image_score = image_embs.dot(idxs, img_emb_q).astype(np.float64)
+        if text_emb_q is not None and text_embs is not None:
+            text_score = text_embs.dot(idxs, text_emb_q).astype(np.float64)
+        fused = alpha_eff * image_score + (1.0 - alpha_eff) * text_score
+    with _timed(stats, 'select'):
+        top = _top_k(fused, idxs, top_k)
+    stats['candidates'] += len(idxs)
+    selected = idxs[top].tolist()
+    results = []
+    for j, idx, m in zip(top.tolist(), selected, _result_meta(selected)):
+        key = _get_image_key(idx)
+        url = _image_url_for_key(key)
+        results.append({'idx': idx, 'meta': m, 'text_score': float(text_score[j]), 'image_score': float(image_score[j]),
+                        'fused': float(fused[j]), 'image_key': key, 'image_url': url})
+    return results
+
+
+def _search_alpha(alpha: Optional[float]) -> float:
+    alpha_eff = 0.5
+    if ART.get('clf_obj') is not None:
+        alpha_eff = ART['clf_obj'].get('alpha', alpha_eff)
+    if alpha is not None:
+        alpha_eff = alpha
+    return alpha_eff
+
+
+# Upper bound on queries per batch request
+BATCH_MAX_QUERIES = int(os.getenv('BATCH_MAX_QUERIES', '256'))
+
+
+class TitleBatchRequest(BaseModel):
+    titles: List[str]
+    top_k: int = 5
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+
+
+@app.post('/dedup/title')
+def dedup_title(title: str = Form(...), top_k: int = Form(5), nprobe: Optional[int] = Form(None), ef_search: Optional[int] = Form(None)):
+    tm = get_text_model()
+    if ART.get('faiss_text') is None or tm is None:
+        return {"error": "Text FAISS index or text model not available. Ensure artifacts and sentence-transformers are installed."}
+
+    q = _encode_titles([title])
+    D, I = _search_index(ART['faiss_text'], q, top_k, nprobe, ef_search)
+    return {'query': title, 'results': _hit_results(D[0], I[0])}
+
+
+@app.post('/dedup/title/batch')
+def dedup_title_batch(req: TitleBatchRequest):
+    """Duplicate check for many titles: one batched encode and one FAISS search for the whole batch."""
+    tm = get_text_model()
+    if ART.get('faiss_text') is None or tm is None:
+        return {"error": "Text FAISS index or text model not available. Ensure artifacts and sentence-transformers are installed."}
+    if len(req.titles) > BATCH_MAX_QUERIES:
+        return {"error": f"too many titles in one batch (max {BATCH_MAX_QUERIES})"}
+    if not req.titles:
+        return {'results': []}
+
+    q = _encode_titles(req.titles)
+    D, I = _search_index(ART['faiss_text'], q, req.top_k, req.nprobe, req.ef_search)
+    return {'results': [{'query': t, 'results': _hit_results(D[r], I[r])} for r, t in enumerate(req.titles)]}
 
 
 @app.post('/dedup/image')
-async def dedup_image(file: UploadFile = File(...), top_k: int = Form(5)):
+async def dedup_image(file: UploadFile = File(...), top_k: int = Form(5), nprobe: Optional[int] = Form(None), ef_search: Optional[int] = Form(None)):
     if ART.get('faiss_image') is None:
         return {"error": "Image FAISS index not available. Ensure artifacts are placed in siamese_artifacts."}
     im, ipre = get_image_model()
     if im is None or ipre is None or Image is None:
         return {"error": "OpenCLIP or image dependencies not installed on server. Install open_clip_torch and pillow to enable image dedup."}
 
-    contents = await file.read()
-    from io import BytesIO
-    pil = Image.open(BytesIO(contents)).convert('RGB')
-    x = ipre(pil).unsqueeze(0)
-    if torch.cuda.is_available():
-        x = x.to('cuda')
-    with torch.no_grad():
-        emb = im.encode_image(x)
-        emb = emb.detach().cpu().numpy().astype('float32')
-    emb = _norm(emb)
-    index = ART['faiss_image']
-    D, I = index.search(emb, top_k)
-    meta_df = ART['meta']
-    results = []
-    for dist, idx in zip(D[0], I[0]):
-        meta = None
-        if meta_df is not None and idx < len(meta_df):
-            meta = meta_df.iloc[int(idx)].to_dict()
-        key = _get_image_key(int(idx))
-        url = _image_url_for_key(key)
-        results.append({'idx': int(idx), 'score': float(dist), 'meta': meta, 'image_key': key, 'image_url': url})
-    return {'results': results}
+    contents = await _read_upload(file)
+    emb = await _encode_images(im, ipre, [contents])
+    D, I = await _search_index_async(ART['faiss_image'], emb, top_k, nprobe, ef_search)
+    return {'results': await SEARCH_STAGE.run(_hit_results, D[0], I[0])}
 
 
 @app.post('/dedup/fused')
-async def dedup_fused(title: Optional[str] = Form(None), file: Optional[UploadFile] = File(None), top_k: int = Form(5), alpha: Optional[float] = Form(None)):
+async def dedup_fused(title: Optional[str] = Form(None), file: Optional[UploadFile] = File(None), top_k: int = Form(5), alpha: Optional[float] = Form(None), nprobe: Optional[int] = Form(None), ef_search: Optional[int] = Form(None), oversample: Optional[float] = Form(None)):
     # Requires at least one of title or file
     if ART.get('faiss_text') is None and ART.get('faiss_image') is None:
         return {"error": "No FAISS indices available."}
     if ART.get('clf_obj') is None:
         return {"error": "Classifier artifact (threshold_clf.pkl) not found. Fused decision requires the classifier."}
 
-    candidates = set()
-
+    clf_obj = ART.get('clf_obj')
+    alpha_eff = alpha if (alpha is not None) else clf_obj.get('alpha', 0.5)
+    stats = _retrieval_stats()
     text_emb_q = None
     img_emb_q = None
 
     tm = get_text_model()
     if title and tm is not None and ART.get('faiss_text') is not None:
-        q = tm.encode([title], convert_to_numpy=True).astype('float32')
-        q = _norm(q)
-        D_t, I_t = ART['faiss_text'].search(q, top_k)
-        candidates.update([int(x) for x in I_t[0]])
+        with _timed(stats, 'encode_text'):
+            q = await _encode_titles_async([title])
         text_emb_q = q[0]
 
     im, ipre = get_image_model()
     if file is not None and im is not None and ART.get('faiss_image') is not None:
-        contents = await file.read()
-        from io import BytesIO
-        pil = Image.open(BytesIO(contents)).convert('RGB')
-        x = ipre(pil).unsqueeze(0)
-        if torch.cuda.is_available():
-            x = x.to('cuda')
-        with torch.no_grad():
-            emb = im.encode_image(x)
-            emb = emb.detach().cpu().numpy().astype('float32')
-        emb = _norm(emb)
-        D_i, I_i = ART['faiss_image'].search(emb, top_k)
-        candidates.update([int(x) for x in I_i[0]])
+        with _timed(stats, 'encode_image'):
+            contents = await _read_upload(file)
+            emb = await _encode_images(im, ipre, [contents])
         img_emb_q = emb[0]
 
+    text_hits, image_hits, fused_hits = await _stage_one([text_emb_q], [img_emb_q], top_k, alpha_eff,
+                                                         nprobe, ef_search, oversample, stats,
+                                                         fused_depth='fused_classifier')
+    candidates = _union_candidates(text_hits[0], image_hits[0], fused_hits[0])[0]
     if len(candidates) == 0:
         return {'results': []}
 
-    # For each candidate compute features and run classifier
+    results = await SEARCH_STAGE.run(_fused_decisions, candidates, text_emb_q, img_emb_q, top_k, alpha_eff, stats)
+    return {'results': results, 'alpha': float(alpha_eff), 'retrieval': stats}
+
+
+def _fused_decisions(cand_idxs: np.ndarray, text_emb_q: Optional[np.ndarray], img_emb_q: Optional[np.ndarray],
+                     top_k: int, alpha_eff: float, stats: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """Score candidates against the query and run the duplicate classifier once over all of them."""
+    stats = _retrieval_stats() if stats is None else stats
+    cand_idxs = np.asarray(cand_idxs, dtype=np.int64)
     text_embs = ART.get('text_embs')
     image_embs = ART.get('image_embs')
-    clf_obj = ART.get('clf_obj')
-    alpha_eff = alpha if (alpha is not None) else clf_obj.get('alpha', 0.5)
+    scorer = ART.get('clf_scorer') or compile_classifier(ART.get('clf_obj'))
 
-    results = []
-    for idx in list(candidates)[:200]:
-        img_sim = 0.0
-        txt_sim = 0.0
+    with _timed(stats, 'rescore'):
+        # one gathered mat-vec per modality over all candidates
+        img_sims = np.zeros(len(cand_idxs), dtype=np.float32)
+        txt_sims = np.zeros(len(cand_idxs), dtype=np.float32)
         if img_emb_q is not None and image_embs is not None:
-            img_sim = float((img_emb_q * _norm(image_embs[idx:idx+1])[0]).sum())
+            img_sims = image_embs.dot(cand_idxs, img_emb_q)
         if text_emb_q is not None and text_embs is not None:
-            txt_sim = float((text_emb_q * _norm(text_embs[idx:idx+1])[0]).sum())
-        fused = alpha_eff * img_sim + (1.0 - alpha_eff) * txt_sim
-        # classifier
-        try:
-            x = np.array([[img_sim, txt_sim, fused]], dtype=np.float32)
-            p = clf_obj['clf'].predict_proba(x)[:,1][0]
-            decision = p >= clf_obj.get('best_threshold', 0.5)
-        except Exception:
-            p = fused
-            decision = fused >= 0.5
-
-        meta = None
-        if ART['meta'] is not None and idx < len(ART['meta']):
-            meta = ART['meta'].iloc[int(idx)].to_dict()
-        key = _get_image_key(int(idx))
+            txt_sims = text_embs.dot(cand_idxs, text_emb_q)
+        fused, probs, decisions = scorer.score(img_sims, txt_sims, alpha_eff)
+    # by probability (fused similarity without a classifier)
+    with _timed(stats, 'select'):
+        top = _top_k(probs, cand_idxs, top_k).tolist()
+    stats['candidates'] += len(cand_idxs)
+    idxs = [int(cand_idxs[i]) for i in top]
+    results = []
+    for i, idx, meta in zip(top, idxs, _result_meta(idxs)):
+        key = _get_image_key(idx)
         url = _image_url_for_key(key)
-        results.append({'idx': int(idx), 'image_sim': img_sim, 'text_sim': txt_sim, 'fused_sim': fused, 'prob': float(p), 'decision': bool(decision), 'meta': meta, 'image_key': key, 'image_url': url})
-
-    # sort by prob or fused
-    results = sorted(results, key=lambda x: x.get('prob', x.get('fused_sim', 0)), reverse=True)[:top_k]
-    return {'results': results, 'alpha': float(alpha_eff)}
+        results.append({'idx': idx, 'image_sim': float(img_sims[i]), 'text_sim': float(txt_sims[i]),
+                        'fused_sim': float(fused[i]), 'prob': float(probs[i]), 'decision': bool(decisions[i]),
+                        'meta': meta, 'image_key': key, 'image_url': url})
+    return results
 
 
 @app.post('/search')
-async def search(title: Optional[str] = Form(None), file: Optional[UploadFile] = File(None), top_k: int = Form(10), alpha: Optional[float] = Form(None)):
+async def search(title: Optional[str] = Form(None), file: Optional[UploadFile] = File(None), top_k: int = Form(10), alpha: Optional[float] = Form(None), nprobe: Optional[int] = Form(None), ef_search: Optional[int] = Form(None), oversample: Optional[float] = Form(None)):
     """Semantic search: title and/or image. Returns top-K by fused score (no classifier decision)."""
-    candidates: Dict[int, Dict[str, Any]] = {}
-    alpha_eff = 0.5
-    if ART.get('clf_obj') is not None:
-        alpha_eff = ART['clf_obj'].get('alpha', alpha_eff)
-    if alpha is not None:
-        alpha_eff = alpha
+    alpha_eff = _search_alpha(alpha)
+    stats = _retrieval_stats()
 
     text_emb_q = None
     img_emb_q = None
 
     tm = get_text_model()
     if title and tm is not None and ART.get('faiss_text') is not None:
-        q = tm.encode([title], convert_to_numpy=True).astype('float32')
-        q = _norm(q)
-        D_t, I_t = ART['faiss_text'].search(q, top_k)
+        with _timed(stats, 'encode_text'):
+            q = await _encode_titles_async([title])
         text_emb_q = q[0]
-        for score, idx in zip(D_t[0], I_t[0]):
-            entry = candidates.setdefault(int(idx), {'idx': int(idx), 'meta': None, 'text_score': 0.0, 'image_score': 0.0})
-            entry['text_score'] = max(entry['text_score'], float(score))
 
     im, ipre = get_image_model()
     if file is not None and im is not None and ART.get('faiss_image') is not None:
-        contents = await file.read()
-        from io import BytesIO
-        pil = Image.open(BytesIO(contents)).convert('RGB')
-        x = ipre(pil).unsqueeze(0)
-        if torch.cuda.is_available():
-            x = x.to('cuda')
-        with torch.no_grad():
-            emb = im.encode_image(x).detach().cpu().numpy().astype('float32')
-        emb = _norm(emb)
+        with _timed(stats, 'encode_image'):
+            contents = await _read_upload(file)
+            emb = await _encode_images(im, ipre, [contents])
         img_emb_q = emb[0]
-        D_i, I_i = ART['faiss_image'].search(emb, top_k)
-        for score, idx in zip(D_i[0], I_i[0]):
-            entry = candidates.setdefault(int(idx), {'idx': int(idx), 'meta': None, 'text_score': 0.0, 'image_score': 0.0})
-            entry['image_score'] = max(entry['image_score'], float(score))
 
-    meta_df = ART.get('meta')
-    text_embs = ART.get('text_embs')
-    image_embs = ART.get('image_embs')
+    text_hits, image_hits, fused_hits = await _stage_one([text_emb_q], [img_emb_q], top_k, alpha_eff,
+                                                         nprobe, ef_search, oversample, stats)
+    results = await SEARCH_STAGE.run(_fused_rank, text_emb_q, img_emb_q, text_hits[0], image_hits[0], top_k,
+                                     alpha_eff, stats, fused_hits[0])
+    return {'results': results, 'alpha': float(alpha_eff), 'retrieval': stats}
 
-    results = []
-    for idx, entry in candidates.items():
-        # If we have raw embeddings for better fused score, recompute cosine vs candidate
-        img_sim = entry['image_score']
-        txt_sim = entry['text_score']
-        if img_emb_q is not None and image_embs is not None:
-            img_sim = float((img_emb_q * _norm(image_embs[idx:idx+1])[0]).sum())
-        if text_emb_q is not None and text_embs is not None:
-            txt_sim = float((text_emb_q * _norm(text_embs[idx:idx+1])[0]).sum())
-        fused = alpha_eff * img_sim + (1.0 - alpha_eff) * txt_sim
-        m = None
-        if meta_df is not None and idx < len(meta_df):
-            m = meta_df.iloc[int(idx)].to_dict()
-        key = _get_image_key(int(idx))
-        url = _image_url_for_key(key)
-        entry.update({'meta': m, 'fused': fused, 'image_score': img_sim, 'text_score': txt_sim, 'image_key': key, 'image_url': url})
-        results.append(entry)
 
-    results = sorted(results, key=lambda x: x['fused'], reverse=True)[:top_k]
-    return {'results': results, 'alpha': float(alpha_eff)}
+@app.post('/search/batch')
+async def search_batch(titles: Optional[str] = Form(None), files: Optional[List[UploadFile]] = File(None), top_k: int = Form(10), alpha: Optional[float] = Form(None), nprobe: Optional[int] = Form(None), ef_search: Optional[int] = Form(None), oversample: Optional[float] = Form(None)):
+    """Batched semantic search.
+
+    titles: JSON array of titles (null/empty entries allowed); files: optional images.
+    Query i pairs titles[i] with files[i]; all titles are encoded in one call, all
+    images in one call, and each index runs one FAISS search for the batch.
+    Stage timings in "retrieval" are summed over the batch.
+    """
+    import json
+    try:
+        title_list = json.loads(titles) if titles else []
+    except ValueError:
+        return {"error": "titles must be a JSON array of strings"}
+    if not isinstance(title_list, list):
+        return {"error": "titles must be a JSON array of strings"}
+    files = files or []
+    n = max(len(title_list), len(files))
+    if n > BATCH_MAX_QUERIES:
+        return {"error": f"too many queries in one batch (max {BATCH_MAX_QUERIES})"}
+    alpha_eff = _search_alpha(alpha)
+    stats = _retrieval_stats()
+
+    text_q: List[Optional[np.ndarray]] = [None] * n
+    img_q: List[Optional[np.ndarray]] = [None] * n
+
+    tm = get_text_model()
+    rows = [i for i, t in enumerate(title_list) if t]
+    if rows and tm is not None and ART.get('faiss_text') is not None:
+        with _timed(stats, 'encode_text'):
+            q = await _encode_titles_async([str(title_list[i]) for i in rows])
+        for r, i in enumerate(rows):
+            text_q[i] = q[r]
+
+    im, ipre = get_image_model()
+    if files and im is not None and ART.get('faiss_image') is not None:
+        with _timed(stats, 'encode_image'):
+            contents_list = [await _read_upload(f) for f in files]
+            emb = await _encode_images(im, ipre, contents_list)
+        for i in range(len(files)):
+            img_q[i] = emb[i]
+
+    text_hits, image_hits, fused_hits = await _stage_one(text_q, img_q, top_k, alpha_eff, nprobe, ef_search,
+                                                         oversample, stats)
+
+    def rank_all():
+        return [{
+            'title': title_list[i] if i < len(title_list) else None,
+            'results': _fused_rank(text_q[i], img_q[i], text_hits[i], image_hits[i], top_k, alpha_eff, stats,
+                                   fused_hits[i]),
+        } for i in range(n)]
+
+    return {'results': await SEARCH_STAGE.run(rank_all), 'alpha': float(alpha_eff), 'retrieval': stats}
+
+
+def _save_catalog_image(contents: bytes, filename: Optional[str]) -> Tuple[str, Optional[str]]:
+    """Store an uploaded listing image under the dataset's catalog_images folder.
+
+    Returns its file name and the path if this call created the file (None when an
+    identical image was already stored), so a failed add can remove what it wrote.
+    """
+    import hashlib
+    ext = os.path.splitext(filename or '')[1].lower() or '.jpg'
+    name = hashlib.sha1(contents).hexdigest()[:20] + ext
+    folder = os.path.join(DATASET_DIR, CATALOG_IMAGES_SUBDIR)
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, name)
+    if os.path.exists(path):
+        return name, None
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(contents)
+    os.replace(tmp, path)
+    return name, path
+
+
+def _remove_files(paths: List[str]):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+@app.post('/catalog/items')
+async def catalog_add_items(items: str = Form(...), files: Optional[List[UploadFile]] = File(None),
+                            x_admin_token: Optional[str] = Header(None)):
+    """Add listings to the live catalog without a rebuild (requires X-Admin-Token).
+
+    items: JSON array of objects with metadata columns (``title`` required);
+    files: optional images, paired with items by position. Titles and images
+    are each encoded in one batch; the new rows are searchable on return.
+    """
+    import json
+    _check_admin(x_admin_token)
+    catalog = ART.get('catalog')
+    if catalog is None:
+        return {"error": "Catalog updates are disabled. Set CATALOG_WRITES=1 (requires meta.csv in the artifacts)."}
+    try:
+        rows = json.loads(items)
+    except ValueError:
+        return {"error": "items must be a JSON array of objects"}
+    if not isinstance(rows, list) or not all(isinstance(r, dict) for r in rows):
+        return {"error": "items must be a JSON array of objects"}
+    if any(not str(r.get('title') or '').strip() for r in rows):
+        return {"error": "every item needs a non-empty title"}
+    files = files or []
+    if len(files) > len(rows):
+        return {"error": "more files than items"}
+    if len(rows) > BATCH_MAX_QUERIES:
+        return {"error": f"too many items in one request (max {BATCH_MAX_QUERIES})"}
+    if not rows:
+        return {'added': []}
+    try:
+        catalog.check_rows(rows)
+    except ValueError as e:
+        return {"error": str(e)}
+
+    tm = get_text_model()
+    if tm is None and ART.get('faiss_text') is not None:
+        return {"error": "Text model not available; cannot encode new titles."}
+    text_vecs: List[Optional[np.ndarray]] = [None] * len(rows)
+    if tm is not None:
+        text_vecs = list(await _encode_titles_async([str(r['title']) for r in rows]))
+
+    image_vecs: List[Optional[np.ndarray]] = [None] * len(rows)
+    if files:
+        im, ipre = get_image_model()
+        if im is None or ipre is None or Image is None:
+            return {"error": "Image model not available; cannot encode uploaded images."}
+        contents_list = [await _read_upload(f) for f in files]
+        emb = await _encode_images(im, ipre, contents_list)
+    # images are stored before the add (their keys resolve to the files); an add that fails
+    # before it is logged removes the files it wrote (a logged add keeps them for the replay)
+    created: List[str] = []
+    failed_before = catalog.failed
+    try:
+        for i, (f, contents) in enumerate(zip(files, contents_list) if files else ()):
+            image_vecs[i] = emb[i]
+            rows[i]['image'], path = await INFERENCE_STAGE.run(_save_catalog_image, contents, f.filename)
+            if path is not None:
+                created.append(path)
+        idxs = await SEARCH_STAGE.run(catalog.add_items, rows, text_vecs, image_vecs)
+    except Exception as e:
+        if catalog.failed is failed_before:
+            _remove_files(created)
+        if isinstance(e, (RuntimeError, ValueError)):
+            return {"error": str(e)}
+        raise
+    return {'added': [{'idx': i, 'image_key': _get_image_key(i), 'image_url': _image_url_for_key(_get_image_key(i))}
+                      for i in idxs]}
+
+
+@app.delete('/catalog/items/{idx}')
+def catalog_delete_item(idx: int, x_admin_token: Optional[str] = Header(None)):
+    """Remove a listing from search results (logged, so it stays deleted across restarts; requires X-Admin-Token)."""
+    _check_admin(x_admin_token)
+    catalog = ART.get('catalog')
+    if catalog is None:
+        return {"error": "Catalog updates are disabled. Set CATALOG_WRITES=1 (requires meta.csv in the artifacts)."}
+    try:
+        deleted = catalog.delete_items([idx])
+    except RuntimeError as e:
+        return {"error": str(e)}
+    if not deleted:
+        return {"error": f"idx {idx} does not exist or is already deleted"}
+    return {'deleted': idx}
+
+
+FRAUD_PAGE_MAX = 1000
+
+
+def _fraud_page(fraud: Dict[str, Any], by: str, n: int, offset: int, limit: Optional[int], min_count: int,
+                min_score: Optional[float]):
+    limit = max(0, min(n if limit is None else limit, FRAUD_PAGE_MAX))
+    offset = max(0, offset)
+    positions, total = fraud['directory'].ranked(by, offset, limit, min_count=min_count, min_score=min_score)
+    return positions, {'total': int(total), 'offset': offset, 'limit': limit}
 
 
 @app.get('/fraud/sellers/anomaly')
-def fraud_top_anomalies(n: int = 20):
-    _build_fraud_model()
-    if FRAUD['model'] is None or FRAUD['seller_ids'] is None:
+def fraud_top_anomalies(n: int = 20, offset: int = 0, limit: Optional[int] = None, min_count: int = 0,
+                        min_score: Optional[float] = None):
+    """Sellers by descending anomaly score, paged with offset/limit (n is the legacy page size)."""
+    fraud = _build_fraud_model()
+    if fraud['model'] is None or fraud['seller_ids'] is None:
         return {'error': "seller_id not found in metadata; cannot compute seller anomalies."}
-    model = FRAUD['model']
-    X = FRAUD['seller_features']
-    sids = FRAUD['seller_ids']
-    counts = FRAUD['counts']
-    scores = -model.score_samples(X)  # higher means more anomalous
-    order = np.argsort(-scores)
+    sids = fraud['seller_ids']
+    counts = fraud['counts']
+    scores = fraud['directory'].anomaly_scores  # higher means more anomalous
+    positions, page = _fraud_page(fraud, 'anomaly', n, offset, limit, min_count, min_score)
     out = []
-    for i in order[:n]:
+    for i in positions.tolist():
         out.append({'seller_id': str(sids[i]), 'anomaly_score': float(scores[i]), 'count': int(counts[i])})
-    return {'results': out}
+    return {'results': out, **page}
 
 
 # -----------------------------
@@ -713,7 +1674,7 @@ def get_random_samples(count: int = 12):
         if meta is None:
             meta_path = os.path.join(ARTIFACT_DIR, 'meta.csv')
             if os.path.exists(meta_path):
-                meta = pd.read_csv(meta_path)
+                meta = MetaStore.from_frame(pd.read_csv(meta_path))
             else:
                 return {'results': []}
         n = len(meta)
@@ -726,19 +1687,9 @@ def get_random_samples(count: int = 12):
         # sample without replacement
         idxs = np.random.choice(n, size=c, replace=False).tolist()
         results = []
-        has_title = hasattr(meta, 'columns') and ('title' in meta.columns)
-        for i in idxs:
+        titles = meta.column('title', idxs) if 'title' in meta.columns else [None] * len(idxs)
+        for i, title in zip(idxs, titles):
             try:
-                title = None
-                if has_title:
-                    # robust access in case of numpy/pandas variances
-                    try:
-                        title = meta.iloc[int(i)]['title']
-                    except Exception:
-                        try:
-                            title = meta.loc[int(i), 'title']
-                        except Exception:
-                            title = None
                 key = _get_image_key(int(i))
                 url = _image_url_for_key(key)
                 results.append({'idx': int(i), 'title': None if title is None else str(title), 'image_key': key, 'image_url': url})
@@ -749,42 +1700,61 @@ def get_random_samples(count: int = 12):
         return {'error': f'sampling failed: {e}'}
 
 
+def _lookup_seller(fraud: Dict[str, Any], seller_id) -> Optional[Dict[str, Any]]:
+    found = fraud['directory'].lookup(seller_id)
+    if found is not None and fraud['rings'] is not None:
+        found.update(fraud['rings'].seller(fraud['directory'].position(seller_id)))
+    return found
+
+
 @app.get('/fraud/seller/{seller_id}')
 def fraud_seller(seller_id: str):
-    _build_fraud_model()
-    if FRAUD['model'] is None or FRAUD['seller_ids'] is None:
+    fraud = _build_fraud_model()
+    if fraud['model'] is None or fraud['seller_ids'] is None:
         return {'error': "seller_id not found in metadata; cannot compute seller anomaly."}
-    sids = FRAUD['seller_ids']
-    try:
-        idx = np.where(sids.astype(str) == str(seller_id))[0]
-        if len(idx) == 0:
-            return {'error': 'seller not found'}
-        i = int(idx[0])
-        model = FRAUD['model']
-        x = FRAUD['seller_features'][i:i+1]
-        score = -model.score_samples(x)[0]
-        return {'seller_id': str(seller_id), 'anomaly_score': float(score), 'count': int(FRAUD['counts'][i])}
-    except Exception as e:
-        return {'error': str(e)}
+    found = _lookup_seller(fraud, seller_id)
+    if found is None:
+        return {'error': 'seller not found'}
+    return found
+
+
+class SellerLookupRequest(BaseModel):
+    seller_ids: List[str]
+
+
+@app.post('/fraud/sellers/lookup')
+def fraud_sellers_lookup(req: SellerLookupRequest):
+    """Bulk form of /fraud/seller/{seller_id}; results follow the order of seller_ids."""
+    fraud = _build_fraud_model()
+    if fraud['model'] is None or fraud['seller_ids'] is None:
+        return {'error': "seller_id not found in metadata; cannot compute seller anomaly."}
+    results = []
+    for sid in req.seller_ids:
+        found = _lookup_seller(fraud, sid)
+        results.append(found if found is not None else {'seller_id': sid, 'error': 'seller not found'})
+    return {'results': results}
 
 
 @app.get('/fraud/sellers/insights')
-def fraud_seller_insights(n: int = 20):
-    """Return top-N risky sellers by heuristic risk_score with metrics (no training)."""
-    _build_fraud_model()
-    df = FRAUD.get('features_df')
+def fraud_seller_insights(n: int = 20, offset: int = 0, limit: Optional[int] = None, min_count: int = 0,
+                          min_score: Optional[float] = None):
+    """Return sellers by heuristic risk_score with metrics (no training), paged like /fraud/sellers/anomaly."""
+    fraud = _build_fraud_model()
+    df = fraud['features_df']
     if df is None or len(df) == 0:
         return {'error': 'insights unavailable'}
-    d = df.sort_values('risk_score', ascending=False).head(n)
-    results = d.to_dict(orient='records')
+    positions, page = _fraud_page(fraud, 'risk', n, offset, limit, min_count, min_score)
+    results = df.iloc[positions].to_dict(orient='records')
     # cast to builtin types
     for r in results:
         for k, v in list(r.items()):
-            if isinstance(v, (np.floating, np.integer)):
+            if k == 'ring_id':
+                r[k] = int(v) if v >= 0 else None  # as in /fraud/seller/{seller_id}
+            elif isinstance(v, (np.floating, np.integer)):
                 r[k] = float(v)
             elif k == 'seller_id':
                 r[k] = str(v)
-    return {'results': results}
+    return {'results': results, **page}
 
 
 @app.get('/fraud/seller/{seller_id}/duplicates')
@@ -792,8 +1762,7 @@ def fraud_seller_duplicates(seller_id: str, top: int = 50, threshold: float = 0.
     """List within-seller likely duplicate pairs based on cosine similarity thresholds.
     use = 'fused' | 'text' | 'image'
     """
-    _build_fraud_model()
-    groups = FRAUD.get('seller_groups')
+    groups = _build_fraud_model()['seller_groups']
     if groups is None or seller_id not in groups:
         return {'error': 'seller not found'}
     idxs = groups[seller_id]
@@ -804,44 +1773,21 @@ def fraud_seller_duplicates(seller_id: str, top: int = 50, threshold: float = 0.
     alpha = 0.5
     if ART.get('clf_obj') is not None:
         alpha = ART['clf_obj'].get('alpha', alpha)
-    # Sample pairs if too many
-    max_pairs = 2000
-    pairs = []
-    for i in range(min(len(idxs), 500)):
-        for j in range(i+1, min(len(idxs), 500)):
-            pairs.append((int(idxs[i]), int(idxs[j])))
-            if len(pairs) >= max_pairs:
-                break
-        if len(pairs) >= max_pairs:
-            break
+    # every pair is scored (blocked matrix products); only the top ones are kept
+    pairs = seller_duplicate_pairs(idxs, text_embs, image_embs, alpha=alpha, use=use, threshold=threshold, top=top)
+    txt, img, fused = pairs['text'], pairs['image'], pairs['fused']
     scored = []
-    for a, b in pairs:
-        txt = None
-        img = None
-        if text_embs is not None:
-            va = _norm(text_embs[a:a+1])[0]
-            vb = _norm(text_embs[b:b+1])[0]
-            txt = float((va * vb).sum())
-        if image_embs is not None:
-            va = _norm(image_embs[a:a+1])[0]
-            vb = _norm(image_embs[b:b+1])[0]
-            img = float((va * vb).sum())
-        fused = None
-        if txt is not None and img is not None:
-            fused = alpha * img + (1.0 - alpha) * txt
-        score = {'text': txt, 'image': img, 'fused': fused}.get(use, fused)
-        if score is None:
-            score = txt if use == 'text' else img
-        if score is None:
-            continue
-        if score >= threshold:
-            scored.append({'a': a, 'b': b, 'score': float(score), 'text': txt, 'image': img, 'fused': fused})
-    scored.sort(key=lambda x: x['score'], reverse=True)
-    meta = ART.get('meta')
+    for k in range(len(pairs['a'])):
+        scored.append({
+            'a': int(pairs['a'][k]), 'b': int(pairs['b'][k]), 'score': float(pairs['score'][k]),
+            'text': None if txt is None else float(txt[k]),
+            'image': None if img is None else float(img[k]),
+            'fused': None if fused is None else float(fused[k]),
+        })
+    a_metas = _result_meta([s['a'] for s in scored])
+    b_metas = _result_meta([s['b'] for s in scored])
     out = []
-    for s in scored[:top]:
-        ma = meta.iloc[int(s['a'])].to_dict() if meta is not None else None
-        mb = meta.iloc[int(s['b'])].to_dict() if meta is not None else None
+    for s, ma, mb in zip(scored, a_metas, b_metas):
         s['a_meta'] = ma
         s['b_meta'] = mb
         a_key = _get_image_key(int(s['a']))
@@ -854,6 +1800,91 @@ def fraud_seller_duplicates(seller_id: str, top: int = 50, threshold: float = 0.
     return {'results': out, 'alpha': float(alpha), 'used': use, 'threshold': float(threshold)}
 
 
+@app.get('/fraud/rings')
+def fraud_rings(offset: int = 0, limit: int = 20, min_sellers: int = 2):
+    """Cross-seller duplicate rings from the offline ring job, most shared duplicates first."""
+    rings = ART.get('rings')
+    if rings is None:
+        return {'error': 'rings not built or stale; run python -m app.build_index --rings'}
+    limit = max(0, min(limit, FRAUD_PAGE_MAX))
+    offset = max(0, offset)
+    ids, total = rings.ranked(offset, limit, min_sellers=min_sellers)
+    results = []
+    for rid in ids.tolist():
+        found = rings.describe(rid)
+        found['seller_ids'] = [str(rings.seller_ids[p]) for p in rings.member_positions(rid)[:20].tolist()]
+        results.append(found)
+    return {'results': results, 'total': int(total), 'offset': offset, 'limit': limit}
+
+
+@app.get('/fraud/rings/{ring_id}')
+def fraud_ring(ring_id: int, limit: int = 100):
+    """One ring: its sellers (with fraud scores when available) and the seller pairs linking them."""
+    rings = ART.get('rings')
+    if rings is None:
+        return {'error': 'rings not built or stale; run python -m app.build_index --rings'}
+    found = rings.describe(ring_id)
+    if found is None:
+        return {'error': 'ring not found'}
+    fraud = _build_fraud_model()
+    directory = fraud['directory'] if fraud['rings'] is rings else None
+    sellers = []
+    for p in rings.member_positions(ring_id)[:max(0, limit)].tolist():
+        entry = {'seller_id': str(rings.seller_ids[p]), **rings.seller(p)}
+        if directory is not None:
+            entry['count'] = int(directory.counts[p])
+            entry['anomaly_score'] = float(directory.anomaly_scores[p])
+            if directory.risk_scores is not None:
+                entry['risk_score'] = float(directory.risk_scores[p])
+        sellers.append(entry)
+    found['sellers'] = sellers
+    found['connections'] = [{'a': str(rings.seller_ids[p]), 'b': str(rings.seller_ids[q]), 'dup_pairs': int(w),
+                             'overlap': float(o)} for p, q, w, o in rings.links(ring_id)[:max(0, limit)]]
+    return found
+
+
+def _cluster_members(clusters, cluster_id: int, limit: int) -> List[Dict[str, Any]]:
+    idxs = clusters.member_idxs(cluster_id)
+    catalog = ART.get('catalog')
+    if catalog is not None and catalog.deleted:
+        idxs = idxs[~np.isin(idxs, np.fromiter(catalog.deleted, dtype=np.int64))]
+    idxs = [int(i) for i in idxs[:max(0, limit)]]
+    out = []
+    for idx, meta in zip(idxs, _result_meta(idxs)):
+        key = _get_image_key(idx)
+        out.append({'idx': idx, 'meta': meta, 'image_key': key, 'image_url': _image_url_for_key(key)})
+    return out
+
+
+@app.get('/clusters/{cluster_id}')
+def get_cluster(cluster_id: int, limit: int = 100):
+    """A near-duplicate cluster from the offline clustering job: statistics and members."""
+    clusters = ART.get('clusters')
+    if clusters is None:
+        return {'error': 'clusters not built or stale; run python -m app.build_index --clusters'}
+    found = clusters.describe(cluster_id)
+    if found is None:
+        return {'error': 'cluster not found'}
+    found['members'] = _cluster_members(clusters, cluster_id, limit)
+    return found
+
+
+@app.get('/item/{idx}/cluster')
+def get_item_cluster(idx: int, limit: int = 100):
+    """The near-duplicate cluster an item belongs to (cluster_id is null when it has none)."""
+    clusters = ART.get('clusters')
+    if clusters is None:
+        return {'error': 'clusters not built or stale; run python -m app.build_index --clusters'}
+    meta, catalog = ART.get('meta'), ART.get('catalog')
+    rows = len(meta) if meta is not None else len(clusters.cluster_ids)
+    if not 0 <= idx < rows or (catalog is not None and catalog.is_deleted(idx)):
+        return {'error': 'item not found'}
+    cluster_id = clusters.cluster_of(idx)
+    if cluster_id is None:
+        return {'idx': idx, 'cluster_id': None}
+    return {'idx': idx, **clusters.describe(cluster_id), 'members': _cluster_members(clusters, cluster_id, limit)}
+
+
 @app.get('/image/{idx}')
 def get_image(idx: int):
     """Serve the raw image for a given catalog idx (for demo use only)."""
@@ -893,28 +1924,23 @@ def get_random_images(count: int = 6):
     """Get random sample images for testing duplicate detection."""
     import random
     try:
-        # Load metadata
-        meta_path = os.path.join(ARTIFACT_DIR, 'meta.csv')
-        if not os.path.exists(meta_path):
-            return {"images": []}
-        meta_df = pd.read_csv(meta_path)
-        if len(meta_df) == 0:
+        meta_store = ART.get('meta')
+        if meta_store is None or len(meta_store) == 0:
             return {"images": []}
 
-        sample_size = max(1, min(int(count), len(meta_df)))
-        random_indices = random.sample(range(len(meta_df)), sample_size)
+        sample_size = max(1, min(int(count), len(meta_store)))
+        random_indices = random.sample(range(len(meta_store)), sample_size)
 
         images = []
-        for idx in random_indices:
-            row = meta_df.iloc[idx]
+        for idx, row in zip(random_indices, meta_store.rows(random_indices)):
             image_key = _get_image_key(idx)
             image_url = _image_url_for_key(image_key)
             images.append({
                 "id": str(idx),
-                "name": (row['title'] if 'title' in row else f'Product {idx}') if hasattr(row, '__getitem__') else f'Product {idx}',
+                "name": row['title'] if 'title' in row else f'Product {idx}',
                 "path": image_key,
                 "url": image_url,
-                "metadata": row.to_dict() if hasattr(row, 'to_dict') else {}
+                "metadata": row
             })
 
         return {"images": images}
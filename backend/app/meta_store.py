@@ -0,0 +1,314 @@
+"""Columnar, memory-mapped store for catalog metadata (meta.csv).
+
+Row access on a pandas DataFrame (``df.iloc[i].to_dict()``) is slow and the
+DataFrame keeps every Python string object resident in each worker. The store
+keeps one file per column instead:
+
+  store.json            column names/kinds, row count and source fingerprint
+  <col>.npy             numeric/bool columns
+  <col>.offsets.npy     string columns: int64 offsets (n + 1) into the blob
+  <col>.blob            string columns: concatenated UTF-8 bytes
+  <col>.null.npy        string columns: missing-value mask (only if any are missing)
+
+Everything is opened with mmap, so opening a store only parses store.json and
+pages are shared between worker processes. When several workers start against
+a missing or stale store, one builds it (under ``<store>.lock``) and the
+others wait and open the result.
+"""
+import json
+import os
+import shutil
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # Windows: builds are not serialized, but temp dirs are still per process
+    fcntl = None
+
+STORE_VERSION = 1
+
+
+def _source_fingerprint(csv_path: str) -> Dict[str, Any]:
+    st = os.stat(csv_path)
+    return {'size': int(st.st_size), 'mtime': float(st.st_mtime)}
+
+
+def _column_kind(series: pd.Series) -> str:
+    if pd.api.types.is_bool_dtype(series):
+        return 'bool'
+    if pd.api.types.is_integer_dtype(series):
+        return 'int'
+    if pd.api.types.is_float_dtype(series):
+        return 'float'
+    return 'str'
+
+
+def _encode_strings(series: pd.Series):
+    null = series.isna().to_numpy()
+    encoded = [b'' if m else str(v).encode('utf-8') for v, m in zip(series.tolist(), null)]
+    lengths = np.fromiter((len(b) for b in encoded), dtype=np.int64, count=len(encoded))
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets, b''.join(encoded), null
+
+
+class MetaStore:
+    """Read-only columnar view over catalog metadata.
+
+    Exposes the small part of the DataFrame API the server relies on
+    (``columns``, ``len()``) plus vectorized row/column fetches.
+    Missing values are returned as None.
+
+    Rows added at runtime (``append_rows``) are kept in memory after the
+    on-disk rows. They are appended to the list in place with one
+    ``list.extend`` (atomic under the GIL), so readers never see a partial
+    update and an append costs only the new rows.
+    """
+
+    def __init__(self, nrows: int, kinds: Dict[str, str], root: Optional[str] = None,
+                 arrays: Optional[Dict[str, Dict[str, Any]]] = None):
+        self.nrows = int(nrows)
+        self.kinds = dict(kinds)
+        self.columns: List[str] = list(kinds.keys())
+        self.root = root
+        self._arrays: Dict[str, Dict[str, Any]] = dict(arrays or {})
+        self._extra: List[Dict[str, Any]] = []
+
+    def __len__(self) -> int:
+        return self.nrows + len(self._extra)
+
+    def _coerce(self, name: str, value: Any) -> Any:
+        if value is None or (isinstance(value, float) and np.isnan(value)):
+            return None
+        kind = self.kinds[name]
+        if kind == 'int':
+            return int(value)
+        if kind == 'float':
+            return float(value)
+        if kind == 'bool':
+            return bool(value)
+        return str(value)
+
+    def coerce_rows(self, rows: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Rows converted to the column kinds (unknown keys dropped, missing columns None).
+
+        Raises ValueError naming the item and column that cannot be converted.
+        """
+        out = []
+        for j, r in enumerate(rows):
+            row = {}
+            for c in self.columns:
+                try:
+                    row[c] = self._coerce(c, r.get(c))
+                except (TypeError, ValueError):
+                    raise ValueError(f'item {j}: {c}={r.get(c)!r} is not a valid {self.kinds[c]}') from None
+            out.append(row)
+        return out
+
+    def append_rows(self, rows: Sequence[Dict[str, Any]]) -> np.ndarray:
+        """Append rows (see ``coerce_rows``); returns their indices. Nothing is appended if a row is invalid."""
+        start = len(self)
+        new = self.coerce_rows(rows)
+        self._extra.extend(new)
+        return np.arange(start, start + len(new))
+
+    def truncate(self, nrows: int):
+        """Drop appended rows from ``nrows`` on (undoes a failed ``append_rows``)."""
+        self._extra = self._extra[:max(0, int(nrows) - self.nrows)]
+
+    # -------- construction --------
+    @classmethod
+    def open(cls, root: str) -> 'MetaStore':
+        with open(os.path.join(root, 'store.json'), 'r') as f:
+            info = json.load(f)
+        kinds = {c['name']: c['kind'] for c in info['columns']}
+        return cls(info['nrows'], kinds, root=root)
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> 'MetaStore':
+        """In-memory store (used when the on-disk store cannot be written)."""
+        kinds = {}
+        arrays = {}
+        for c in df.columns:
+            kind = _column_kind(df[c])
+            kinds[str(c)] = kind
+            if kind == 'str':
+                offsets, blob, null = _encode_strings(df[c])
+                arrays[str(c)] = {'offsets': offsets, 'blob': np.frombuffer(blob, dtype=np.uint8),
+                                  'null': null if null.any() else None}
+            else:
+                arrays[str(c)] = {'values': df[c].to_numpy()}
+        return cls(len(df), kinds, arrays=arrays)
+
+    # -------- lazy column access --------
+    def _column_arrays(self, name: str) -> Dict[str, Any]:
+        arrs = self._arrays.get(name)
+        if arrs is not None:
+            return arrs
+        i = self.columns.index(name)
+        base = os.path.join(self.root, f'c{i}')
+        if self.kinds[name] == 'str':
+            blob_path = base + '.blob'
+            if os.path.getsize(blob_path) > 0:
+                blob = np.memmap(blob_path, dtype=np.uint8, mode='r')
+            else:
+                blob = np.zeros(0, dtype=np.uint8)
+            null_path = base + '.null.npy'
+            arrs = {
+                'offsets': np.load(base + '.offsets.npy', mmap_mode='r'),
+                'blob': blob,
+                'null': np.load(null_path, mmap_mode='r') if os.path.exists(null_path) else None,
+            }
+        else:
+            arrs = {'values': np.load(base + '.npy', mmap_mode='r')}
+        self._arrays[name] = arrs
+        return arrs
+
+    def _gather(self, name: str, idxs: np.ndarray) -> List[Any]:
+        extra = self._extra
+        if extra and (idxs >= self.nrows).any():
+            in_extra = idxs >= self.nrows
+            out: List[Any] = [None] * len(idxs)
+            base_pos = np.flatnonzero(~in_extra)
+            for j, v in zip(base_pos.tolist(), self._gather(name, idxs[base_pos])):
+                out[j] = v
+            for j in np.flatnonzero(in_extra).tolist():
+                out[j] = extra[int(idxs[j]) - self.nrows][name]
+            return out
+        arrs = self._column_arrays(name)
+        kind = self.kinds[name]
+        if kind != 'str':
+            vals = np.asarray(arrs['values'][idxs])
+            out = vals.tolist()
+            if kind == 'float':
+                nan = np.isnan(vals)
+                if nan.any():
+                    out = [None if m else v for v, m in zip(out, nan.tolist())]
+            return out
+        offsets = arrs['offsets']
+        starts = np.asarray(offsets[idxs]).tolist()
+        ends = np.asarray(offsets[idxs + 1]).tolist()
+        blob = arrs['blob']
+        out = [bytes(blob[s:e]).decode('utf-8') for s, e in zip(starts, ends)]
+        null = arrs['null']
+        if null is not None:
+            for j, m in enumerate(np.asarray(null[idxs]).tolist()):
+                if m:
+                    out[j] = None
+        return out
+
+    def column(self, name: str, idxs: Optional[Sequence[int]] = None) -> np.ndarray:
+        """Return a column as a numpy array (object dtype for strings)."""
+        if idxs is None:
+            idxs = np.arange(len(self))
+        idxs = np.asarray(idxs, dtype=np.int64)
+        if self.kinds[name] != 'str':
+            if self._extra and (idxs >= self.nrows).any():
+                return np.asarray(self._gather(name, idxs))
+            return np.asarray(self._column_arrays(name)['values'][idxs])
+        return np.array(self._gather(name, idxs), dtype=object)
+
+    def rows(self, idxs: Sequence[int]) -> List[Dict[str, Any]]:
+        """Fetch rows as dicts (same keys and order as ``df.iloc[i].to_dict()``)."""
+        idxs = np.asarray(idxs, dtype=np.int64).reshape(-1)
+        if len(idxs) == 0:
+            return []
+        cols = [self._gather(c, idxs) for c in self.columns]
+        return [dict(zip(self.columns, vals)) for vals in zip(*cols)]
+
+    def row(self, idx: int) -> Dict[str, Any]:
+        return self.rows([idx])[0]
+
+    def to_frame(self, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        columns = columns or self.columns
+        return pd.DataFrame({c: self.column(c) for c in columns}, columns=columns)
+
+
+def build_meta_store(csv_path: str, out_dir: str) -> MetaStore:
+    """Convert meta.csv into a store directory (written atomically)."""
+    df = pd.read_csv(csv_path)
+    tmp_dir = f'{out_dir}.tmp{os.getpid()}'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    cols = []
+    for i, c in enumerate(df.columns):
+        kind = _column_kind(df[c])
+        base = os.path.join(tmp_dir, f'c{i}')
+        if kind == 'str':
+            offsets, blob, null = _encode_strings(df[c])
+            np.save(base + '.offsets.npy', offsets)
+            with open(base + '.blob', 'wb') as f:
+                f.write(blob)
+            if null.any():
+                np.save(base + '.null.npy', null)
+        else:
+            np.save(base + '.npy', df[c].to_numpy())
+        cols.append({'name': str(c), 'kind': kind})
+    info = {
+        'version': STORE_VERSION,
+        'nrows': int(len(df)),
+        'columns': cols,
+        'source': _source_fingerprint(csv_path),
+    }
+    with open(os.path.join(tmp_dir, 'store.json'), 'w') as f:
+        json.dump(info, f, indent=2)
+    old_dir = f'{out_dir}.old{os.getpid()}'
+    if os.path.exists(out_dir):
+        os.replace(out_dir, old_dir)
+    os.replace(tmp_dir, out_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return MetaStore.open(out_dir)
+
+
+@contextmanager
+def _build_lock(store_dir: str):
+    """Exclusive lock across processes (e.g. gunicorn workers) for building ``store_dir``."""
+    if fcntl is None:
+        yield
+        return
+    with open(store_dir + '.lock', 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def store_is_current(csv_path: str, store_dir: str) -> bool:
+    try:
+        with open(os.path.join(store_dir, 'store.json'), 'r') as f:
+            info = json.load(f)
+        return info.get('version') == STORE_VERSION and info.get('source') == _source_fingerprint(csv_path)
+    except Exception:
+        return False
+
+
+def load_meta_store(csv_path: str, store_dir: Optional[str] = None) -> MetaStore:
+    """Open the store next to meta.csv, (re)building it if missing or stale.
+
+    Falls back to an in-memory store when the artifact directory is read-only.
+    """
+    store_dir = store_dir or os.path.join(os.path.dirname(csv_path), 'meta_store')
+    if store_is_current(csv_path, store_dir):
+        return MetaStore.open(store_dir)
+    try:
+        with _build_lock(store_dir):
+            if store_is_current(csv_path, store_dir):  # built by another worker while this one waited
+                return MetaStore.open(store_dir)
+            return build_meta_store(csv_path, store_dir)
+    except OSError:
+        return MetaStore.from_frame(pd.read_csv(csv_path))
+
+
+if __name__ == '__main__':
+    import argparse
+    ap = argparse.ArgumentParser(description='Build the columnar metadata store from meta.csv')
+    ap.add_argument('csv', help='path to meta.csv')
+    ap.add_argument('--out', default=None, help='store directory (default: meta_store next to the csv)')
+    args = ap.parse_args()
+    store = build_meta_store(args.csv, args.out or os.path.join(os.path.dirname(args.csv), 'meta_store'))
+    print(f'Built meta store: {store.nrows} rows, columns={store.columns} -> {store.root}')
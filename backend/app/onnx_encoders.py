@@ -0,0 +1,278 @@
+"""ONNX Runtime text and image encoders for CPU serving.
+
+``build_index --export-onnx`` exports the PyTorch encoders the server would
+otherwise load into <artifact_dir>/onnx/:
+
+  text/model.onnx         token ids -> sentence embedding (pooling and normalization included)
+  text/tokenizer.json     the model's fast tokenizer
+  image/model.onnx        preprocessed pixels -> OpenCLIP image embedding
+  */model.int8.onnx       dynamic int8 quantized copy (--onnx-int8)
+  */config.json           inputs, tokenizer / preprocess settings and the agreement with PyTorch
+
+Serving with ENCODER_BACKEND=onnx needs only onnxruntime, tokenizers and
+numpy; torch is never imported. Image preprocessing is image_preprocess's
+numpy transform with the parameters recorded at export.
+
+Every export is checked against PyTorch on probe inputs (catalog titles and
+images when available): the float32 graph must reach a row cosine of at least
+FLOAT32_MIN_COSINE, and the int8 graph is kept only if it reaches
+``int8_min_cosine``. The measured agreement is stored in config.json.
+"""
+import json
+import os
+import shutil
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from .image_preprocess import ClipPreprocess, _clip_params
+
+ONNX_DIR = 'onnx'
+MODEL_FILES = {'float32': 'model.onnx', 'int8': 'model.int8.onnx'}
+FLOAT32_MIN_COSINE = 0.9999
+OPSET = 17
+TEXT_INPUTS = ('input_ids', 'attention_mask', 'token_type_ids')
+FALLBACK_TITLES = [
+    'wireless bluetooth headphones with mic', 'Kaos Polos Pria Lengan Pendek Cotton Combed 30s',
+    'baby stroller lightweight foldable', 'original samsung galaxy charger 25w fast charging',
+    'hijab segi empat voal premium', 'set of 3 ceramic coffee mugs', 'x', '',
+]
+
+
+def _read_config(model_dir: str) -> Dict[str, Any]:
+    with open(os.path.join(model_dir, 'config.json')) as f:
+        return json.load(f)
+
+
+def _session(model_dir: str, int8: bool = False, threads: Optional[int] = None):
+    import onnxruntime as ort
+    path = os.path.join(model_dir, MODEL_FILES['int8' if int8 else 'float32'])
+    if int8 and not os.path.exists(path):
+        print(f'[onnx] {path} not found; using the float32 model')
+        path = os.path.join(model_dir, MODEL_FILES['float32'])
+    opts = ort.SessionOptions()
+    if threads:
+        opts.intra_op_num_threads = int(threads)
+    return ort.InferenceSession(path, opts, providers=['CPUExecutionProvider']), os.path.basename(path)
+
+
+class OnnxTextEncoder:
+    """Drop-in for SentenceTransformer.encode on an exported text graph."""
+
+    def __init__(self, model_dir: str, int8: bool = False, threads: Optional[int] = None):
+        from tokenizers import Tokenizer
+        self.config = _read_config(model_dir)
+        self.session, self.model_file = _session(model_dir, int8, threads)
+        self.inputs = self.config['inputs']
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, 'tokenizer.json'))
+        self.tokenizer.enable_truncation(self.config['max_seq_length'])
+        self.tokenizer.enable_padding(pad_id=self.config['pad_id'], pad_token=self.config['pad_token'])
+
+    def encode(self, texts: Sequence[str], convert_to_numpy: bool = True, batch_size: int = 64, **kwargs) -> np.ndarray:
+        out = [np.zeros((0, self.config['dim']), dtype=np.float32)]
+        for start in range(0, len(texts), batch_size):
+            enc = self.tokenizer.encode_batch([str(t) for t in texts[start:start + batch_size]])
+            feed = {
+                'input_ids': np.array([e.ids for e in enc], dtype=np.int64),
+                'attention_mask': np.array([e.attention_mask for e in enc], dtype=np.int64),
+                'token_type_ids': np.array([e.type_ids for e in enc], dtype=np.int64),
+            }
+            out.append(self.session.run(None, {k: feed[k] for k in self.inputs})[0])
+        return np.concatenate(out).astype(np.float32)
+
+
+class OnnxImageEncoder:
+    """OpenCLIP encode_image on an exported image graph; ``preprocess`` yields its numpy input rows."""
+
+    def __init__(self, model_dir: str, int8: bool = False, threads: Optional[int] = None):
+        self.config = _read_config(model_dir)
+        self.session, self.model_file = _session(model_dir, int8, threads)
+        self.preprocess = ClipPreprocess(**self.config['preprocess'], tensor=False)
+
+    def encode_image(self, pixels) -> np.ndarray:
+        x = np.ascontiguousarray(np.asarray(pixels, dtype=np.float32))
+        return self.session.run(None, {'pixel_values': x})[0].astype(np.float32)
+
+
+def load_onnx_encoder(kind: str, onnx_dir: str, int8: bool = False, threads: Optional[int] = None):
+    """OnnxTextEncoder / OnnxImageEncoder from ``onnx_dir``/``kind``."""
+    cls = {'text': OnnxTextEncoder, 'image': OnnxImageEncoder}[kind]
+    return cls(os.path.join(onnx_dir, kind), int8=int8, threads=threads)
+
+
+# ---------------- export (needs torch) ----------------
+
+def _agreement(ref: np.ndarray, got: np.ndarray) -> Dict[str, float]:
+    ref = np.asarray(ref, dtype=np.float64)
+    got = np.asarray(got, dtype=np.float64)
+    norms = np.linalg.norm(ref, axis=1) * np.linalg.norm(got, axis=1)
+    cos = (ref * got).sum(axis=1) / np.maximum(norms, 1e-12)
+    return {'min_cosine': float(cos.min()), 'mean_cosine': float(cos.mean()),
+            'max_abs_diff': float(np.abs(ref - got).max()), 'probes': int(len(ref))}
+
+
+def _quantize(src: str, dst: str):
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    quantize_dynamic(src, dst, weight_type=QuantType.QInt8, op_types_to_quantize=['MatMul', 'Gemm'])
+
+
+def _finish(tmp: str, out: str, config: Dict[str, Any], check, int8: bool, int8_min_cosine: float) -> Dict[str, Any]:
+    """Verify the float32 (and optional int8) graph in ``tmp``, write config.json and move it to ``out``."""
+    name = config['kind']
+    config['check'] = {'float32': check(False)}
+    if config['check']['float32']['min_cosine'] < FLOAT32_MIN_COSINE:
+        raise RuntimeError(f"{name} ONNX export disagrees with PyTorch: {config['check']['float32']}")
+    if int8:
+        _quantize(os.path.join(tmp, MODEL_FILES['float32']), os.path.join(tmp, MODEL_FILES['int8']))
+        config['check']['int8'] = check(True)
+        if config['check']['int8']['min_cosine'] < int8_min_cosine:
+            print(f"  {name}: int8 min cosine {config['check']['int8']['min_cosine']:.4f} < {int8_min_cosine}; "
+                  f"int8 model not kept")
+            os.remove(os.path.join(tmp, MODEL_FILES['int8']))
+    config['created'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+    with open(os.path.join(tmp, 'config.json'), 'w') as f:
+        json.dump(config, f, indent=2)
+    shutil.rmtree(out, ignore_errors=True)
+    os.replace(tmp, out)
+    for dtype, rep in config['check'].items():
+        print(f"  {name} {dtype}: min cosine {rep['min_cosine']:.6f} vs PyTorch over {rep['probes']} probes")
+    return config
+
+
+def export_text_encoder(model, out_dir: str, probe_texts: Sequence[str], int8: bool = False,
+                        int8_min_cosine: float = 0.99, source: Optional[str] = None) -> Dict[str, Any]:
+    """Export a SentenceTransformer (transformer + pooling [+ normalize]) to ``out_dir``."""
+    import torch
+
+    tokenizer = model.tokenizer
+    names = [n for n in TEXT_INPUTS if n in tokenizer.model_input_names]
+
+    class SentenceGraph(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *inputs):
+            return self.model(dict(zip(names, inputs)))['sentence_embedding']
+
+    tmp = out_dir + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    model.eval()
+    dummy = tokenizer(['a short title', 'another product title here'], padding=True, return_tensors='pt')
+    with torch.no_grad():
+        torch.onnx.export(SentenceGraph(), tuple(dummy[n] for n in names), os.path.join(tmp, MODEL_FILES['float32']),
+                          input_names=names, output_names=['embedding'], opset_version=OPSET, dynamo=False,
+                          dynamic_axes={**{n: {0: 'batch', 1: 'tokens'} for n in names}, 'embedding': {0: 'batch'}})
+        ref = model.encode(list(probe_texts), convert_to_numpy=True)
+    tokenizer.backend_tokenizer.save(os.path.join(tmp, 'tokenizer.json'))
+    config = {
+        'kind': 'text',
+        'source': source,
+        'inputs': names,
+        'dim': int(ref.shape[1]),
+        'max_seq_length': int(model.max_seq_length),
+        'pad_id': int(tokenizer.pad_token_id),
+        'pad_token': tokenizer.pad_token,
+    }
+    with open(os.path.join(tmp, 'config.json'), 'w') as f:
+        json.dump(config, f)
+
+    def check(use_int8: bool):
+        return _agreement(ref, OnnxTextEncoder(tmp, int8=use_int8).encode(list(probe_texts)))
+
+    return _finish(tmp, out_dir, config, check, int8, int8_min_cosine)
+
+
+def export_image_encoder(model, preprocess, out_dir: str, probe_images: List[Any], int8: bool = False,
+                         int8_min_cosine: float = 0.99, source: Optional[str] = None) -> Dict[str, Any]:
+    """Export an OpenCLIP model's encode_image to ``out_dir``; ``preprocess`` must be the standard eval transform."""
+    import torch
+
+    params = _clip_params(preprocess)
+    if params is None:
+        raise ValueError(f'unsupported image transform, cannot reproduce it without torchvision: {preprocess}')
+    params = {'size': int(params['size']), 'crop': [int(c) for c in params['crop']],
+              'interpolation': int(params['interpolation']),
+              'mean': [float(m) for m in params['mean']], 'std': [float(s) for s in params['std']]}
+
+    class ImageGraph(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.model = model
+
+        def forward(self, pixel_values):
+            return self.model.encode_image(pixel_values)
+
+    tmp = out_dir + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    model.eval()
+    fast = ClipPreprocess(**params, tensor=False)
+    x = np.stack([fast(img) for img in probe_images])
+    with torch.no_grad():
+        torch.onnx.export(ImageGraph(), (torch.from_numpy(x[:2]),), os.path.join(tmp, MODEL_FILES['float32']),
+                          input_names=['pixel_values'], output_names=['embedding'], opset_version=OPSET, dynamo=False,
+                          dynamic_axes={'pixel_values': {0: 'batch'}, 'embedding': {0: 'batch'}})
+        ref = model.encode_image(torch.from_numpy(x)).cpu().numpy()
+    config = {'kind': 'image', 'source': source, 'inputs': ['pixel_values'], 'dim': int(ref.shape[1]),
+              'preprocess': params}
+    with open(os.path.join(tmp, 'config.json'), 'w') as f:
+        json.dump(config, f)
+
+    def check(use_int8: bool):
+        return _agreement(ref, OnnxImageEncoder(tmp, int8=use_int8).encode_image(x))
+
+    return _finish(tmp, out_dir, config, check, int8, int8_min_cosine)
+
+
+def _probe_titles(artifact_dir: str, n: int = 256) -> List[str]:
+    meta_path = os.path.join(artifact_dir, 'meta.csv')
+    try:
+        import pandas as pd
+        titles = pd.read_csv(meta_path, usecols=['title'], nrows=n)['title'].fillna('').astype(str).tolist()
+    except Exception:
+        titles = []
+    return titles + FALLBACK_TITLES
+
+
+def _probe_images(images_dir: Optional[str], n: int = 32) -> List[Any]:
+    from PIL import Image
+    from .image_preprocess import open_image
+    images = []
+    if images_dir and os.path.isdir(images_dir):
+        for name in sorted(os.listdir(images_dir)):
+            if len(images) >= n:
+                break
+            try:
+                images.append(open_image(os.path.join(images_dir, name)))
+            except Exception:
+                continue
+    rng = np.random.default_rng(0)
+    for w, h in ((640, 480), (300, 520), (224, 224), (1000, 750)):
+        images.append(Image.fromarray(rng.integers(0, 256, (h // 8, w // 8, 3), dtype=np.uint8)).resize((w, h)))
+    return images
+
+
+def export_encoders(artifact_dir: str, int8: bool = False, int8_min_cosine: float = 0.99,
+                    images_dir: Optional[str] = None, kinds: Sequence[str] = ('text', 'image')) -> Dict[str, Any]:
+    """Export the server's text and image encoders to <artifact_dir>/onnx (see module docstring)."""
+    from .build_artifacts import IMAGE_MODEL_NAME, IMAGE_MODEL_PRETRAINED, TEXT_MODEL_NAME
+    onnx_dir = os.path.join(artifact_dir, ONNX_DIR)
+    os.makedirs(onnx_dir, exist_ok=True)
+    out = {}
+    if 'text' in kinds:
+        from sentence_transformers import SentenceTransformer
+        print(f'exporting text encoder {TEXT_MODEL_NAME}')
+        out['text'] = export_text_encoder(SentenceTransformer(TEXT_MODEL_NAME), os.path.join(onnx_dir, 'text'),
+                                          _probe_titles(artifact_dir), int8=int8, int8_min_cosine=int8_min_cosine,
+                                          source=TEXT_MODEL_NAME)
+    if 'image' in kinds:
+        import open_clip
+        print(f'exporting image encoder {IMAGE_MODEL_NAME}/{IMAGE_MODEL_PRETRAINED}')
+        model, _, preprocess = open_clip.create_model_and_transforms(IMAGE_MODEL_NAME, pretrained=IMAGE_MODEL_PRETRAINED)
+        out['image'] = export_image_encoder(model, preprocess, os.path.join(onnx_dir, 'image'), _probe_images(images_dir),
+                                            int8=int8, int8_min_cosine=int8_min_cosine,
+                                            source=f'{IMAGE_MODEL_NAME}/{IMAGE_MODEL_PRETRAINED}')
+    return out
@@ -0,0 +1,258 @@
+"""Cross-seller duplicate rings: groups of sellers that list the same products.
+
+The per-seller fraud features only look at each seller on its own. This job
+starts from the near-duplicate pairs of the clustering job (the chunked
+FAISS self-join in ``clusters.py``). It keeps the pairs whose two listings
+belong to different sellers and sums them into sparse seller x seller
+matrices: W[s, t] counts the near-duplicate listing pairs between sellers s
+and t, and the overlap is the share of both sellers' listings that have a
+near-duplicate at the other one. Two sellers are linked when they share at
+least ``min_pairs`` pairs and their overlap is at least ``min_overlap``. The
+overlap cut keeps large sellers from chaining into one component through a
+few incidental matches. Every connected component of two or more linked
+sellers is a ring, and its density (links / possible links) shows how
+tightly it is knit. Sellers are numbered as in the fraud model (see
+``fraud_model.seller_codes``), so the per-seller columns line up with its
+features.
+
+Written to ``<artifact_dir>/rings/``:
+
+  info.json          parameters, counts and the clustering build it was made from
+  seller_ids.npy     seller ids by position
+  ring_ids.npy       ring id per seller (-1: in no ring)
+  cross_pairs.npy    near-duplicate pairs each seller shares with other sellers
+  max_overlap.npy    highest overlap of each seller with any other seller
+  partners.npy       sellers each seller is linked to
+  offsets.npy        (R + 1,) CSR offsets into members
+  members.npy        seller positions grouped by ring, most cross-seller pairs first
+  stats.npz          per ring: sellers, links, dup_pairs, listings, density
+  graph_*.npy        links as a symmetric CSR matrix (indptr, indices, data = pairs, overlap)
+
+Ring ids are ordered by dup_pairs, highest first.
+
+Usage:
+  python -m app.build_index --rings [--ring-min-pairs 2] [--ring-min-overlap 0.25]
+"""
+import json
+import os
+import shutil
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
+
+RINGS_DIR = 'rings'
+RINGS_VERSION = 2
+STAT_COLUMNS = ('sellers', 'links', 'dup_pairs', 'listings', 'density')
+
+
+def seller_graph(pairs: np.ndarray, codes: np.ndarray, counts: np.ndarray):
+    """Symmetric seller x seller CSR matrices: shared near-duplicate pairs, and the overlap share.
+
+    Both matrices have the same sparsity pattern (sellers sharing at least one pair).
+    """
+    n = len(counts)
+    sa, sb = codes[pairs[:, 0]], codes[pairs[:, 1]]
+    cross = (sa >= 0) & (sb >= 0) & (sa != sb)
+    a, b, sa, sb = pairs[cross, 0], pairs[cross, 1], sa[cross], sb[cross]
+    upper = sp.coo_matrix((np.ones(len(a), dtype=np.int64), (np.minimum(sa, sb), np.maximum(sa, sb))),
+                          shape=(n, n)).tocsr()  # repeated entries are summed
+    shared = (upper + upper.T).tocsr()
+    # listings of s with a near-duplicate at t, each listing counted once per partner seller
+    keys = np.unique(np.r_[a * n + sb, b * n + sa])
+    items, partner = keys // n, keys % n
+    listings = sp.coo_matrix((np.ones(len(keys)), (codes[items], partner)), shape=(n, n)).tocsr()
+    overlap = (listings + listings.T).tocoo()
+    overlap.data = overlap.data / (counts[overlap.row] + counts[overlap.col])
+    return shared, overlap.tocsr()
+
+
+def build_rings(artifact_dir: str, min_pairs: int = 2, min_overlap: float = 0.25) -> Dict[str, Any]:
+    """Build seller rings from the persisted near-duplicate pairs. Returns info.json."""
+    from .clusters import cluster_source, load_clusters
+    from .fraud_model import seller_codes
+    from .meta_store import load_meta_store
+
+    t0 = time.perf_counter()
+    meta_path = os.path.join(artifact_dir, 'meta.csv')
+    clusters = load_clusters(artifact_dir, cluster_source(artifact_dir))
+    if clusters is None or clusters.pairs is None:
+        raise ValueError('near-duplicate pairs are missing or stale; run python -m app.build_index --clusters first')
+    grouped = seller_codes(load_meta_store(meta_path))
+    if grouped is None:
+        raise ValueError('meta.csv has no seller_id column')
+    seller_ids, counts, _, codes = grouped
+    n_sellers = len(seller_ids)
+    pairs = np.asarray(clusters.pairs, dtype=np.int64)
+
+    shared, overlap = seller_graph(pairs, codes, counts)
+    cross_pairs = np.asarray(shared.sum(axis=1)).ravel().astype(np.int64)
+    max_overlap = overlap.max(axis=1).toarray().ravel().astype(np.float32)
+    linked = (shared >= min_pairs).multiply(overlap >= min_overlap).astype(bool)
+    strong = shared.multiply(linked).tocsr()
+    strong.eliminate_zeros()
+    strong.sort_indices()
+    strong_overlap = overlap.multiply(linked).tocsr()
+    strong_overlap.eliminate_zeros()
+    strong_overlap.sort_indices()
+    partners = np.diff(strong.indptr).astype(np.int64)
+    _, labels = connected_components(strong, directed=False)
+
+    sizes = np.bincount(labels, minlength=n_sellers)
+    upper = sp.triu(strong, k=1).tocoo()
+    edge_comp = labels[upper.row]
+    dup_pairs = np.bincount(edge_comp, weights=upper.data, minlength=len(sizes))
+    big = np.flatnonzero(sizes >= 2)
+    order = big[np.lexsort((big, -sizes[big], -dup_pairs[big]))]  # most shared duplicates first
+    comp_to_ring = np.full(len(sizes), -1, dtype=np.int64)
+    comp_to_ring[order] = np.arange(len(order))
+    ring_ids = comp_to_ring[labels]
+    members = np.flatnonzero(ring_ids >= 0)
+    members = members[np.lexsort((members, -cross_pairs[members], ring_ids[members]))]
+    size = sizes[order].astype(np.int64)
+    offsets = np.r_[0, np.cumsum(size)].astype(np.int64)
+
+    # listings taking part in a ring: both ends of every pair between two linked sellers
+    sa, sb = codes[pairs[:, 0]], codes[pairs[:, 1]]
+    pair_keys = np.minimum(sa, sb) * n_sellers + np.maximum(sa, sb)
+    on_edge = (sa >= 0) & (sb >= 0) & np.isin(pair_keys, upper.row.astype(np.int64) * n_sellers + upper.col)
+    items = np.unique(pairs[on_edge].ravel())
+    item_rings = ring_ids[codes[items]]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        links = np.bincount(comp_to_ring[edge_comp], minlength=len(order)).astype(np.int64)
+        stats = {
+            'sellers': size,
+            'links': links,
+            'dup_pairs': dup_pairs[order].astype(np.int64),
+            'listings': np.bincount(item_rings[item_rings >= 0], minlength=len(order)).astype(np.int64),
+            'density': links / (size * (size - 1) / 2.0),
+        }
+
+    out = os.path.join(artifact_dir, RINGS_DIR)
+    tmp = out + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    np.save(os.path.join(tmp, 'seller_ids.npy'), np.array(seller_ids), allow_pickle=True)
+    np.save(os.path.join(tmp, 'ring_ids.npy'), ring_ids)
+    np.save(os.path.join(tmp, 'cross_pairs.npy'), cross_pairs)
+    np.save(os.path.join(tmp, 'max_overlap.npy'), max_overlap)
+    np.save(os.path.join(tmp, 'partners.npy'), partners)
+    np.save(os.path.join(tmp, 'offsets.npy'), offsets)
+    np.save(os.path.join(tmp, 'members.npy'), members)
+    np.savez(os.path.join(tmp, 'stats.npz'), **stats)
+    np.save(os.path.join(tmp, 'graph_indptr.npy'), strong.indptr.astype(np.int64))
+    np.save(os.path.join(tmp, 'graph_indices.npy'), strong.indices.astype(np.int64))
+    np.save(os.path.join(tmp, 'graph_data.npy'), strong.data.astype(np.int64))
+    np.save(os.path.join(tmp, 'graph_overlap.npy'), strong_overlap.data.astype(np.float32))
+    info = {
+        'version': RINGS_VERSION,
+        'source': ring_source(clusters),
+        'sellers': int(n_sellers),
+        'rings': int(len(order)),
+        'ring_sellers': int(len(members)),
+        'largest': int(size[0]) if len(size) else 0,
+        'cross_seller_pairs': int(cross_pairs.sum() // 2),
+        'links': int(len(edge_comp)),
+        'min_pairs': int(min_pairs),
+        'min_overlap': float(min_overlap),
+        'build_s': time.perf_counter() - t0,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    with open(os.path.join(tmp, 'info.json'), 'w') as f:
+        json.dump(info, f, indent=2)
+    shutil.rmtree(out, ignore_errors=True)
+    os.replace(tmp, out)
+    print(f"Rings: {info['rings']} rings covering {info['ring_sellers']} of {n_sellers} sellers "
+          f"({info['cross_seller_pairs']} cross-seller duplicate pairs) in {info['build_s']:.1f}s -> {out}")
+    return info
+
+
+class Rings:
+    """Loaded ring result: seller -> ring and ring -> members/links lookups by seller position."""
+
+    def __init__(self, info: Dict[str, Any], seller_ids: np.ndarray, ring_ids: np.ndarray, cross_pairs: np.ndarray,
+                 max_overlap: np.ndarray, partners: np.ndarray, offsets: np.ndarray, members: np.ndarray,
+                 stats: Dict[str, np.ndarray], graph: Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]):
+        self.info = info
+        self.seller_ids = seller_ids
+        self.ring_ids = ring_ids
+        self.cross_pairs = cross_pairs
+        self.max_overlap = max_overlap
+        self.partners = partners
+        self.offsets = offsets
+        self.members = members
+        self.stats = stats
+        self.indptr, self.indices, self.data, self.overlap = graph
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def ranked(self, offset: int = 0, limit: int = 20, min_sellers: int = 2):
+        """One page of ring ids (already ordered by dup_pairs) and how many pass the filter."""
+        ids = np.arange(len(self))
+        if min_sellers > 2:
+            ids = ids[self.stats['sellers'] >= min_sellers]
+        return ids[offset:offset + limit], len(ids)
+
+    def describe(self, ring_id: int) -> Optional[Dict[str, Any]]:
+        if not 0 <= ring_id < len(self):
+            return None
+        out: Dict[str, Any] = {'ring_id': int(ring_id)}
+        for name in STAT_COLUMNS:
+            v = self.stats[name][ring_id]
+            out[name] = float(v) if name == 'density' else int(v)
+        return out
+
+    def member_positions(self, ring_id: int) -> np.ndarray:
+        return self.members[self.offsets[ring_id]:self.offsets[ring_id + 1]]
+
+    def links(self, ring_id: int) -> List[Tuple[int, int, int, float]]:
+        """(seller position, seller position, shared pairs, overlap) for each link in a ring, heaviest first."""
+        out = []
+        for p in self.member_positions(ring_id).tolist():
+            lo, hi = self.indptr[p], self.indptr[p + 1]
+            for q, w, o in zip(self.indices[lo:hi].tolist(), self.data[lo:hi].tolist(), self.overlap[lo:hi].tolist()):
+                if p < q:
+                    out.append((p, q, w, o))
+        out.sort(key=lambda e: (-e[2], e[0], e[1]))
+        return out
+
+    def seller(self, position: int) -> Dict[str, Any]:
+        """Per-seller ring features (the ones merged into the fraud features)."""
+        rid = int(self.ring_ids[position])
+        return {
+            'ring_id': rid if rid >= 0 else None,
+            'cross_seller_pairs': int(self.cross_pairs[position]),
+            'max_overlap': float(self.max_overlap[position]),
+            'ring_partners': int(self.partners[position]),
+        }
+
+
+def ring_source(clusters) -> Dict[str, Any]:
+    """What a ring result is built from: the clustering build (its ``created`` stamp) and its inputs."""
+    return {'clusters': clusters.info.get('created'), **clusters.info['source']}
+
+
+def load_rings(artifact_dir: str, source: Dict[str, Any], mmap: bool = True) -> Optional[Rings]:
+    """Load a ring result if it was built from ``source`` (see ``ring_source``), else None."""
+    root = os.path.join(artifact_dir, RINGS_DIR)
+    try:
+        with open(os.path.join(root, 'info.json'), 'r') as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if info.get('version') != RINGS_VERSION or info.get('source') != source:
+        return None
+    mmap_mode = 'r' if mmap else None
+
+    def arr(name: str):
+        return np.load(os.path.join(root, name + '.npy'), mmap_mode=mmap_mode)
+
+    with np.load(os.path.join(root, 'stats.npz')) as f:
+        stats = {name: f[name] for name in STAT_COLUMNS}
+    return Rings(info, np.load(os.path.join(root, 'seller_ids.npy'), allow_pickle=True), arr('ring_ids'),
+                 arr('cross_pairs'), arr('max_overlap'), arr('partners'), np.load(os.path.join(root, 'offsets.npy')),
+                 arr('members'), stats,
+                 (arr('graph_indptr'), arr('graph_indices'), arr('graph_data'), arr('graph_overlap')))
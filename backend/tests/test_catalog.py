@@ -0,0 +1,213 @@
+"""Live catalog adds: invalid rows must not leave meta, embeddings and indices misaligned."""
+import numpy as np
+import pandas as pd
+import pytest
+
+faiss = pytest.importorskip('faiss')
+
+from app import catalog as catalog_module
+from app.catalog import Catalog, CatalogWAL
+from app.embeddings import EmbeddingMatrix
+from app.meta_store import MetaStore
+
+N, D_TEXT, D_IMAGE = 30, 8, 6
+
+
+def _artifacts(n=N):
+    rng = np.random.default_rng(0)
+    meta = MetaStore.from_frame(pd.DataFrame({
+        'posting_id': [f'p{i}' for i in range(n)],
+        'title': [f'item {i}' for i in range(n)],
+        'label_group': np.arange(n, dtype=np.int64),
+    }))
+    art = {'meta': meta, 'image_keys': np.array([None] * n, dtype=object)}
+    for emb_name, index_name, d in (('text_embs', 'faiss_text', D_TEXT), ('image_embs', 'faiss_image', D_IMAGE)):
+        x = rng.normal(size=(n, d)).astype(np.float32)
+        x /= np.linalg.norm(x, axis=1, keepdims=True)
+        index = faiss.IndexFlatIP(d)
+        index.add(x)
+        art[emb_name], art[index_name] = EmbeddingMatrix(x, normalized=True), index
+    return art
+
+
+def _catalog(tmp_path):
+    catalog = Catalog(_artifacts(), CatalogWAL(str(tmp_path / 'wal.jsonl'), fsync=False), lambda row: None)
+    catalog.replay()
+    return catalog
+
+
+def _sizes(art):
+    return (len(art['meta']), len(art['text_embs']), len(art['image_embs']), art['faiss_text'].ntotal,
+            art['faiss_image'].ntotal, len(art['image_keys']))
+
+
+def _vecs(n, d):
+    return list(np.ones((n, d), dtype=np.float32))
+
+
+def test_invalid_row_is_rejected_before_logging(tmp_path):
+    catalog = _catalog(tmp_path)
+    with pytest.raises(ValueError, match='label_group'):
+        catalog.add_items([{'title': 'bad', 'label_group': 'abc'}], _vecs(1, D_TEXT), [None])
+    assert _sizes(catalog.art) == (N,) * 6
+    assert not [r for r in catalog.wal.read() if r['op'] == 'add']
+
+    assert catalog.add_items([{'title': 'good', 'label_group': '7'}], _vecs(1, D_TEXT), [None]) == [N]
+    assert _sizes(catalog.art) == (N + 1,) * 6
+    assert catalog.art['meta'].row(N)['label_group'] == 7
+
+
+def test_wrong_vector_dimension_is_rejected(tmp_path):
+    catalog = _catalog(tmp_path)
+    with pytest.raises(ValueError, match='dims'):
+        catalog.add_items([{'title': 'x'}], _vecs(1, D_TEXT + 1), [None])
+    assert _sizes(catalog.art) == (N,) * 6
+
+
+def test_failed_index_append_is_rolled_back(tmp_path, monkeypatch):
+    catalog = _catalog(tmp_path)
+    real_append = catalog_module._append
+
+    def failing_append(index, index_name, block, ids):
+        if index_name == 'faiss_image':
+            raise MemoryError('simulated')
+        real_append(index, index_name, block, ids)
+
+    monkeypatch.setattr(catalog_module, '_append', failing_append)
+    with pytest.raises(MemoryError):
+        catalog.add_items([{'title': 'x'}], _vecs(1, D_TEXT), [None])
+    assert _sizes(catalog.art) == (N,) * 6
+    with pytest.raises(RuntimeError, match='disabled'):
+        catalog.add_items([{'title': 'y'}], _vecs(1, D_TEXT), [None])
+
+
+def test_replay_of_a_bad_log_leaves_artifacts_untouched(tmp_path):
+    catalog = _catalog(tmp_path)
+    catalog.add_items([{'title': 'good'}], _vecs(1, D_TEXT), [None])
+    catalog.wal.append([{'op': 'add', 'idx': N + 1, 'row': {'title': 'bad', 'label_group': 'abc'},
+                         'text': None, 'image': None}])
+    catalog.wal.close()
+
+    fresh = Catalog(_artifacts(), CatalogWAL(catalog.wal.path, fsync=False), lambda row: None)
+    with pytest.raises(ValueError):
+        fresh.replay()
+    assert _sizes(fresh.art) == (N,) * 6
+
+
+def test_log_of_other_artifacts_is_set_aside_only_on_first_write(tmp_path):
+    serving = _catalog(tmp_path)
+    serving.add_items([{'title': 'a'}], _vecs(1, D_TEXT), [None])
+
+    # a reloaded generation over rebuilt artifacts replays the log but may still be rejected
+    reloaded = Catalog(_artifacts(N + 5), CatalogWAL(serving.wal.path, fsync=False), lambda row: None)
+    assert reloaded.replay() == 0
+    serving.add_items([{'title': 'b'}], _vecs(1, D_TEXT), [None])
+    assert not (tmp_path / 'wal.jsonl.stale').exists()
+    assert [r['idx'] for r in serving.wal.read() if r['op'] == 'add'] == [N, N + 1]
+
+    serving.retire()
+    reloaded.add_items([{'title': 'c'}], _vecs(1, D_TEXT), [None])
+    assert (tmp_path / 'wal.jsonl.stale').exists()
+    assert [r.get('idx', r.get('rows')) for r in reloaded.wal.read()] == [N + 5, N + 5]
+
+
+def test_log_is_keyed_on_the_build_not_just_the_row_count(tmp_path):
+    path = str(tmp_path / 'wal.jsonl')
+    first = Catalog(_artifacts(), CatalogWAL(path, fsync=False), lambda row: None, base_id={'build': 'a'})
+    first.replay()
+    first.add_items([{'title': 'x'}], _vecs(1, D_TEXT), [None])
+    first.wal.close()
+
+    same = Catalog(_artifacts(), CatalogWAL(path, fsync=False), lambda row: None, base_id={'build': 'a'})
+    assert same.replay() == 1
+    # rebuilt with the same number of rows: the logged idxs no longer mean the same items
+    rebuilt = Catalog(_artifacts(), CatalogWAL(path, fsync=False), lambda row: None, base_id={'build': 'b'})
+    assert rebuilt.replay() == 0
+    assert _sizes(rebuilt.art) == (N,) * 6
+
+
+def test_many_small_adds_stay_aligned(tmp_path):
+    catalog = Catalog(_artifacts(), CatalogWAL(str(tmp_path / 'wal.jsonl'), fsync=False),
+                      lambda row: f"catalog_images/{row['title']}.jpg")
+    catalog.replay()
+    for i in range(300):
+        v = np.zeros(D_TEXT, np.float32)
+        v[i % D_TEXT] = 1.0
+        catalog.add_items([{'title': f'n{i}'}], [v], [None])
+    art = catalog.art
+    assert _sizes(art) == (N + 300,) * 6
+    assert art['image_keys'][N + 299] == 'catalog_images/n299.jpg' and art['image_keys'][N - 1] is None
+    assert art['meta'].row(N + 150)['title'] == 'n150'
+    assert np.argmax(art['text_embs'][N + 150]) == 150 % D_TEXT
+
+
+def test_hnsw_search_drops_deleted_hits_without_padding(tmp_path):
+    art = _artifacts()
+    x = art['text_embs'][np.arange(N)]
+    art['faiss_text'] = faiss.IndexHNSWFlat(D_TEXT, 8, faiss.METRIC_INNER_PRODUCT)
+    art['faiss_text'].add(x)
+    catalog = Catalog(art, CatalogWAL(str(tmp_path / 'wal.jsonl'), fsync=False), lambda row: None)
+    catalog.replay()
+    catalog.delete_items(range(N - 3))  # far more tombstones than the initial over-fetch
+    D, I = catalog.search(art['faiss_text'], x[:2], 5)
+    assert D.shape[1] <= 3 and np.isfinite(D).all()
+    found = I[I >= 0]
+    assert len(found) and set(found.tolist()) <= {N - 3, N - 2, N - 1}
+
+
+def test_expected_entries_follow_each_index_after_a_delete(tmp_path):
+    # HNSW keeps deleted rows as tombstones while a flat (id-mapped) index drops them on compaction
+    art = _artifacts()
+    x = art['text_embs'][np.arange(N)]
+    art['faiss_text'] = faiss.IndexHNSWFlat(D_TEXT, 8, faiss.METRIC_INNER_PRODUCT)
+    art['faiss_text'].add(x)
+    path = str(tmp_path / 'wal.jsonl')
+    catalog = Catalog(art, CatalogWAL(path, fsync=False), lambda row: None, compact_every=1)
+    catalog.replay()
+    catalog.add_items([{'title': 'x'}], _vecs(1, D_TEXT), [np.ones(D_IMAGE, np.float32)])
+    catalog.delete_items([0])
+    catalog.wal.close()
+
+    reloaded_art = _artifacts()
+    reloaded_art['faiss_text'] = faiss.IndexHNSWFlat(D_TEXT, 8, faiss.METRIC_INNER_PRODUCT)
+    reloaded_art['faiss_text'].add(x)
+    reloaded = Catalog(reloaded_art, CatalogWAL(path, fsync=False), lambda row: None)
+    assert reloaded.replay() == 2
+    for cat in (catalog, reloaded):
+        rows = len(cat.art['text_embs'])
+        assert cat.art['faiss_text'].ntotal == cat.expected_ntotal(cat.art['faiss_text'], rows) == N + 1
+        assert cat.art['faiss_image'].ntotal == cat.expected_ntotal(cat.art['faiss_image'], rows) == N
+
+
+def test_reload_catches_up_on_writes_logged_during_its_replay(tmp_path):
+    serving = _catalog(tmp_path)
+    serving.add_items([{'title': 'a'}], _vecs(1, D_TEXT), [None])
+
+    reloaded = Catalog(_artifacts(), CatalogWAL(serving.wal.path, fsync=False), lambda row: None)
+    assert reloaded.replay() == 1
+    # the serving generation keeps taking writes while the new one loads
+    serving.add_items([{'title': 'b'}], _vecs(1, D_TEXT), [None])
+    serving.delete_items([0])
+    with serving.paused():
+        assert reloaded.catch_up() == 2
+        serving.retire()
+    # the replayed delete is compacted out of the (id-mapped) indices
+    assert _sizes(reloaded.art) == (N + 2, N + 2, N + 2, N + 1, N + 1, N + 2) and reloaded.is_deleted(0)
+    assert reloaded.add_items([{'title': 'c'}], _vecs(1, D_TEXT), [None]) == [N + 2]
+    assert [r['idx'] for r in reloaded.wal.read() if r['op'] == 'add'] == [N, N + 1, N + 2]
+
+
+def test_torn_log_tail_is_cut_only_by_the_writer(tmp_path):
+    path = tmp_path / 'wal.jsonl'
+    serving = _catalog(tmp_path)
+    serving.add_items([{'title': 'a'}], _vecs(1, D_TEXT), [None])
+    serving.wal.close()
+    with open(path, 'a') as f:
+        f.write('{"op": "add", "idx"')  # crash mid-write
+    size = path.stat().st_size
+
+    restarted = Catalog(_artifacts(), CatalogWAL(str(path), fsync=False), lambda row: None)
+    assert restarted.replay() == 1
+    assert path.stat().st_size == size  # replaying does not modify the log
+    restarted.add_items([{'title': 'b'}], _vecs(1, D_TEXT), [None])
+    assert [r['idx'] for r in restarted.wal.read() if r['op'] == 'add'] == [N, N + 1]
@@ -0,0 +1,119 @@
+"""The chunked self-join, union-find and ring graph must match brute force over every pair."""
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+faiss = pytest.importorskip('faiss')
+pytest.importorskip('scipy')
+
+from app.classifier import compile_classifier
+from app.clusters import UnionFind, build_clusters, cluster_source, load_clusters
+from app.rings import build_rings, load_rings, ring_source, seller_graph
+
+N = 90
+
+
+def _components(n, edges):
+    """Connected components of two or more nodes, by depth-first search."""
+    adj = {i: set() for i in range(n)}
+    for a, b in edges:
+        adj[a].add(b)
+        adj[b].add(a)
+    seen, out = set(), set()
+    for start in range(n):
+        if start in seen or not adj[start]:
+            continue
+        stack, comp = [start], set()
+        while stack:
+            v = stack.pop()
+            if v not in comp:
+                comp.add(v)
+                stack.extend(adj[v] - comp)
+        seen |= comp
+        out.add(frozenset(comp))
+    return out
+
+
+def _artifacts(path, seed=0):
+    """Listings drawn around a few products (with noise), flat indices and no classifier (fused >= 0.5)."""
+    rng = np.random.default_rng(seed)
+    product = rng.integers(0, 15, size=N)
+    out = {}
+    for name, d in (('text', 16), ('image', 12)):
+        centers = rng.normal(size=(15, d))
+        x = (centers[product] + rng.uniform(0.2, 1.2, size=(N, 1)) * rng.normal(size=(N, d))).astype(np.float32)
+        x /= np.linalg.norm(x, axis=1, keepdims=True)
+        np.save(path / f'{name}_embs.npy', x)
+        index = faiss.IndexFlatIP(d)
+        index.add(x)
+        faiss.write_index(index, str(path / f'faiss_{name}.index'))
+        out[name] = x
+    # sellers share products in pairs: (s0, s1) list products 0, 5, 10, (s2, s3) products 1, 6, 11, ...
+    seller = np.char.add('s', ((product % 5) * 2 + (rng.random(N) < 0.5)).astype(str))
+    seller[rng.random(N) < 0.2] = 'other'
+    pd.DataFrame({'title': [f't{i}' for i in range(N)], 'seller_id': seller}).to_csv(path / 'meta.csv', index=False)
+    return out['text'], out['image'], seller
+
+
+def _accepted_pairs(text, image):
+    a, b = map(np.array, zip(*itertools.combinations(range(N), 2)))
+    img = np.einsum('ij,ij->i', image[a], image[b])
+    txt = np.einsum('ij,ij->i', text[a], text[b])
+    ok = compile_classifier(None).score(img, txt, 0.5)[2]
+    return set(zip(a[ok].tolist(), b[ok].tolist()))
+
+
+def test_union_find_matches_depth_first_search():
+    rng = np.random.default_rng(1)
+    edges = rng.integers(0, 200, size=(150, 2))
+    uf = UnionFind(200)
+    uf.union(edges[:, 0], edges[:, 1])
+    labels = uf.labels()
+    groups = pd.Series(np.arange(200)).groupby(labels).apply(frozenset)
+    assert {g for g in groups if len(g) > 1} == _components(200, [(a, b) for a, b in edges if a != b])
+
+
+@pytest.mark.parametrize('k', [0, N])
+def test_cluster_partition_matches_brute_force(tmp_path, k):
+    text, image, _ = _artifacts(tmp_path)
+    info = build_clusters(str(tmp_path), workers=2, chunk=16, k=k)
+    clusters = load_clusters(str(tmp_path), cluster_source(str(tmp_path)))
+    pairs = _accepted_pairs(text, image)
+    assert info['exhaustive'] and pairs
+    assert set(map(tuple, clusters.pairs.tolist())) == pairs
+    expected = _components(N, pairs)
+    got = {frozenset(clusters.member_idxs(c).tolist()) for c in range(len(clusters))}
+    assert got == expected
+    sizes = [clusters.describe(c)['size'] for c in range(len(clusters))]
+    assert sizes == sorted(sizes, reverse=True)
+    for c in range(len(clusters)):
+        assert all(clusters.cluster_of(i) == c for i in clusters.member_idxs(c))
+
+
+def test_rings_match_brute_force(tmp_path):
+    text, image, seller = _artifacts(tmp_path, seed=2)
+    build_clusters(str(tmp_path), workers=1, k=0)
+    build_rings(str(tmp_path), min_pairs=6, min_overlap=0.5)
+    rings = load_rings(str(tmp_path), ring_source(load_clusters(str(tmp_path), cluster_source(str(tmp_path)))))
+
+    ids = list(rings.seller_ids)
+    codes = np.array([ids.index(s) for s in seller])
+    counts = np.bincount(codes, minlength=len(ids))
+    pairs = _accepted_pairs(text, image)
+    shared, overlap = seller_graph(np.array(sorted(pairs)), codes, counts)
+    links = []
+    for s, t in itertools.combinations(range(len(ids)), 2):
+        n_pairs = sum(1 for a, b in pairs if {codes[a], codes[b]} == {s, t})
+        listed = (len({a for a, b in pairs if codes[a] == s and codes[b] == t}
+                      | {b for a, b in pairs if codes[b] == s and codes[a] == t})
+                  + len({a for a, b in pairs if codes[a] == t and codes[b] == s}
+                        | {b for a, b in pairs if codes[b] == t and codes[a] == s}))
+        assert shared[s, t] == shared[t, s] == n_pairs
+        assert overlap[s, t] == pytest.approx(listed / (counts[s] + counts[t]))
+        if n_pairs >= 6 and listed / (counts[s] + counts[t]) >= 0.5:
+            links.append((s, t))
+    expected = _components(len(ids), links)
+    got = {frozenset(np.flatnonzero(np.asarray(rings.ring_ids) == r).tolist()) for r in range(rings.info['rings'])}
+    assert len(expected) > 1 and got == expected
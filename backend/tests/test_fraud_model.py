@@ -0,0 +1,79 @@
+"""Vectorized seller features and duplicate pairs must match a brute-force pass over every pair."""
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('sklearn')
+
+from app import fraud_model
+from app.embeddings import EmbeddingMatrix
+from app.meta_store import MetaStore
+
+N = 60
+
+
+def _catalog(seed=0):
+    rng = np.random.default_rng(seed)
+    sellers = rng.choice([f's{i}' for i in range(8)], size=N)
+    sellers[:2] = ['solo', 's0']  # a single-listing seller has no pairs
+    meta = MetaStore.from_frame(pd.DataFrame({
+        'seller_id': sellers,
+        'title': rng.choice(['Red Mug', 'red mug ', 'Blue Tee', 'lamp', 'LAMP'], size=N),
+        'label_group': rng.integers(0, 4, size=N),
+    }))
+    text = EmbeddingMatrix(rng.normal(size=(N, 12)).astype(np.float32))
+    image = EmbeddingMatrix(rng.normal(size=(N, 10)).astype(np.float32))
+    for m in (text, image):
+        m.prepare_norms()
+    return meta, text, image
+
+
+def _unit(x):
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def test_seller_features_match_brute_force():
+    meta, text, image = _catalog()
+    fraud = fraud_model.build_fraud_model(meta, text, image)
+    df = fraud['features_df'].set_index('seller_id')
+    frame = pd.DataFrame({c: meta.column(c) for c in ('seller_id', 'title', 'label_group')})
+    for sid, rows in frame.groupby('seller_id').groups.items():
+        rows = np.asarray(rows)
+        got = df.loc[sid]
+        assert got['count'] == len(rows)
+        for name, m in (('mean_text_sim', text), ('mean_image_sim', image)):
+            u = _unit(m[rows])
+            sims = [u[i] @ u[j] for i, j in itertools.permutations(range(len(rows)), 2)]
+            expected = np.mean(sims) if sims else np.nan
+            assert got[name] == pytest.approx(expected, abs=1e-5, nan_ok=True)
+        p = frame.loc[rows, 'label_group'].value_counts(normalize=True).to_numpy()
+        assert got['label_entropy'] == pytest.approx(-(p * np.log(p)).sum(), abs=1e-6)
+        titles = frame.loc[rows, 'title'].str.strip().str.lower()
+        assert got['unique_title_ratio'] == pytest.approx(titles.nunique() / len(rows))
+
+
+def test_seller_sums_carry_sellers_across_blocks():
+    meta, text, _ = _catalog(1)
+    _, counts, order, _ = fraud_model.seller_codes(meta)
+    sums, pairs = fraud_model._seller_sums(text, order, counts, block=7)  # most sellers straddle blocks
+    start = 0
+    for s, c in enumerate(counts):
+        rows = order[start:start + c]
+        start += c
+        np.testing.assert_allclose(sums[s], text[rows].sum(axis=0), rtol=1e-5, atol=1e-5)
+        u = _unit(text[rows])
+        assert pairs[s] == pytest.approx(sum(u[i] @ u[j] for i, j in itertools.permutations(range(c), 2)), abs=1e-4)
+
+
+@pytest.mark.parametrize('use', ['fused', 'text', 'image'])
+def test_seller_duplicate_pairs_match_brute_force(use):
+    _, text, image = _catalog(2)
+    idxs = np.arange(3, 40)
+    found = fraud_model.seller_duplicate_pairs(idxs, text, image, alpha=0.3, use=use, threshold=0.1, top=12, block=8)
+    t, i = _unit(text[np.arange(N)]), _unit(image[np.arange(N)])
+    score = {'text': t @ t.T, 'image': i @ i.T, 'fused': 0.3 * (i @ i.T) + 0.7 * (t @ t.T)}[use]
+    brute = sorted(((-score[a, b], a, b) for a, b in itertools.combinations(idxs, 2) if score[a, b] >= 0.1))[:12]
+    assert list(zip(found['a'], found['b'])) == [(a, b) for _, a, b in brute]
+    np.testing.assert_allclose(found['score'], [-s for s, _, _ in brute], atol=1e-5)
@@ -0,0 +1,38 @@
+"""Artifact generations keep the loader's object, so in-place updates stay visible."""
+import contextlib
+
+import pytest
+
+from app.generations import ArtifactGenerations, Artifacts, ArtifactView, ReloadError
+
+
+def test_loader_artifacts_are_served_without_copying():
+    loaded = []
+
+    def loader():
+        art = Artifacts({'image_keys': [None]})
+        loaded.append(art)
+        return art
+
+    generations = ArtifactGenerations(loader)
+    generations.load_initial()
+    view = ArtifactView(generations)
+    loaded[0]['image_keys'] = [None, 'catalog_images/a.jpg']  # e.g. Catalog._apply_add
+    assert view['image_keys'] == [None, 'catalog_images/a.jpg']
+    assert generations.reload('test')['generation'] == 2
+    assert generations.current is loaded[1]
+
+
+def test_failing_swap_guard_keeps_the_serving_generation():
+    generations = ArtifactGenerations(lambda: Artifacts())
+    first = generations.load_initial()
+
+    @contextlib.contextmanager
+    def guard(new, old):
+        assert old is first and new is not first
+        raise RuntimeError('catch-up failed')
+        yield
+
+    with pytest.raises(ReloadError, match='catch-up failed'):
+        generations.reload('test', swap_guard=guard)
+    assert generations.current is first